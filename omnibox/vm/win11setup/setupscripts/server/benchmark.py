@@ -0,0 +1,385 @@
+"""
+Small latency benchmarks for the VM server (main.py).
+
+Run against a live server, e.g.:
+    python benchmark.py --url http://localhost:5000 input --iterations 50
+
+The capture benchmark runs in-process on the machine being captured:
+    python benchmark.py capture --duration 5
+
+The load benchmark compares serving modes; run it once per server started as
+    python main.py --server waitress
+    python main.py --server flask --debug   (the previous default)
+and compare throughput and p99:
+    python benchmark.py load --concurrency 16 --duration 20
+
+The search benchmark runs in-process on a generated log file:
+    python benchmark.py search --size-mb 200 --regex "ERROR .* id=42"
+
+The payload benchmark compares response sizes and latencies of an endpoint
+with and without compression and compact mode:
+    python benchmark.py payload --path /file/find_in_content --body '{"file": "C:\\\\big.log", "regex": "INFO"}'
+
+The find benchmark walks a directory tree in-process, e.g.:
+    python benchmark.py find --path C:\\Users --glob "**/*.txt"
+"""
+import argparse
+import glob as glob_module
+import http.client
+import json
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+
+def post_json(url, payload, timeout=180):
+    body = json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def timed(fn, iterations):
+    """Calls fn() `iterations` times and returns the latencies in milliseconds."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def report(label, samples):
+    print(f"{label:<28} n={len(samples):<5} mean={statistics.mean(samples):8.1f} ms  "
+          f"p50={percentile(samples, 50):8.1f} ms  p95={percentile(samples, 95):8.1f} ms  "
+          f"p99={percentile(samples, 99):8.1f} ms")
+
+
+def bench_input(args):
+    """Per-action latency of /execute (python -c "import pyautogui...") against /input."""
+    x, y = args.x, args.y
+    execute_code = f"import pyautogui; pyautogui.FAILSAFE=False; pyautogui.moveTo(x={x}, y={y})"
+
+    def via_execute():
+        post_json(f"{args.url}/execute", {'command': ['python', '-c', execute_code]})
+
+    def via_input():
+        post_json(f"{args.url}/input", {'action': 'moveTo', 'x': x, 'y': y})
+
+    def via_input_batch():
+        post_json(f"{args.url}/input", {'actions': [{'action': 'moveTo', 'x': x, 'y': y}] * 10})
+
+    report("/execute python -c", timed(via_execute, args.iterations))
+    report("/input (1 action)", timed(via_input, args.iterations))
+    batch = timed(via_input_batch, args.iterations)
+    report("/input (10 actions) / 10", [s / 10 for s in batch])
+
+
+def bench_capture(args):
+    """Frames per second and CPU usage of each available capture backend."""
+    import capture
+    cursor_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cursor.png")
+    for name in args.backends:
+        try:
+            backend = capture.create_backend(name)
+        except Exception as e:
+            print(f"{name:<12} unavailable: {e}")
+            continue
+        try:
+            result = capture.measure_backend(backend, duration=args.duration,
+                                             with_cursor=args.cursor, cursor_path=cursor_path)
+        except Exception as e:
+            # e.g. mss without a display: the connection is only opened by the first grab
+            print(f"{name:<12} failed: {e}")
+            continue
+        finally:
+            backend.close()
+        print(f"{result['backend']:<12} frames={result['frames']:<6} fps={result['fps']:7.1f}  "
+              f"cpu={result['cpu_percent']:6.1f}%  cpu/frame={result['cpu_ms_per_frame']:6.2f} ms")
+
+
+# Mix of requests the Node controller sends while a task runs
+LOAD_REQUESTS = {
+    'screenshot': ('GET', '/screenshot?format=jpeg&quality=70&scale=0.5', None),
+    'job': ('GET', '/jobs/stats', None),
+    'execute': ('POST', '/execute', {'command': ['python', '-c', 'pass'], 'gui': False, 'record': 'none'}),
+    'input': ('POST', '/input', {'action': 'sleep', 'seconds': 0}),
+}
+
+
+def bench_load(args):
+    """Throughput and latency of a mix of requests sent by concurrent clients."""
+    url = urllib.parse.urlsplit(args.url)
+    requests_mix = [LOAD_REQUESTS[name] for name in args.requests]
+    samples = {name: [] for name in args.requests}
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def client(index):
+        connection = None
+        sent = index
+        while time.perf_counter() < deadline:
+            name = args.requests[sent % len(args.requests)]
+            method, path, payload = requests_mix[sent % len(requests_mix)]
+            sent += 1
+            if connection is None:
+                connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=180)
+            body = json.dumps(payload).encode('utf-8') if payload is not None else None
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            if not args.keep_alive:
+                headers['Connection'] = 'close'
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    if response.status >= 400:
+                        errors.append(f"{name}: HTTP {response.status}")
+                    else:
+                        samples[name].append(elapsed)
+                if not args.keep_alive or response.will_close:
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException) as e:
+                with lock:
+                    errors.append(f"{name}: {e}")
+                connection.close()
+                connection = None
+        if connection is not None:
+            connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    total = sum(len(s) for s in samples.values())
+    print(f"concurrency={args.concurrency} keep_alive={args.keep_alive} duration={wall:.1f} s  "
+          f"throughput={total / wall:.1f} req/s  errors={len(errors)}")
+    for name, name_samples in samples.items():
+        if name_samples:
+            report(name, name_samples)
+    all_samples = [sample for name_samples in samples.values() for sample in name_samples]
+    if all_samples:
+        report("all", all_samples)
+    for error in sorted(set(errors))[:10]:
+        print(f"  {error}")
+
+
+def legacy_find_in_content(path, regex):
+    """The previous /file/find_in_content: whole file in memory, every match with its full line."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        content = f.read()
+    pattern = re.compile(regex)
+    matches = []
+    for line_num, line in enumerate(content.splitlines(), 1):
+        for match in pattern.finditer(line):
+            matches.append({'line': line_num, 'column': match.start() + 1, 'text': match.group(), 'full_line': line})
+    return matches, len(json.dumps(matches, indent=2)) + len(json.dumps(matches))
+
+
+def bench_search(args):
+    """Throughput of file_search.search_file against the previous whole-file search on a generated log."""
+    import file_search
+    path = args.file
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.log')
+        line_count = 0
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            written = 0
+            while written < args.size_mb << 20:
+                level = 'ERROR' if line_count % 97 == 0 else 'INFO'
+                line = f"2026-01-01 12:00:{line_count % 60:02d} {level} worker={line_count % 8} id={line_count % 1000} " \
+                       f"request handled in {line_count % 250} ms{' ' + 'x' * 300 if line_count % 13 == 0 else ''}\r\n"
+                f.write(line)
+                written += len(line)
+                line_count += 1
+    size_mb = os.path.getsize(path) / (1 << 20)
+    try:
+        for max_matches in args.max_matches:
+            stats = {}
+            start = time.perf_counter()
+            records = list(file_search.search_file(path, args.regex, max_matches=max_matches or None,
+                                                   context=args.context, max_line_length=args.max_line_length,
+                                                   stats=stats))
+            elapsed = time.perf_counter() - start
+            print(f"search_file max_matches={max_matches or 'none':<6} matches={stats['matches']:<8} "
+                  f"{elapsed * 1000:9.1f} ms  {stats['bytes'] / (1 << 20) / elapsed:8.1f} MB/s scanned  "
+                  f"response={len(json.dumps(records)) / 1024:10.1f} KB")
+        if args.legacy:
+            start = time.perf_counter()
+            matches, response_size = legacy_find_in_content(path, args.regex)
+            elapsed = time.perf_counter() - start
+            print(f"legacy (whole file)      matches={len(matches):<8} {elapsed * 1000:9.1f} ms  "
+                  f"{size_mb / elapsed:8.1f} MB/s scanned  response={response_size / 1024:10.1f} KB")
+    finally:
+        if args.file is None:
+            os.remove(path)
+
+
+def legacy_find_by_name(path, pattern):
+    """The previous /file/find_by_name: glob.glob, then four filesystem calls per hit."""
+    file_list = []
+    for file_path in glob_module.glob(os.path.join(path, pattern), recursive=True):
+        file_list.append({
+            'path': file_path,
+            'name': os.path.basename(file_path),
+            'size': os.path.getsize(file_path),
+            'is_directory': os.path.isdir(file_path),
+            'created': os.path.getctime(file_path),
+            'modified': os.path.getmtime(file_path)
+        })
+    return file_list, len(json.dumps(file_list, indent=2)) + len(json.dumps(file_list))
+
+
+def bench_find(args):
+    """Time of file_walk.walk against the previous glob-based /file/find_by_name."""
+    import file_walk
+    path = args.path
+    if path is None:
+        path = tempfile.mkdtemp()
+        for i in range(args.directories):
+            directory = os.path.join(path, f"dir{i % 20}", f"sub{i}")
+            os.makedirs(directory, exist_ok=True)
+            for j in range(args.files_per_directory):
+                with open(os.path.join(directory, f"file{j}.{'txt' if j % 4 == 0 else 'dat'}"), 'w') as f:
+                    f.write('x' * j)
+    try:
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            entries, response_size = legacy_find_by_name(path, args.glob)
+            elapsed = time.perf_counter() - start
+            print(f"legacy glob + 4 stats  entries={len(entries):<8} {elapsed * 1000:9.1f} ms  "
+                  f"response={response_size / 1024:10.1f} KB")
+
+            stats = {}
+            start = time.perf_counter()
+            entries = [info for _, info in file_walk.walk(path, args.glob, stats=stats)]
+            elapsed = time.perf_counter() - start
+            print(f"scandir walk           entries={len(entries):<8} {elapsed * 1000:9.1f} ms  "
+                  f"response={len(json.dumps(entries)) / 1024:10.1f} KB  directories={stats['directories']}")
+
+            start = time.perf_counter()
+            page = []
+            for _, info in file_walk.walk(path, args.glob):
+                page.append(info)
+                if len(page) == args.limit:
+                    break
+            elapsed = time.perf_counter() - start
+            print(f"scandir first page     entries={len(page):<8} {elapsed * 1000:9.1f} ms")
+    finally:
+        if args.path is None:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+PAYLOAD_MODES = {
+    'plain': ({'Accept-Encoding': 'identity'}, False),
+    'compact': ({'Accept-Encoding': 'identity'}, True),
+    'gzip': ({'Accept-Encoding': 'gzip'}, False),
+    'compact+gzip': ({'Accept-Encoding': 'gzip'}, True),
+    'compact+zstd': ({'Accept-Encoding': 'zstd'}, True),
+}
+
+
+def bench_payload(args):
+    """Bytes on the wire and latency of one endpoint per compression / compact mode."""
+    url = urllib.parse.urlsplit(args.url)
+    body = json.loads(args.body) if args.body else None
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=180)
+    try:
+        for mode, (headers, compact) in PAYLOAD_MODES.items():
+            path = args.path + ('&' if '?' in args.path else '?') + f"compact={int(compact)}"
+            payload = json.dumps(body).encode('utf-8') if body is not None else None
+            request_headers = dict(headers, **({'Content-Type': 'application/json'} if payload else {}))
+            sizes = []
+
+            def call():
+                connection.request('POST' if payload else 'GET', path, body=payload, headers=request_headers)
+                response = connection.getresponse()
+                data = response.read()
+                sizes.append((len(data), response.getheader('Content-Encoding') or 'identity'))
+
+            samples = timed(call, args.iterations)
+            size, encoding = sizes[-1]
+            report(f"{mode} ({encoding}, {size / 1024:.1f} KB)", samples)
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="server base url", type=str, default="http://localhost:5000")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    input_parser = subparsers.add_parser("input", help="per-action latency of /input against /execute")
+    input_parser.add_argument("--iterations", type=int, default=20)
+    input_parser.add_argument("--x", type=int, default=100)
+    input_parser.add_argument("--y", type=int, default=100)
+    input_parser.set_defaults(func=bench_input)
+
+    capture_parser = subparsers.add_parser("capture", help="fps and CPU usage per capture backend")
+    capture_parser.add_argument("--duration", type=float, default=5.0)
+    capture_parser.add_argument("--backends", nargs="+", default=["mss", "pyautogui", "fake"])
+    capture_parser.add_argument("--cursor", action="store_true", help="draw the cursor on every frame")
+    capture_parser.set_defaults(func=bench_capture)
+
+    load_parser = subparsers.add_parser("load", help="throughput and p99 latency under concurrent clients")
+    load_parser.add_argument("--concurrency", type=int, default=16)
+    load_parser.add_argument("--duration", type=float, default=20.0)
+    load_parser.add_argument("--requests", nargs="+", choices=list(LOAD_REQUESTS), default=list(LOAD_REQUESTS))
+    load_parser.add_argument("--no-keep-alive", dest="keep_alive", action="store_false",
+                             help="open a new connection for every request")
+    load_parser.set_defaults(func=bench_load)
+
+    search_parser = subparsers.add_parser("search", help="throughput of /file/find_in_content on a large file")
+    search_parser.add_argument("--file", help="file to search (default: a generated log)", type=str, default=None)
+    search_parser.add_argument("--size-mb", type=int, default=200, help="size of the generated log")
+    search_parser.add_argument("--regex", type=str, default=r"ERROR .* id=4\d\b")
+    search_parser.add_argument("--max-matches", type=int, nargs="+", default=[0, 1000],
+                               help="match limits to compare (0 for no limit)")
+    search_parser.add_argument("--context", type=int, default=0)
+    search_parser.add_argument("--max-line-length", type=int, default=500)
+    search_parser.add_argument("--no-legacy", dest="legacy", action="store_false",
+                               help="skip the previous whole-file search")
+    search_parser.set_defaults(func=bench_search)
+
+    payload_parser = subparsers.add_parser("payload", help="response size and latency per compression mode")
+    payload_parser.add_argument("--path", type=str, default="/jobs/stats", help="endpoint path, with its query string")
+    payload_parser.add_argument("--body", type=str, default=None, help="JSON body (POST), GET without")
+    payload_parser.add_argument("--iterations", type=int, default=10)
+    payload_parser.set_defaults(func=bench_payload)
+
+    find_parser = subparsers.add_parser("find", help="time of /file/find_by_name on a directory tree")
+    find_parser.add_argument("--path", help="directory to walk (default: a generated tree)", type=str, default=None)
+    find_parser.add_argument("--glob", type=str, default="**/*.txt")
+    find_parser.add_argument("--directories", type=int, default=2000, help="directories of the generated tree")
+    find_parser.add_argument("--files-per-directory", type=int, default=20)
+    find_parser.add_argument("--limit", type=int, default=1000, help="page size of the first-page measurement")
+    find_parser.add_argument("--iterations", type=int, default=2)
+    find_parser.set_defaults(func=bench_find)
+
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""
+Screen capture backends shared by the screen recorder and /screenshot.
+
+Every backend hands out BGR numpy frames (the format cv2 expects), written
+into the caller's `out` buffer when it has the screen's shape: the recorder
+grabs into its own pool of buffers, so steady-state capture does not allocate
+a new full-screen image for every frame. Without `out` a new array is
+returned, which the caller owns; nothing is kept per request thread.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    import mss
+except ImportError:  # mss is optional, pyautogui is used as a fallback
+    mss = None
+
+
+class CaptureBackend:
+    """Base class for capture backends."""
+    name = "base"
+
+    def _buffer(self, height, width, channels=3, out=None):
+        """Returns `out` if it has the frame's shape, else a new frame array."""
+        if out is not None and out.shape == (height, width, channels):
+            return out
+        return np.empty((height, width, channels), dtype=np.uint8)
+
+    def size(self):
+        """Returns the screen size as (width, height)."""
+        raise NotImplementedError
+
+    def grab(self, out=None):
+        """
+        Returns the current screen as a BGR uint8 array of shape (height, width, 3),
+        written into `out` if it has that shape.
+        """
+        raise NotImplementedError
+
+    def cursor_position(self):
+        import pyautogui
+        return pyautogui.position()
+
+    def close(self):
+        pass
+
+
+class PyAutoGUIBackend(CaptureBackend):
+    """Captures through pyautogui.screenshot(). Slowest, but available everywhere pyautogui runs."""
+    name = "pyautogui"
+
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+
+    def size(self):
+        width, height = self._pyautogui.size()
+        return int(width), int(height)
+
+    def grab(self, out=None):
+        rgb = np.asarray(self._pyautogui.screenshot())
+        frame = self._buffer(rgb.shape[0], rgb.shape[1], out=out)
+        cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR, dst=frame)
+        return frame
+
+
+class MSSBackend(CaptureBackend):
+    """Captures with mss (GDI BitBlt on Windows, XGetImage/XShm on X11, works on Xvfb)."""
+    name = "mss"
+
+    def __init__(self, monitor=1):
+        if mss is None:
+            raise RuntimeError("mss is not installed")
+        self._monitor_index = monitor
+        # mss handles must be used from the thread that created them: a single handle lives on
+        # one capture thread, instead of one handle per request thread that ever grabbed
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mss-capture')
+        self._sct = None
+
+    def _call(self, fn, *fn_args):
+        return self._executor.submit(fn, *fn_args).result()
+
+    def _monitor(self):
+        if self._sct is None:
+            self._sct = mss.mss()
+        return self._sct.monitors[self._monitor_index]
+
+    def _size(self):
+        monitor = self._monitor()
+        return monitor['width'], monitor['height']
+
+    def size(self):
+        return self._call(self._size)
+
+    def _grab(self, out):
+        monitor = self._monitor()
+        shot = self._sct.grab(monitor)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        frame = self._buffer(shot.height, shot.width, out=out)
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=frame)
+        return frame
+
+    def grab(self, out=None):
+        return self._call(self._grab, out)
+
+    def _close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+    def close(self):
+        self._call(self._close)
+        self._executor.shutdown()
+
+
+class FakeBackend(CaptureBackend):
+    """
+    Synthetic screen for tests and benchmarks on machines without a display:
+    a static background with a small square that moves every `change_every` frames.
+    """
+    name = "fake"
+
+    def __init__(self, width=1280, height=720, change_every=10):
+        self._width = width
+        self._height = height
+        self._change_every = max(1, change_every)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def size(self):
+        return self._width, self._height
+
+    def grab(self, out=None):
+        with self._lock:
+            self._counter += 1
+            step = self._counter // self._change_every
+        frame = self._buffer(self._height, self._width, out=out)
+        frame[:] = 48
+        x = (step * 16) % max(1, self._width - 64)
+        y = (step * 8) % max(1, self._height - 64)
+        frame[y:y + 64, x:x + 64] = (40, 160, 240)
+        return frame
+
+    def cursor_position(self):
+        return self._width // 2, self._height // 2
+
+
+BACKENDS = {
+    'mss': MSSBackend,
+    'pyautogui': PyAutoGUIBackend,
+    'fake': FakeBackend,
+}
+
+
+def create_backend(name='auto'):
+    """Creates a capture backend by name. 'auto' prefers mss and falls back to pyautogui."""
+    if name == 'auto':
+        name = 'mss' if mss is not None else 'pyautogui'
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown capture backend: {name}")
+    return BACKENDS[name]()
+
+
+class CursorOverlay:
+    """Cursor sprite loaded and scaled once, alpha-blended in place onto BGR frames."""
+
+    def __init__(self, cursor_path, scale=1 / 1.5):
+        sprite = cv2.imread(cursor_path, cv2.IMREAD_UNCHANGED)
+        if sprite is None:
+            raise FileNotFoundError(cursor_path)
+        if sprite.ndim == 2 or sprite.shape[2] == 3:
+            sprite = cv2.cvtColor(sprite, cv2.COLOR_GRAY2BGRA if sprite.ndim == 2 else cv2.COLOR_BGR2BGRA)
+        width = max(1, int(sprite.shape[1] * scale))
+        height = max(1, int(sprite.shape[0] * scale))
+        sprite = cv2.resize(sprite, (width, height), interpolation=cv2.INTER_AREA)
+        self.bgr = sprite[:, :, :3].astype(np.float32)
+        self.alpha = (sprite[:, :, 3:4].astype(np.float32)) / 255.0
+
+    def draw(self, frame, x, y):
+        """Draws the cursor with its top-left corner at (x, y), clipped to the frame."""
+        frame_height, frame_width = frame.shape[:2]
+        sprite_height, sprite_width = self.alpha.shape[:2]
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(frame_width, x + sprite_width), min(frame_height, y + sprite_height)
+        if x0 >= x1 or y0 >= y1:
+            return frame
+        sx0, sy0 = x0 - x, y0 - y
+        sx1, sy1 = sx0 + (x1 - x0), sy0 + (y1 - y0)
+        alpha = self.alpha[sy0:sy1, sx0:sx1]
+        roi = frame[y0:y1, x0:x1]
+        blended = self.bgr[sy0:sy1, sx0:sx1] * alpha + roi * (1.0 - alpha)
+        roi[:] = blended.astype(np.uint8)
+        return frame
+
+
+class ScreenGrabber:
+    """Long-lived grabber combining a capture backend and the cursor overlay."""
+
+    def __init__(self, backend, cursor_path=None):
+        self.backend = backend
+        self.cursor = CursorOverlay(cursor_path) if cursor_path and os.path.exists(cursor_path) else None
+
+    def size(self):
+        return self.backend.size()
+
+    def grab(self, with_cursor=True, out=None):
+        frame = self.backend.grab(out)
+        if with_cursor and self.cursor is not None:
+            cursor_x, cursor_y = self.backend.cursor_position()
+            self.cursor.draw(frame, int(cursor_x), int(cursor_y))
+        return frame
+
+    def close(self):
+        self.backend.close()
+
+
+class TileHistory:
+    """
+    Keeps the tile hashes of the last `size` frames (not the frames themselves)
+    so that the tiles changed since an earlier frame can be found by comparing
+    hashes. The hashes are 64-bit BLAKE2b digests: with a 32-bit checksum,
+    the thousands of tiles compared per frame would let a changed tile go
+    unnoticed every few hundred thousand frames.
+    """
+
+    def __init__(self, tile_size=64, size=8):
+        self.tile_size = tile_size
+        self.size = size
+        self._frames = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _hashes(self, frame):
+        tile = self.tile_size
+        height, width = frame.shape[:2]
+        return [[hashlib.blake2b(np.ascontiguousarray(frame[y:y + tile, x:x + tile]), digest_size=8).digest()
+                 for x in range(0, width, tile)]
+                for y in range(0, height, tile)]
+
+    def add(self, frame):
+        """Registers a frame and returns its id."""
+        hashes = self._hashes(frame)
+        with self._lock:
+            frame_id = self._next_id
+            self._next_id += 1
+            self._frames[frame_id] = (frame.shape, hashes)
+            while len(self._frames) > self.size:
+                self._frames.popitem(last=False)
+        return frame_id
+
+    def changed_regions(self, since_id, frame_id):
+        """
+        Returns the (x, y, width, height) rectangles that changed between two
+        frames, merging changed tiles that follow each other on a row. Returns
+        None if either frame was evicted or the screen size changed.
+        """
+        with self._lock:
+            before = self._frames.get(since_id)
+            after = self._frames.get(frame_id)
+        if before is None or after is None or before[0] != after[0]:
+            return None
+        (height, width), tile = after[0][:2], self.tile_size
+        regions = []
+        for row, (old_row, new_row) in enumerate(zip(before[1], after[1])):
+            y = row * tile
+            run_start = None
+            for column, (old, new) in enumerate(zip(old_row, new_row)):
+                if old != new and run_start is None:
+                    run_start = column
+                elif old == new and run_start is not None:
+                    regions.append(self._region(run_start, column, y, width, height))
+                    run_start = None
+            if run_start is not None:
+                regions.append(self._region(run_start, len(new_row), y, width, height))
+        return regions
+
+    def _region(self, first_column, end_column, y, width, height):
+        x = first_column * self.tile_size
+        return x, y, min(width, end_column * self.tile_size) - x, min(height, y + self.tile_size) - y
+
+
+def measure_backend(backend, duration=5.0, with_cursor=False, cursor_path=None):
+    """
+    Grabs frames as fast as possible for `duration` seconds, into one reused
+    buffer like the recorder, and returns fps and CPU usage (of the whole
+    process, so including mss's capture thread).
+    """
+    grabber = ScreenGrabber(backend, cursor_path if with_cursor else None)
+    frames = 0
+    frame = None
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    while time.perf_counter() - wall_start < duration:
+        frame = grabber.grab(with_cursor=with_cursor, out=frame)
+        frames += 1
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return {
+        'backend': backend.name,
+        'frames': frames,
+        'fps': frames / wall,
+        'cpu_percent': 100.0 * cpu / wall,
+        'cpu_ms_per_frame': 1000.0 * cpu / max(1, frames),
+    }
@@ -0,0 +1,69 @@
+"""
+Scheduler for the /execute commands.
+
+GUI commands drive the mouse and keyboard, so they run one at a time while
+holding the lock shared with /input. Headless commands only need a process,
+so they run in parallel. The number of commands waiting for a worker is
+capped: a full queue is reported to the client instead of piling up work.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CommandScheduler:
+    """
+    Runs /execute commands. GUI commands are exclusive: they run one at a time
+    and hold computer_control_lock, like /input. Headless commands run in
+    parallel on up to `max_workers` threads. At most `max_queue` commands may
+    wait for a worker; beyond that submit() returns None.
+    """
+
+    def __init__(self, gui_lock, max_workers, max_queue):
+        self.gui_lock = gui_lock
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executors = {
+            'gui': ThreadPoolExecutor(max_workers=1, thread_name_prefix='execute-gui'),
+            'headless': ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='execute-headless')
+        }
+        self._lock = threading.Lock()
+        self._queued = {'gui': 0, 'headless': 0}
+        self._running = {'gui': 0, 'headless': 0}
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, gui, fn, *fn_args):
+        """Queues fn(*fn_args) and returns its Future, or None if the queue is full."""
+        lane = 'gui' if gui else 'headless'
+        with self._lock:
+            if sum(self._queued.values()) >= self.max_queue:
+                self.rejected += 1
+                return None
+            self._queued[lane] += 1
+        return self._executors[lane].submit(self._run, lane, fn, fn_args)
+
+    def _run(self, lane, fn, fn_args):
+        with self._lock:
+            self._queued[lane] -= 1
+            self._running[lane] += 1
+        try:
+            if lane == 'gui':
+                with self.gui_lock:
+                    return fn(*fn_args)
+            return fn(*fn_args)
+        finally:
+            with self._lock:
+                self._running[lane] -= 1
+                self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': dict(self._queued),
+                'running': dict(self._running),
+                'queue_depth': sum(self._queued.values()),
+                'max_queue': self.max_queue,
+                'max_workers': self.max_workers,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
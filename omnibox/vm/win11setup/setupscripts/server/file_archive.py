@@ -0,0 +1,241 @@
+"""
+Streamed directory archives used by /file/archive and /file/extract.
+
+iter_archive() writes a tar (optionally gzip-compressed) or zip archive of a
+directory on a background thread into a small bounded queue, and yields the
+bytes as they are produced: no temporary file, and at most a few blocks of
+the archive in memory however large the files are. Files are selected like
+/file/search (include/exclude globs, see file_search.iter_tree_files), with
+no size limit unless one is given; empty directories are kept unless include
+globs are given. The response headers are sent before the files are read, so
+files left out (over the size limit, or unreadable) are listed in a last
+entry of the archive, SKIPPED_LIST, one '<relative path>\t<reason>' per
+line; it is only added when there are some.
+
+extract_archive() does the reverse from a request stream. Tar archives are
+read sequentially; zip archives need their central directory, at the end of
+the file, so they are spooled to a temporary file first. Members that would
+land outside the destination (absolute paths, '..', links pointing out) are
+rejected.
+"""
+import io
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+import file_search
+
+BLOCK_SIZE = 256 * 1024
+SKIPPED_LIST = '.skipped_files.txt'
+
+FORMATS = {
+    # (format, compress) -> (mimetype, file extension)
+    ('tar', False): ('application/x-tar', '.tar'),
+    ('tar', True): ('application/gzip', '.tar.gz'),
+    ('zip', False): ('application/zip', '.zip'),
+    ('zip', True): ('application/zip', '.zip'),
+}
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    """Write-only file object handing BLOCK_SIZE blocks to a bounded queue."""
+
+    def __init__(self, blocks, cancelled):
+        self.blocks = blocks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+        self.position = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= BLOCK_SIZE:
+            self.flush()
+        return len(data)
+
+    def tell(self):
+        # No seek(): zipfile then writes data descriptors instead of rewriting headers
+        return self.position
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise _Cancelled()
+            try:
+                self.blocks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def _skipped_list(skipped):
+    return ''.join(f"{path}\t{reason}\n" for path, reason in skipped).encode('utf-8')
+
+
+def _write_tar(root, files, out, compress, on_error, skipped):
+    with tarfile.open(fileobj=out, mode='w|gz' if compress else 'w|', format=tarfile.PAX_FORMAT) as tar:
+        for path in files:
+            try:
+                tar.add(path, arcname=_relative(path, root), recursive=False)
+            except OSError as e:
+                on_error(path, e)
+        if skipped:
+            data = _skipped_list(skipped)
+            info = tarfile.TarInfo(SKIPPED_LIST)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+
+
+def _write_zip(root, files, out, compress, on_error, skipped):
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(out, 'w', compression=compression) as archive:
+        for path in files:
+            try:
+                if path.endswith(os.sep):
+                    # Empty directory: from_file() adds the trailing '/' of the entry name
+                    archive.writestr(zipfile.ZipInfo.from_file(path, _relative(path, root)), b'')
+                    continue
+                with open(path, 'rb') as source:
+                    info = zipfile.ZipInfo.from_file(path, _relative(path, root))
+                    info.compress_type = compression
+                    with archive.open(info, 'w', force_zip64=True) as target:
+                        shutil.copyfileobj(source, target, BLOCK_SIZE)
+            except OSError as e:
+                on_error(path, e)
+        if skipped:
+            archive.writestr(SKIPPED_LIST, _skipped_list(skipped))
+
+
+def _relative(path, root):
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def iter_archive(root, archive_format='tar', compress=False, include=None, exclude=None, max_file_size=None,
+                 on_error=None, stats=None):
+    """
+    Yields the bytes of an archive of the files under `root`, and of its
+    empty directories when no `include` globs are given. Files over
+    `max_file_size` bytes and files that cannot be read are left out, listed
+    in SKIPPED_LIST, and passed to `on_error(path, reason)`. `stats`, if
+    given, is updated with 'files' (archived), 'directories' (empty ones
+    archived), 'files_skipped' and 'bytes' (archive size) once the archive
+    is complete. Closing the generator early (client gone) stops the writer
+    thread.
+    """
+    if stats is None:
+        stats = {}
+    stats.update(files=0, directories=0, bytes=0)
+    writer = _write_zip if archive_format == 'zip' else _write_tar
+    blocks = queue.Queue(maxsize=8)
+    cancelled = threading.Event()
+    out = _QueueWriter(blocks, cancelled)
+    done = object()
+    failure = []
+    skipped = []
+
+    def left_out(path, reason):
+        skipped.append((_relative(path, root), reason))
+        if on_error is not None:
+            on_error(path, reason)
+
+    def counted_files():
+        for path in file_search.iter_tree_files(root, include, exclude, max_file_size, stats, left_out,
+                                                empty_dirs=True):
+            stats['directories' if path.endswith(os.sep) else 'files'] += 1
+            yield path
+
+    def skip(path, error):
+        stats['directories' if path.endswith(os.sep) else 'files'] -= 1
+        stats['files_skipped'] += 1
+        left_out(path, str(error))
+
+    def produce():
+        try:
+            writer(root, counted_files(), out, compress, skip, skipped)
+            out.flush()
+        except _Cancelled:
+            return
+        except Exception as e:
+            failure.append(e)
+        try:
+            out.put(done)
+        except _Cancelled:
+            pass
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is done:
+                break
+            stats['bytes'] += len(block)
+            yield block
+        if failure:
+            raise failure[0]
+    finally:
+        cancelled.set()
+        thread.join()
+
+
+def _check_member(name, destination):
+    target = os.path.realpath(os.path.join(destination, name))
+    if os.path.commonpath([target, destination]) != destination:
+        raise ValueError(f"Archive member outside of the destination: {name}")
+
+
+def extract_archive(stream, destination, archive_format='tar', stats=None):
+    """
+    Extracts an archive read from `stream` into `destination` (created if
+    needed). The tar format also reads gzip, bz2 and xz compressed tars.
+    `stats`, if given, is updated with 'files' and 'bytes' (extracted sizes).
+    """
+    if stats is None:
+        stats = {}
+    stats.update(files=0, bytes=0)
+    os.makedirs(destination, exist_ok=True)
+    destination = os.path.realpath(destination)
+
+    if archive_format == 'zip':
+        # The central directory is at the end: the stream is spooled to disk first
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(stream, spool, BLOCK_SIZE)
+            spool.seek(0)
+            with zipfile.ZipFile(spool) as archive:
+                for info in archive.infolist():
+                    _check_member(info.filename, destination)
+                    archive.extract(info, destination)
+                    if not info.is_dir():
+                        stats['files'] += 1
+                        stats['bytes'] += info.file_size
+        return stats
+
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            _check_member(member.name, destination)
+            if hasattr(tarfile, 'data_filter'):
+                # Also rejects links leaving the destination and special files
+                archive.extract(member, destination, filter='data')
+            elif member.isfile() or member.isdir():
+                archive.extract(member, destination)
+            else:
+                raise ValueError(f"Unsupported archive member: {member.name}")
+            if member.isfile():
+                stats['files'] += 1
+                stats['bytes'] += member.size
+    return stats
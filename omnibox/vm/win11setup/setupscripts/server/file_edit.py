@@ -0,0 +1,273 @@
+"""
+Multi-edit engine used by /file/str_replace.
+
+All edits of a request are applied in one pass over the memory-mapped file:
+each edit (a literal string or a regex) finds its next match, the earliest
+one is replaced (on a tie, the edit listed first), and the other edits look
+again after it. Edits therefore apply to the original content, never to the
+text inserted by another edit, and matches never overlap.
+
+The result is written to a temporary file in the same directory, which then
+replaces the original with os.replace(): the file is either fully edited or
+untouched, never truncated. Nothing is written when there is nothing to
+replace, when an edit's expected count does not match, or in dry-run mode.
+
+Literal edits match the UTF-8 bytes of the mapped file. Regexes match
+characters ('.' or '[^x]' must not stop in the middle of 'é'), so a request
+with a regex edit is applied to the decoded text instead, all of it read in
+memory; bytes that are not valid UTF-8 are kept as they are. In a file with
+'\\r\\n' line endings, the '\\n' of literal strings stand for '\\r\\n'
+(regexes can use '\\r?\\n'). Diffs list the changed lines as hunks:
+    @@ -12,1 +12,2 @@
+    -old line
+    +new line
+    +inserted line
+"""
+import mmap
+import os
+import re
+import shutil
+import tempfile
+
+COPY_CHUNK = 1 << 20
+
+
+class Edit:
+    """One replacement: a literal `old` string or a `regex`, and the expected number of matches (or None)."""
+
+    def __init__(self, new, old=None, regex=None, count=None, crlf=False):
+        if regex is not None:
+            self.is_regex = True
+            self.source = regex
+        else:
+            if not old:
+                raise ValueError("old_str must not be empty")
+            old, new = (_to_crlf(old), _to_crlf(new)) if crlf else (old, new)
+            self.is_regex = False
+            self.source = re.escape(old)
+        self.new = new
+        self.expected = count
+        self.occurrences = 0
+        self.compile(text=self.is_regex)
+
+    def compile(self, text):
+        """Matches str (`text`) or UTF-8 bytes."""
+        self.pattern = re.compile(self.source if text else self.source.encode('utf-8'))
+        self.template = self.new if text else self.new.encode('utf-8')
+
+    def replacement(self, match):
+        if not self.is_regex:
+            return self.template
+        return match.expand(self.template)
+
+
+def _to_crlf(text):
+    return text.replace('\r\n', '\n').replace('\n', '\r\n')
+
+
+def parse_edits(specs, crlf=False):
+    """
+    Edits from request dicts: {"old_str": ..., "new_str": ...} or
+    {"regex": ..., "new_str": ...} (with \\1 or \\g<name> group references),
+    each with an optional expected "count".
+    """
+    edits = []
+    for spec in specs:
+        count = spec.get('count')
+        edits.append(Edit(spec.get('new_str', ''), old=spec.get('old_str'), regex=spec.get('regex'),
+                          count=None if count is None else int(count), crlf=crlf))
+    return edits
+
+
+def uses_crlf(path, sniff=65536):
+    """Whether the first line ending of the file is '\\r\\n'."""
+    with open(path, 'rb') as f:
+        head = f.read(sniff)
+    newline = head.find(b'\n')
+    return newline > 0 and head[newline - 1:newline] == b'\r'
+
+
+def _encode(data):
+    # The decoded text keeps invalid bytes as lone surrogates: they are written back unchanged
+    return data.encode('utf-8', 'surrogateescape') if isinstance(data, str) else data
+
+
+def _newline(mm):
+    return '\n' if isinstance(mm, str) else b'\n'
+
+
+def _copy(mm, start, end, out):
+    while start < end:
+        chunk_end = min(end, start + COPY_CHUNK)
+        out.write(_encode(mm[start:chunk_end]))
+        start = chunk_end
+
+
+def _count_newlines(mm, start, end):
+    count = 0
+    newline = _newline(mm)
+    while start < end:
+        chunk_end = min(end, start + COPY_CHUNK)
+        count += mm[start:chunk_end].count(newline)
+        start = chunk_end
+    return count
+
+
+def _matches(mm, edits):
+    """Yields (edit, match) in file order, without overlaps (see the module docstring)."""
+    upcoming = [edit.pattern.search(mm) for edit in edits]
+    while True:
+        best = None
+        for i, match in enumerate(upcoming):
+            if match is not None and (best is None or match.start() < upcoming[best].start()):
+                best = i
+        if best is None:
+            return
+        match = upcoming[best]
+        yield edits[best], match
+        end = match.end()
+        for i, other in enumerate(upcoming):
+            if other is not None and (i == best or other.start() < end):
+                # An empty match must not be found again at the same position
+                start = end + 1 if i == best and match.start() == end else end
+                upcoming[i] = edits[i].pattern.search(mm, start) if start <= len(mm) else None
+
+
+def _lines(data):
+    text = _encode(data).decode('utf-8', errors='replace')
+    return [line[:-1] if line.endswith('\r') else line for line in text.split('\n')]
+
+
+class _Diff:
+    """Collects the hunks of changed lines while the edits are applied."""
+
+    def __init__(self, mm, max_hunks):
+        self.mm = mm
+        self.max_hunks = max_hunks
+        self.hunks = []
+        self.truncated = False
+        self.current = None
+        self.line = 1
+        self.counted = 0
+        self.line_delta = 0
+
+    def add(self, start, end, replacement):
+        mm = self.mm
+        line_start = mm.rfind(_newline(mm), 0, start) + 1
+        if self.current is not None and line_start <= self.current['end']:
+            # Another match on a line of the current hunk
+            self.current['replacements'].append((start, end, replacement))
+            self.current['end'] = max(self.current['end'], self._line_end(start, end, replacement))
+            return
+        self._close()
+        if len(self.hunks) >= self.max_hunks:
+            self.truncated = True
+            return
+        self.line += _count_newlines(mm, self.counted, line_start)
+        self.counted = line_start
+        self.current = {'start': line_start, 'end': self._line_end(start, end, replacement),
+                        'replacements': [(start, end, replacement)]}
+
+    def _line_end(self, start, end, replacement):
+        newline = _newline(self.mm)
+        if end > start and self.mm[end - 1:end] == newline and replacement[-1:] == newline:
+            # Match and replacement both end a line: the next line is left as it is
+            return end - 1
+        line_end = self.mm.find(newline, end)
+        return len(self.mm) if line_end == -1 else line_end
+
+    def _close(self):
+        hunk = self.current
+        if hunk is None:
+            return
+        self.current = None
+        old = self.mm[hunk['start']:hunk['end']]
+        pieces = []
+        position = hunk['start']
+        for start, end, replacement in hunk['replacements']:
+            pieces.append(self.mm[position:start])
+            # Without the line ending the hunk stops before (see _line_end)
+            pieces.append(replacement[:-1] if end > hunk['end'] else replacement)
+            position = end
+        pieces.append(self.mm[position:hunk['end']])
+        new = self.mm[:0].join(pieces)
+        old_lines = _lines(old)
+        new_lines = _lines(new)
+        self.hunks.append(
+            f"@@ -{self.line},{len(old_lines)} +{self.line + self.line_delta},{len(new_lines)} @@\n"
+            + ''.join(f"-{line}\n" for line in old_lines) + ''.join(f"+{line}\n" for line in new_lines))
+        self.line_delta += len(new_lines) - len(old_lines)
+
+    def text(self):
+        self._close()
+        return ''.join(self.hunks)
+
+
+def apply_edits(path, edits, dry_run=False, diff=False, max_hunks=200):
+    """
+    Applies `edits` to the file at `path` (see the module docstring) and sets
+    their `occurrences`. Raises ValueError, leaving the file untouched, when an
+    edit's expected count does not match. Returns a dict with 'written'
+    (False in dry-run mode or without any match) and, with `diff` or
+    `dry_run`, 'diff' and 'diff_truncated'.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = None
+    result = {'written': False}
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            text = any(edit.is_regex for edit in edits)
+            for edit in edits:
+                edit.compile(text)
+            if text:
+                mm = f.read().decode('utf-8', 'surrogateescape')
+            else:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+            try:
+                hunks = _Diff(mm, max_hunks) if diff or dry_run else None
+                out = None
+                if not dry_run:
+                    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp',
+                                                     dir=directory)
+                    out = os.fdopen(fd, 'wb')
+                try:
+                    position = 0
+                    for edit, match in _matches(mm, edits):
+                        replacement = edit.replacement(match)
+                        edit.occurrences += 1
+                        if hunks is not None:
+                            hunks.add(match.start(), match.end(), replacement)
+                        if out is not None:
+                            _copy(mm, position, match.start(), out)
+                            out.write(_encode(replacement))
+                        position = match.end()
+                    if out is not None:
+                        _copy(mm, position, len(mm), out)
+                        out.flush()
+                        os.fsync(out.fileno())
+                finally:
+                    if out is not None:
+                        out.close()
+                if hunks is not None:
+                    result['diff'] = hunks.text()
+                    result['diff_truncated'] = hunks.truncated
+            finally:
+                if isinstance(mm, mmap.mmap):
+                    mm.close()
+
+        mismatched = [f"edit {i}: expected {edit.expected}, found {edit.occurrences}"
+                      for i, edit in enumerate(edits) if edit.expected is not None and edit.expected != edit.occurrences]
+        if mismatched:
+            raise ValueError("Unexpected number of occurrences, file left unchanged (" + "; ".join(mismatched) + ")")
+
+        if temp_path is not None and any(edit.occurrences for edit in edits):
+            # The mapping is closed: the file can be replaced, also on Windows
+            shutil.copymode(path, temp_path)
+            os.replace(temp_path, path)
+            temp_path = None
+            result['written'] = True
+        return result
+    finally:
+        if temp_path is not None:
+            os.remove(temp_path)
@@ -0,0 +1,146 @@
+"""
+Sparse line-offset index used by /file/read to page through large files.
+
+Finding line N of a file normally means reading every line before it. The
+index remembers the byte offset of every `stride`-th line, so reading lines
+[start, end) becomes a seek to the closest indexed line, at most `stride`
+readline() calls, then a read of just the requested bytes. Indexes are built
+with one sequential scan and cached by (path, size, mtime): a file that
+changes gets a new index the next time it is read.
+
+Tail reads do not need an index: they scan backwards from the end of the
+file. Lines are split on b'\\n' (a '\\r\\n' line counts as one line).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SCAN_CHUNK = 1 << 20
+
+
+class LineIndex:
+    """Byte offsets of every `stride`-th line of a file, and its number of lines."""
+
+    def __init__(self, path, stride=1024):
+        self.stride = stride
+        self.offsets = [0]
+        newlines = 0
+        position = 0
+        last_byte = b''
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(SCAN_CHUNK)
+                if not chunk:
+                    break
+                # numpy finds the newlines of a chunk in C instead of one find() per line
+                ends = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+                first = (stride - 1 - newlines % stride) % stride
+                self.offsets.extend((position + ends[first::stride] + 1).tolist())
+                newlines += len(ends)
+                position += len(chunk)
+                last_byte = chunk[-1:]
+        self.size = position
+        # Like readlines(), a last line without a newline still counts
+        self.line_count = newlines + (1 if last_byte and last_byte != b'\n' else 0)
+
+    def line_offset(self, f, line):
+        """Returns the byte offset where `line` starts, using the open binary file `f`."""
+        if line >= self.line_count:
+            return self.size
+        block = line // self.stride
+        f.seek(self.offsets[block])
+        for _ in range(line - block * self.stride):
+            f.readline()
+        return f.tell()
+
+
+class LineIndexCache:
+    """Thread-safe LRU cache of line indexes keyed by path, size and mtime."""
+
+    def __init__(self, max_entries=32, stride=1024):
+        self.max_entries = max_entries
+        self.stride = stride
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._indexes.get(path)
+            if entry is not None and entry[0] == key:
+                self._indexes.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Built outside of the lock: scanning a large file can take a while
+        index = LineIndex(path, self.stride)
+        with self._lock:
+            self._indexes[path] = (key, index)
+            self._indexes.move_to_end(path)
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        return index
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._indexes),
+                'max_entries': self.max_entries,
+                'stride': self.stride,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def tail_offset(f, size, lines, block_size=65536):
+    """Returns the byte offset where the last `lines` lines of the open binary file `f` start."""
+    if lines <= 0:
+        return size
+    position = size
+    f.seek(max(0, size - 1))
+    # The newline ending the last line does not start another line
+    if size and f.read(1) == b'\n':
+        position -= 1
+    found = 0
+    while position > 0:
+        start = max(0, position - block_size)
+        f.seek(start)
+        block = f.read(position - start)
+        end = len(block)
+        while True:
+            index = block.rfind(b'\n', 0, end)
+            if index == -1:
+                break
+            found += 1
+            if found == lines:
+                return start + index + 1
+            end = index
+        position = start
+    return 0
+
+
+def line_range(f, index, start_line=None, end_line=None):
+    """Byte range of lines[start_line:end_line], with Python slice semantics (negative lines count from the end)."""
+    start, end, _ = slice(start_line, end_line).indices(index.line_count)
+    if end <= start:
+        return 0, 0
+    return index.line_offset(f, start), index.line_offset(f, end)
+
+
+def iter_file_range(path, start, end, chunk_size=65536):
+    """Yields the bytes of [start, end) of a file in chunks."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,363 @@
+"""
+Bounded regex search over files, used by /file/find_in_content.
+
+The file is memory-mapped and scanned in chunks of whole lines: the regex
+(compiled with re.MULTILINE, and with \\A and \\Z turned into ^ and $ so
+that they can match at any line of the chunk) runs over each decoded chunk,
+so lines without a match are never split or copied one by one. Each line
+containing a match is then searched again on its own with the regex as
+given, so columns and anchors behave as if every line had been searched
+separately. Scanning stops as soon as `max_matches` matches were found.
+
+Results are yielded per matching line:
+    {'line': 12, 'text': '...', 'matches': [[column, matched text], ...],
+     'before': [...], 'after': [...]}
+with 1-based lines and columns. With `max_line_length`, long lines are cut to
+a window around their first match and 'text_start' gives the column of the
+window's first character.
+
+search_tree() runs the same search over every file of a directory tree on a
+thread pool and yields the records of each file, tagged with its path, as
+soon as that file is done. Threads overlap the disk reads of files that are
+not cached yet; the regex itself holds the GIL.
+"""
+import fnmatch
+import mmap
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+SEARCH_CHUNK = 4 << 20
+
+
+def _clip(text, max_length, around=0):
+    """Cuts text to max_length characters around index `around`. Returns (text, start)."""
+    if not max_length or len(text) <= max_length:
+        return text, 0
+    start = max(0, min(around - max_length // 2, len(text) - max_length))
+    return text[start:start + max_length], start
+
+
+def _chunks(mm, chunk_size, start=0):
+    """Yields (start, end) byte ranges of whole lines covering the mapped file from `start`."""
+    size = len(mm)
+    while start < size:
+        end = min(size, start + chunk_size)
+        if end < size:
+            # Chunks end on a newline so that no line (nor UTF-8 character, nor '\r\n') is split
+            newline = mm.rfind(b'\n', start, end)
+            if newline == -1:
+                newline = mm.find(b'\n', end)
+            end = size if newline == -1 else newline + 1
+        yield start, end
+        start = end
+
+
+def _matching_lines(pattern, scanner, text, position, end):
+    """Yields (line start, line end, line, matches) for the lines of text[position:end] matching the pattern."""
+    while True:
+        candidate = scanner.search(text, position, end)
+        if candidate is None:
+            return
+        line_start = text.rfind('\n', 0, candidate.start()) + 1
+        if line_start >= end:
+            # Empty match after the last newline: not a line
+            return
+        line_end = text.find('\n', candidate.start())
+        if line_end == -1:
+            line_end = len(text)
+        position = line_end + 1
+        line = text[line_start:line_end]
+        hits = list(pattern.finditer(line))
+        # No hit when the chunk-wide match spanned several lines
+        if hits:
+            yield line_start, line_end, line, hits
+        if position >= end:
+            # Last line read (it has no newline if position passed the end): search() would clamp
+            # back to the end and find the same empty match again
+            return
+
+
+def _lines_before(text, line_start, count):
+    """Up to `count` lines of text ending just before index `line_start` (a line start)."""
+    lines = []
+    end = line_start - 1
+    while len(lines) < count and end >= 0:
+        start = text.rfind('\n', 0, end) + 1
+        lines.append(text[start:end])
+        end = start - 1
+    lines.reverse()
+    return lines
+
+
+def _lines_after(text, line_end, count):
+    """Up to `count` lines of text following the newline at index `line_end`."""
+    pieces = text[line_end + 1:].split('\n', count) if line_end < len(text) else []
+    if len(pieces) > count:
+        return pieces[:count]
+    # The last piece follows the last newline: a line only if it is not empty
+    return pieces[:-1] + [p for p in pieces[-1:] if p]
+
+
+def _line_anchors(pattern):
+    """The pattern with \\A and \\Z (outside character classes) replaced by ^ and $."""
+    out = []
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            out.append('^' if escaped == 'A' and not in_class else '$' if escaped == 'Z' and not in_class
+                       else c + escaped)
+            i += 2
+            continue
+        out.append(c)
+        i += 1
+        if c == '[' and not in_class:
+            in_class = True
+            # '^' and a ']' right after the opening bracket belong to the class
+            if pattern.startswith('^', i):
+                out.append('^')
+                i += 1
+            if pattern.startswith(']', i):
+                out.append(']')
+                i += 1
+        elif c == ']' and in_class:
+            in_class = False
+    return ''.join(out)
+
+
+def search_file(path, regex, max_matches=None, context=0, max_line_length=None, stats=None,
+                chunk_size=SEARCH_CHUNK):
+    """
+    Yields the lines of a file matching `regex` (see the module docstring).
+    `stats`, if given, is a dict updated with 'matches', 'lines' (matching
+    lines), 'bytes' scanned and 'truncated' (True if max_matches stopped the
+    search before every match was returned).
+    """
+    pattern = re.compile(regex) if isinstance(regex, str) else regex
+    scanner = re.compile(_line_anchors(pattern.pattern), pattern.flags | re.MULTILINE)
+    if stats is None:
+        stats = {}
+    for key in ('matches', 'lines', 'bytes'):
+        stats.setdefault(key, 0)
+    stats.setdefault('truncated', False)
+    remaining = max_matches if max_matches is not None else -1
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            line_number = 1
+            previous_lines = []
+            for chunk_start, chunk_end in _chunks(mm, chunk_size):
+                # Windows line endings become '\n' so that '$' matches at the end of every line
+                text = mm[chunk_start:chunk_end].decode('utf-8', errors='replace').replace('\r\n', '\n')
+                scan_end = len(text)
+                if context:
+                    # Lines after the chunk, for the after-context of its last lines
+                    context_end = chunk_end
+                    for _ in range(context):
+                        newline = mm.find(b'\n', context_end)
+                        context_end = len(mm) if newline == -1 else newline + 1
+                    text += mm[chunk_end:context_end].decode('utf-8', errors='replace').replace('\r\n', '\n')
+
+                counted = 0
+                for line_start, line_end, line, hits in _matching_lines(pattern, scanner, text, 0, scan_end):
+                    if remaining == 0:
+                        stats['truncated'] = True
+                        break
+                    if 0 < remaining < len(hits):
+                        hits = hits[:remaining]
+                        stats['truncated'] = True
+
+                    line_number += text.count('\n', counted, line_start)
+                    counted = line_start
+                    clipped, clip_start = _clip(line, max_line_length, hits[0].start())
+                    record = {
+                        'line': line_number,
+                        'text': clipped,
+                        'matches': [[hit.start() + 1, _clip(hit.group(), max_line_length)[0]] for hit in hits]
+                    }
+                    if len(clipped) < len(line):
+                        record['text_start'] = clip_start + 1
+                    if context:
+                        before = _lines_before(text, line_start, context)
+                        if len(before) < context:
+                            before = previous_lines[len(previous_lines) - (context - len(before)):] + before
+                        record['before'] = [_clip(l, max_line_length)[0] for l in before]
+                        record['after'] = [_clip(l, max_line_length)[0] for l in _lines_after(text, line_end, context)]
+                    stats['matches'] += len(hits)
+                    stats['lines'] += 1
+                    if remaining > 0:
+                        remaining -= len(hits)
+                    yield record
+
+                if remaining == 0:
+                    # Limit reached: only check whether the rest of the file has another match
+                    if not stats['truncated']:
+                        stats['truncated'] = _file_has_match(pattern, scanner, mm, chunk_end, chunk_size)
+                    stats['bytes'] += chunk_end - chunk_start
+                    return
+
+                line_number += text.count('\n', counted, scan_end)
+                if context:
+                    previous_lines = (previous_lines + _lines_before(text, scan_end, context))[-context:]
+                stats['bytes'] += chunk_end - chunk_start
+
+
+def _file_has_match(pattern, scanner, mm, start, chunk_size):
+    for chunk_start, chunk_end in _chunks(mm, chunk_size, start):
+        text = mm[chunk_start:chunk_end].decode('utf-8', errors='replace').replace('\r\n', '\n')
+        if any(True for _ in _matching_lines(pattern, scanner, text, 0, len(text))):
+            return True
+    return False
+
+
+BINARY_SNIFF = 8192
+
+
+def is_binary(path):
+    """Like grep, treats a file whose first bytes contain a NUL byte as binary."""
+    with open(path, 'rb') as f:
+        return b'\0' in f.read(BINARY_SNIFF)
+
+
+def _matches_any(relative_path, name, globs):
+    return any(fnmatch.fnmatch(relative_path, g) or fnmatch.fnmatch(name, g) for g in globs)
+
+
+def iter_tree_files(root, include=None, exclude=None, max_file_size=None, stats=None, on_skip=None,
+                    empty_dirs=False):
+    """
+    Yields the paths of the files under `root` to search. A glob matches either
+    the path relative to root (with '/' separators) or the bare name; excluded
+    directories are not entered. Files over `max_file_size` bytes and files
+    that cannot be read are counted in stats['files_skipped'] and passed to
+    `on_skip(path, reason)`. With `empty_dirs` (and no include globs), the
+    directories under root that contain nothing are yielded too, as paths
+    ending with os.sep.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault('files_skipped', 0)
+    if os.path.isfile(root):
+        yield root
+        return
+    for directory, dirnames, filenames in os.walk(root):
+        relative_dir = os.path.relpath(directory, root).replace(os.sep, '/')
+        relative_dir = '' if relative_dir == '.' else relative_dir + '/'
+        if exclude:
+            dirnames[:] = [d for d in dirnames if not _matches_any(relative_dir + d, d, exclude)]
+        if empty_dirs and not include and relative_dir and not dirnames and not filenames:
+            yield os.path.join(directory, '')
+        for name in filenames:
+            relative_path = relative_dir + name
+            if include and not _matches_any(relative_path, name, include):
+                continue
+            if exclude and _matches_any(relative_path, name, exclude):
+                continue
+            path = os.path.join(directory, name)
+            if max_file_size is not None:
+                try:
+                    size = os.path.getsize(path)
+                    reason = f"{size} bytes, over max_file_size" if size > max_file_size else None
+                except OSError as e:
+                    reason = str(e)
+                if reason is not None:
+                    stats['files_skipped'] += 1
+                    if on_skip is not None:
+                        on_skip(path, reason)
+                    continue
+            yield path
+
+
+def search_tree(root, regex, include=None, exclude=None, max_file_size=None, skip_binary=True,
+                max_matches=None, context=0, max_line_length=None, workers=8, stats=None):
+    """
+    Yields the matching lines of every file under `root` (see iter_tree_files),
+    as search_file records with an extra 'file' key. Files are searched on
+    `workers` threads and their records come back file by file, in completion
+    order. Once `max_matches` matches were yielded, no new file is started.
+
+    `stats`, if given, is a dict updated with 'files_searched',
+    'files_skipped' (too large, binary or unreadable), 'matches', 'lines',
+    'bytes' and 'truncated' (True if the limit stopped the search while
+    matches or files were left).
+    """
+    pattern = re.compile(regex) if isinstance(regex, str) else regex
+    if stats is None:
+        stats = {}
+    for key in ('files_searched', 'files_skipped', 'matches', 'lines', 'bytes'):
+        stats.setdefault(key, 0)
+    stats.setdefault('truncated', False)
+    stop = threading.Event()
+
+    def search_one(path):
+        if stop.is_set():
+            return path, None, None
+        try:
+            if skip_binary and is_binary(path):
+                return path, None, None
+            file_stats = {}
+            records = []
+            for record in search_file(path, pattern, max_matches=max_matches, context=context,
+                                      max_line_length=max_line_length, stats=file_stats):
+                if stop.is_set():
+                    break
+                records.append(record)
+            return path, records, file_stats
+        except (OSError, ValueError):
+            # Unreadable file, or a file that cannot be mapped
+            return path, None, None
+
+    remaining = max_matches if max_matches is not None else -1
+    files = iter_tree_files(root, include, exclude, max_file_size, stats)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = set()
+        exhausted = False
+        try:
+            while pending or not exhausted:
+                # Keep a bounded number of files in flight so that the walk stays ahead without queueing the whole tree
+                while not exhausted and not stop.is_set() and len(pending) < 2 * max(1, workers):
+                    path = next(files, None)
+                    if path is None:
+                        exhausted = True
+                    else:
+                        pending.add(executor.submit(search_one, path))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done = list(done)
+                for index, future in enumerate(done):
+                    path, records, file_stats = future.result()
+                    if records is None:
+                        stats['files_skipped'] += 1
+                        continue
+                    stats['files_searched'] += 1
+                    stats['bytes'] += file_stats['bytes']
+                    for record in records:
+                        if remaining == 0:
+                            stats['truncated'] = True
+                            break
+                        hits = record['matches']
+                        if 0 < remaining < len(hits):
+                            record['matches'] = hits[:remaining]
+                            stats['truncated'] = True
+                        remaining -= len(record['matches']) if remaining > 0 else 0
+                        stats['matches'] += len(record['matches'])
+                        stats['lines'] += 1
+                        yield dict(record, file=path)
+                    if remaining == 0:
+                        # Files already searched, still pending or not walked yet may hold more matches
+                        if (file_stats.get('truncated') or pending or any(f.result()[1] for f in done[index + 1:])
+                                or next(files, None) is not None):
+                            stats['truncated'] = True
+                        return
+        finally:
+            # Also reached when the consumer stops iterating early (e.g. the client disconnected)
+            stop.set()
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,100 @@
+"""
+Binary upload helpers used by /file/upload and /file/checksum.
+
+An upload is written to '<path>.part' in chunks, each at the offset the
+client gives: offset 0 starts over, and an interrupted upload resumes at
+the size of the partial file. The request body is copied in blocks while it
+is hashed, so neither a chunk nor the file is ever held in memory. The last
+chunk (or a request with no body) completes the upload: the partial file
+replaces `path` with os.replace(), after its checksum was verified if the
+client sent one.
+"""
+import hashlib
+import os
+
+BLOCK_SIZE = 1 << 20
+PART_SUFFIX = '.part'
+
+
+class UploadError(Exception):
+    """An upload request that cannot be applied; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status, **fields):
+        super().__init__(message)
+        self.status = status
+        self.fields = fields
+
+
+def partial_path(path):
+    return path + PART_SUFFIX
+
+
+def partial_size(path):
+    """Bytes already received for an upload to `path` (0 if none is in progress)."""
+    try:
+        return os.path.getsize(partial_path(path))
+    except OSError:
+        return 0
+
+
+def file_checksum(path, algorithm='sha256', start=0, end=None):
+    """Hex digest of the bytes [start, end) of a file, read block by block."""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            block = f.read(BLOCK_SIZE if remaining is None else min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+def write_chunk(path, stream, offset, algorithm='sha256'):
+    """
+    Copies `stream` into the partial file of `path` at `offset` and returns
+    (bytes received, hex digest of the chunk, new size of the partial file).
+    The partial file is cut at the end of the chunk, so a chunk sent again
+    replaces what followed it. Raises UploadError if `offset` is past the
+    bytes received so far.
+    """
+    part = partial_path(path)
+    size = partial_size(path)
+    if offset > size:
+        raise UploadError(f"Offset {offset} is past the {size} bytes received so far", 409, offset=size)
+
+    digest = hashlib.new(algorithm)
+    received = 0
+    with open(part, 'r+b' if offset and os.path.exists(part) else 'wb') as f:
+        f.seek(offset)
+        while True:
+            block = stream.read(BLOCK_SIZE)
+            if not block:
+                break
+            f.write(block)
+            digest.update(block)
+            received += len(block)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+    return received, digest.hexdigest(), offset + received
+
+
+def complete_upload(path, expected=None, algorithm='sha256'):
+    """
+    Moves the partial file of `path` over `path` and returns its checksum.
+    Raises UploadError (keeping the partial file) if it does not match
+    `expected`.
+    """
+    part = partial_path(path)
+    if not os.path.exists(part):
+        raise UploadError(f"No upload in progress for {path}", 404, offset=0)
+    checksum = file_checksum(part, algorithm)
+    if expected is not None and checksum != expected.lower():
+        raise UploadError(f"Checksum mismatch: expected {expected}, got {checksum}", 422,
+                          offset=os.path.getsize(part), checksum=checksum)
+    os.replace(part, path)
+    return checksum
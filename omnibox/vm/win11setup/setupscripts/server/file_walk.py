@@ -0,0 +1,164 @@
+"""
+Directory walker used by /file/find_by_name.
+
+Replaces glob.glob(..., recursive=True) followed by getsize/isdir/getctime/
+getmtime on every hit. The tree is walked with os.scandir: the type and the
+stat of an entry come from the directory listing (on Windows the listing
+already holds them, elsewhere it is one stat per entry), and directories
+that cannot contain a match of the pattern are not entered.
+
+The pattern follows glob's rules: '*', '?' and '[...]' match within one path
+component, '**' matches any number of directories, and wildcards do not
+match names starting with '.' unless the pattern component does.
+
+Entries come in a stable order (names sorted in each directory, a directory
+before its content), which is the order of their relative paths compared
+component by component. A cursor is the relative path of the last entry
+returned: resuming from it skips every directory that sorts entirely before
+it instead of walking it again.
+"""
+import fnmatch
+import os
+import re
+
+
+def split_relative(path):
+    """Components of a relative path written with '/' or '\\' separators."""
+    return tuple(part for part in path.replace('\\', '/').split('/') if part and part != '.')
+
+
+def _hidden(name):
+    return name.startswith('.')
+
+
+class GlobMatcher:
+    """
+    Matches paths component by component against a glob. A state is the set
+    of positions in the pattern that the components read so far can lead to,
+    so each directory is matched once and each entry costs one step.
+    """
+
+    def __init__(self, pattern):
+        self.patterns = split_relative(pattern) or ('*',)
+        # Like fnmatch.fnmatch: case-insensitive where the file system is
+        flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+        self.regexes = [None if p == '**' else re.compile(fnmatch.translate(p), flags) for p in self.patterns]
+        self.start = self._closure({0})
+
+    def _closure(self, positions):
+        # '**' also matches zero directories
+        stack = list(positions)
+        while stack:
+            i = stack.pop()
+            if i < len(self.patterns) and self.patterns[i] == '**' and i + 1 not in positions:
+                positions.add(i + 1)
+                stack.append(i + 1)
+        return frozenset(positions)
+
+    def step(self, state, name):
+        """State after reading the component `name`."""
+        positions = set()
+        hidden = _hidden(name)
+        for i in state:
+            if i == len(self.patterns):
+                continue
+            if self.patterns[i] == '**':
+                if not hidden:
+                    positions.add(i)
+            elif (not hidden or _hidden(self.patterns[i])) and self.regexes[i].match(name):
+                positions.add(i + 1)
+        return self._closure(positions)
+
+    def matches(self, state):
+        """Whether the components read to reach `state` match the whole pattern."""
+        return len(self.patterns) in state
+
+    def may_contain(self, state):
+        """Whether a path below the components read to reach `state` can match."""
+        return any(i < len(self.patterns) for i in state)
+
+
+def _excluded(parts, exclude):
+    relative_path = '/'.join(parts)
+    return any(fnmatch.fnmatch(relative_path, g) or fnmatch.fnmatch(parts[-1], g) for g in exclude)
+
+
+def entry_info(path, entry, stat):
+    return {
+        'path': path,
+        'name': entry.name,
+        'size': stat.st_size,
+        'is_directory': entry.is_dir(),
+        'created': stat.st_ctime,
+        'modified': stat.st_mtime
+    }
+
+
+def walk(root, pattern='*', max_depth=None, exclude=None, cursor=None, stats=None):
+    """
+    Yields (relative path components, info dict) for the entries under `root`
+    matching the glob `pattern`, in the stable order described above and
+    starting after `cursor` (a relative path). `max_depth` limits how many
+    directories deep the walk goes (1: only the entries of root). Directories
+    matching an `exclude` glob (relative path or name) are not entered.
+    Symbolic links to directories are listed but not followed.
+
+    `stats`, if given, is a dict updated with 'directories' (listed) and
+    'errors' (directories or entries that could not be read).
+    """
+    matcher = GlobMatcher(pattern)
+    exclude = exclude or []
+    after = split_relative(cursor) if cursor else None
+    if stats is None:
+        stats = {}
+    stats.setdefault('directories', 0)
+    stats.setdefault('errors', 0)
+    if '**' not in matcher.patterns:
+        # A pattern without '**' only matches at its own depth
+        depth = len(matcher.patterns)
+        max_depth = depth if max_depth is None else min(max_depth, depth)
+
+    def listing(parts, state, directory):
+        """Entries of a directory, in reverse order so that pop() returns them sorted."""
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name, reverse=True)
+        except OSError:
+            stats['errors'] += 1
+            return []
+        stats['directories'] += 1
+        return [(parts + (entry.name,), state, entry) for entry in entries]
+
+    # Depth-first: the stack holds the entries left in each open directory
+    stack = [listing((), matcher.start, root)]
+    while stack:
+        if not stack[-1]:
+            stack.pop()
+            continue
+        entry_parts, parent_state, entry = stack[-1].pop()
+        state = matcher.step(parent_state, entry.name)
+
+        # Not past the cursor yet: skip, and do not enter directories that sort entirely before it
+        before_cursor = after is not None and entry_parts <= after
+        inside_cursor = after is not None and after[:len(entry_parts)] == entry_parts
+
+        if not before_cursor and matcher.matches(state):
+            try:
+                stat = entry.stat()
+            except OSError:
+                stats['errors'] += 1
+            else:
+                yield entry_parts, entry_info(os.path.join(root, *entry_parts), entry, stat)
+
+        if ((before_cursor and not inside_cursor)
+                or (max_depth is not None and len(entry_parts) >= max_depth)
+                or not matcher.may_contain(state)
+                or (exclude and _excluded(entry_parts, exclude))):
+            continue
+        try:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+        except OSError:
+            continue
+        # Children come right after their directory, before its next sibling
+        stack.append(listing(entry_parts, state, entry.path))
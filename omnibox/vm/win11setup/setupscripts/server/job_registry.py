@@ -0,0 +1,114 @@
+"""
+Bounded stores for the /execute and /execute_powershell jobs.
+
+Jobs are kept after they finish so their output can be fetched, which would
+let memory grow without bound on a long-running server. A registry caps the
+number of jobs, the bytes of output they hold and their age since last use,
+evicting finished jobs only and reporting why each one was dropped.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('werkzeug')
+
+
+class JobRegistry:
+    """
+    Thread-safe job store bounded by number of jobs, bytes held and age.
+    Only finished jobs are evicted, least recently used first: running jobs
+    are never dropped, so the endpoints updating them can keep indexing it.
+    """
+
+    def __init__(self, name, max_count, max_bytes, ttl, size_of, is_active, on_evict=None):
+        self.name = name
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._size_of = size_of
+        self._is_active = is_active
+        self._on_evict = on_evict
+        self._jobs = OrderedDict()
+        self._last_used = {}
+        self._lock = threading.RLock()
+        self.evictions = {'count': 0, 'bytes': 0, 'ttl': 0}
+
+    def __setitem__(self, job_id, job):
+        with self._lock:
+            self._jobs[job_id] = job
+            self._touch(job_id)
+        self.prune()
+
+    def __getitem__(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            self._touch(job_id)
+            return job
+
+    def get(self, job_id, default=None):
+        with self._lock:
+            if job_id not in self._jobs:
+                return default
+            return self[job_id]
+
+    def pop(self, job_id, default=None):
+        with self._lock:
+            self._last_used.pop(job_id, None)
+            return self._jobs.pop(job_id, default)
+
+    def __contains__(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def _touch(self, job_id):
+        self._jobs.move_to_end(job_id)
+        self._last_used[job_id] = time.monotonic()
+
+    def prune(self):
+        """Evicts expired jobs, then the least recently used ones until the limits are met."""
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            finished = [job_id for job_id, job in self._jobs.items() if not self._is_active(job)]
+            total_bytes = sum(self._size_of(job) for job in self._jobs.values())
+            for job_id in finished:
+                if self.ttl > 0 and now - self._last_used[job_id] > self.ttl:
+                    reason = 'ttl'
+                elif self.max_count > 0 and len(self._jobs) > self.max_count:
+                    reason = 'count'
+                elif self.max_bytes > 0 and total_bytes > self.max_bytes:
+                    reason = 'bytes'
+                else:
+                    continue
+                job = self._jobs.pop(job_id)
+                del self._last_used[job_id]
+                total_bytes -= self._size_of(job)
+                self.evictions[reason] += 1
+                evicted.append(job)
+        # Artifacts are cleaned up outside of the lock
+        if self._on_evict is not None:
+            for job in evicted:
+                try:
+                    self._on_evict(job)
+                except Exception as e:
+                    logger.error(f"Error cleaning up evicted job {job.id}: {str(e)}")
+        return len(evicted)
+
+    def stats(self):
+        with self._lock:
+            jobs_list = list(self._jobs.values())
+            evictions = dict(self.evictions)
+        return {
+            'count': len(jobs_list),
+            'running': sum(1 for job in jobs_list if self._is_active(job)),
+            'bytes': sum(self._size_of(job) for job in jobs_list),
+            'evictions': evictions,
+            'max_count': self.max_count,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl
+        }
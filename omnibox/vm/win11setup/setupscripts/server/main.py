@@ -3,31 +3,57 @@ import logging
 import argparse
 import shlex
 import subprocess
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, has_request_context
+from flask.json.provider import DefaultJSONProvider
 import threading
 import traceback
 import pyautogui
-from PIL import Image
 from io import BytesIO
 import cv2
 import numpy as np
 import time
-import base64
 import tempfile
 import uuid
-from dataclasses import dataclass
-from typing import Optional, Dict
+from dataclasses import dataclass, field
+from typing import Optional
 from enum import Enum
-import glob as glob_module
 import re
 import json
+import gzip
+import tarfile
+import zipfile
+import base64
+import codecs
+import io
+import locale
 import queue
+import capture
+import recorder
+import shell_pool
+import file_index
+import file_archive
+import file_edit
+import file_search
+import file_transfer
+import file_walk
+import job_registry
+import command_scheduler
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, responses are then only gzip-compressed
+    zstandard = None
 
 class JobStatus(Enum):
     RUNNING = "running"
     COMPLETED = "completed"
     ERROR = "error"
 
+class RecordMode(Enum):
+    NONE = "none"          # No screen recording
+    FULL = "full"          # Always keep the recording
+    ON_ERROR = "on_error"  # Keep the recording only if the action failed
+
 @dataclass
 class Job:
     id: str
@@ -36,22 +62,164 @@ class Job:
     error: Optional[str] = None
     returncode: Optional[int] = None
     video_path: Optional[str] = None
-    video_base64: Optional[str] = None
+    video_size: Optional[int] = None
+    recording_pending: bool = False
+    # Frames encoded, skipped as duplicates and dropped under backpressure while the job was recorded
+    recording_frames: Optional[dict] = None
+
+class OutputBuffer:
+    """
+    Append-only text buffer filled by a reader thread. Pollers read only the
+    text after the offset they already have, instead of the whole output.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._length = 0
+        self._lock = threading.Lock()
+
+    def append(self, text):
+        """Appends text and returns the new length of the buffer."""
+        with self._lock:
+            if text:
+                self._chunks.append(text)
+                self._length += len(text)
+            return self._length
+
+    def read(self, offset=0):
+        """Returns (text after offset, new offset). Offsets count characters."""
+        with self._lock:
+            if len(self._chunks) > 1:
+                # Join lazily so that appends stay O(1) and repeated reads stay cheap
+                self._chunks = [''.join(self._chunks)]
+            text = self._chunks[0] if self._chunks else ''
+            offset = min(max(0, offset), self._length)
+            return text[offset:], self._length
+
+    def getvalue(self):
+        return self.read(0)[0]
+
+    def __len__(self):
+        return self._length
 
 @dataclass
 class PowerShellJob:
     id: str
     command: str
     status: JobStatus
-    output: str = ""
-    error: str = ""
+    output: OutputBuffer = field(default_factory=OutputBuffer)
+    error: OutputBuffer = field(default_factory=OutputBuffer)
     returncode: Optional[int] = None
     process: Optional[subprocess.Popen] = None
+    session: Optional[shell_pool.ShellSession] = None
+
+
+@dataclass
+class JobRecording:
+    job_id: str
+    mode: RecordMode
+    post_roll: float
+    video_path: str
+    started_at: float
+    clip: Optional[recorder.Clip] = None
+
+
+class JobEventBus:
+    """
+    Pushes job events (output chunks, status changes, recordings ready) to the
+    subscribers of /events. Each subscriber has a bounded queue; when a slow
+    subscriber's queue is full its oldest event is dropped.
+    """
+
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, job_id=None):
+        subscriber = (job_id, queue.Queue(maxsize=self.max_queue))
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, kind, job_id, event, data):
+        with self._lock:
+            targets = [q for wanted, q in self._subscribers if wanted is None or wanted == job_id]
+        if not targets:
+            return
+        message = (event, dict(data, kind=kind, job_id=job_id))
+        for q in targets:
+            while True:
+                try:
+                    q.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+def job_size(job):
+    # Approximate memory held by a job: its output and error text
+    return len(job.output or '') + len(job.error or '')
+
+def job_active(job):
+    return job.status == JobStatus.RUNNING or job.recording_pending
+
+def remove_job_artifacts(job):
+    """Deletes the screen recording of an evicted job."""
+    if job.video_path and os.path.exists(job.video_path):
+        os.remove(job.video_path)
+
+def powershell_job_size(job):
+    return len(job.command) + len(job.output) + len(job.error)
+
+def powershell_job_active(job):
+    return job.status == JobStatus.RUNNING
+
+def release_powershell_job(job):
+    # Drop the process handles so that the pipes can be collected
+    job.process = None
+    job.session = None
+
+def compact_payload(value):
+    """Drops null fields, recursively."""
+    if isinstance(value, dict):
+        return {key: compact_payload(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [compact_payload(item) for item in value]
+    return value
+
+def compact_requested():
+    """Compact mode: ?compact=1, an X-Compact: 1 header or "compact": true in the JSON body."""
+    flag = request.args.get('compact') or request.headers.get('X-Compact')
+    if flag is not None:
+        return flag.lower() not in ('0', 'false', '')
+    body = request.get_json(silent=True) if request.is_json else None
+    return isinstance(body, dict) and bool(body.get('compact', False))
 
+class CompactJSONProvider(DefaultJSONProvider):
+    """
+    JSON responses without indentation (also in debug mode) and without key
+    sorting, and with compact_payload() applied when the client asks for it.
+    """
+    compact = True
+    sort_keys = False
 
-# Global job storage
-jobs: Dict[str, Job] = {}
-powershell_jobs: Dict[str, PowerShellJob] = {}
+    def response(self, *args, **kwargs):
+        if has_request_context() and compact_requested():
+            args = tuple(compact_payload(arg) for arg in args)
+            kwargs = {key: compact_payload(value) for key, value in kwargs.items()}
+        return super().response(*args, **kwargs)
+
+# Post-roll every action used to record before recording policies existed
+LEGACY_RECORD_SECONDS_AFTER = 3.0
 
 
 
@@ -59,15 +227,128 @@ parser = argparse.ArgumentParser()
 parser.add_argument("--log_file", help="log file path", type=str,
                     default=os.path.join(os.path.dirname(__file__), "server.log"))
 parser.add_argument("--port", help="port", type=int, default=5000)
+parser.add_argument("--server", help="HTTP server: waitress (production) or flask (development server)", type=str,
+                    choices=["waitress", "flask"], default="waitress")
+parser.add_argument("--threads", help="worker threads of the waitress server", type=int, default=32)
+parser.add_argument("--connection_limit", help="open connections accepted by the waitress server", type=int, default=200)
+parser.add_argument("--keep_alive_timeout", help="seconds an idle keep-alive connection stays open", type=int, default=120)
+parser.add_argument("--max_request_body", help="largest request body accepted, in bytes", type=int,
+                    default=1024 * 1024 * 1024)
+parser.add_argument("--debug", help="run the Flask development server in debug mode", action="store_true")
+parser.add_argument("--no_compression", help="never compress responses", action="store_true")
+parser.add_argument("--compress_min_size", help="smallest response body compressed, in bytes", type=int, default=1024)
+parser.add_argument("--compress_level", help="gzip compression level (1-9)", type=int, default=5)
+parser.add_argument("--capture_backend", help="screen capture backend", type=str,
+                    choices=["auto"] + list(capture.BACKENDS), default="auto")
+parser.add_argument("--record_mode", help="default screen recording policy of action endpoints", type=str,
+                    choices=[mode.value for mode in RecordMode], default=RecordMode.FULL.value)
+parser.add_argument("--record_post_roll", help="default seconds recorded after an action completes",
+                    type=float, default=LEGACY_RECORD_SECONDS_AFTER)
+parser.add_argument("--record_fps", help="screen recording frame rate", type=float, default=20.0)
+parser.add_argument("--record_idle_timeout", type=float, default=3.0,
+                    help="seconds the screen keeps being captured after the last recorded action")
+parser.add_argument("--record_duplicate_tolerance", type=float, default=0.0,
+                    help="fraction of sampled pixels that may change for a frame to be skipped as a duplicate")
+parser.add_argument("--record_queue_size", help="frame buffers between screen capture and video encoding",
+                    type=int, default=8)
+parser.add_argument("--record_drop_policy", help="frame dropped when the encoder falls behind",
+                    type=str, choices=list(recorder.DROP_POLICIES), default="drop_oldest")
+parser.add_argument("--execute_workers", help="headless /execute commands run in parallel", type=int, default=4)
+parser.add_argument("--execute_max_queue", help="/execute commands waiting for a worker before requests get 429",
+                    type=int, default=32)
+parser.add_argument("--shell_executable", help="shell used by /execute_powershell", type=str, default="powershell")
+parser.add_argument("--shell_pool_size", help="number of warm shell sessions kept for /execute_powershell (0 disables the pool)",
+                    type=int, default=2)
+parser.add_argument("--shell_max_commands", help="commands run by a pooled shell session before it is recycled",
+                    type=int, default=50)
+parser.add_argument("--job_max_count", help="finished jobs kept per job type (0 for no limit)", type=int, default=1000)
+parser.add_argument("--job_max_bytes", help="output bytes held per job type before finished jobs are evicted (0 for no limit)",
+                    type=int, default=256 * 1024 * 1024)
+parser.add_argument("--job_ttl", help="seconds a finished job is kept after its last access (0 for no limit)",
+                    type=float, default=3600)
+parser.add_argument("--line_index_cache_size", help="files whose line-offset index is kept for /file/read",
+                    type=int, default=32)
+parser.add_argument("--search_max_matches", help="default match limit of /file/find_in_content (0 for no limit)",
+                    type=int, default=1000)
+parser.add_argument("--search_max_line_length", help="default length lines returned by /file/find_in_content are cut to (0 for no limit)",
+                    type=int, default=500)
+parser.add_argument("--search_workers", help="threads searching files in parallel for /file/search", type=int, default=8)
+parser.add_argument("--search_max_file_size", help="default size in bytes above which /file/search skips a file (0 for no limit)",
+                    type=int, default=50 << 20)
+parser.add_argument("--find_limit", help="default number of entries returned per /file/find_by_name page (0 for no limit)",
+                    type=int, default=1000)
+parser.add_argument("--delta_tile_size", help="tile size in pixels of /screenshot/delta", type=int, default=64)
+parser.add_argument("--delta_history", help="number of frames remembered by /screenshot/delta", type=int, default=8)
 args = parser.parse_args()
 
 logging.basicConfig(filename=args.log_file,level=logging.DEBUG, filemode='w' )
 logger = logging.getLogger('werkzeug')
 
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = args.max_request_body
+app.json = CompactJSONProvider(app)
 
 computer_control_lock = threading.Lock()
 
+# /execute: exclusive GUI commands, parallel headless commands
+execute_scheduler = command_scheduler.CommandScheduler(computer_control_lock, args.execute_workers, args.execute_max_queue)
+
+# Same behaviour as the commands sent by the controller (pyautogui.FAILSAFE=False)
+pyautogui.FAILSAFE = False
+
+# Long-lived screen grabber shared by the recorder and /screenshot
+screen_grabber = capture.ScreenGrabber(
+    capture.create_backend(args.capture_backend),
+    os.path.join(os.path.dirname(__file__), "cursor.png")
+)
+
+# Single background recorder shared by every job; jobs only mark start/end times
+screen_recorder = recorder.SharedRecorder(
+    screen_grabber,
+    fps=args.record_fps,
+    idle_timeout=args.record_idle_timeout,
+    duplicate_tolerance=args.record_duplicate_tolerance,
+    queue_size=args.record_queue_size,
+    drop_policy=args.record_drop_policy
+)
+
+# Push notifications for /events
+job_events = JobEventBus()
+
+# Global job storage, bounded so that a long-running server does not grow forever
+jobs = job_registry.JobRegistry('jobs', args.job_max_count, args.job_max_bytes, args.job_ttl,
+                                 job_size, job_active, remove_job_artifacts)
+powershell_jobs = job_registry.JobRegistry('powershell_jobs', args.job_max_count, args.job_max_bytes, args.job_ttl,
+                                             powershell_job_size, powershell_job_active, release_powershell_job)
+
+def prune_jobs_periodically():
+    # Insertions prune too; this only expires jobs when no new job comes in
+    while True:
+        time.sleep(60)
+        jobs.prune()
+        powershell_jobs.prune()
+
+threading.Thread(target=prune_jobs_periodically, daemon=True).start()
+
+# Encodage utilisé par les pipes des processus PowerShell (comme text=True)
+POWERSHELL_ENCODING = locale.getpreferredencoding(False)
+
+# Warm shell sessions reused by /execute_powershell
+powershell_pool = shell_pool.ShellPool(
+    args.shell_executable, args.shell_pool_size, args.shell_max_commands, POWERSHELL_ENCODING
+) if args.shell_pool_size > 0 else None
+
+# Line-offset indexes of the files paged through with /file/read
+line_index_cache = file_index.LineIndexCache(args.line_index_cache_size)
+
+# Tile hashes of the last frames returned by /screenshot/delta
+screen_tile_history = capture.TileHistory(tile_size=args.delta_tile_size, size=args.delta_history)
+
+# Counters per recording mode: jobs, seconds recorded and seconds of capture saved
+# compared with always recording the action plus LEGACY_RECORD_SECONDS_AFTER
+recording_stats = {mode.value: {'jobs': 0, 'recorded_seconds': 0.0, 'saved_seconds': 0.0} for mode in RecordMode}
+recording_stats_lock = threading.Lock()
+
 
 # Fonction pour étendre les variables d'environnement Windows
 def expand_windows_env_vars(path):
@@ -88,227 +369,538 @@ def expand_windows_env_vars(path):
     return path
 
 
+# Types de réponses compressés: le reste (images, vidéos, archives, fichiers) l'est déjà ou est binaire
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/plain', 'text/html'}
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses buffered text responses with zstd (if installed and accepted)
+    or gzip, as negotiated with Accept-Encoding. Streamed responses, file
+    downloads and ranges are left as they are.
+    """
+    if (args.no_compression or response.direct_passthrough or response.is_streamed
+            or response.status_code in (204, 206) or response.status_code < 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < args.compress_min_size:
+        return response
+    encoding = request.accept_encodings.best_match(['zstd', 'gzip'] if zstandard is not None else ['gzip'])
+    if encoding == 'zstd':
+        response.set_data(zstandard.ZstdCompressor(level=3).compress(data))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(data, compresslevel=args.compress_level))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.route('/probe', methods=['GET'])
 def probe_endpoint():
     return jsonify({"status": "Probe successful", "message": "Service is operational"}), 200
 
-def record_screen(stop_event, output_path):
-    screen_width, screen_height = pyautogui.size()
-    # Use H.264 codec with better parameters
-    fourcc = cv2.VideoWriter_fourcc(*'avc1')
-    out = cv2.VideoWriter(
-        output_path,
-        fourcc,
-        20.0,
-        (screen_width, screen_height),
-        isColor=True
+def recording_options(data, default_mode=None):
+    """Returns the (mode, post_roll) requested by an action, falling back to the server defaults."""
+    record = data.get('record')
+    if record is None:
+        mode = default_mode or RecordMode(args.record_mode)
+    elif isinstance(record, bool):
+        mode = RecordMode.FULL if record else RecordMode.NONE
+    else:
+        mode = RecordMode(record)
+    post_roll = data.get('post_roll')
+    post_roll = args.record_post_roll if post_roll is None else max(0.0, float(post_roll))
+    return mode, post_roll
+
+def start_job_recording(job_id, data, default_mode=None):
+    """Starts the screen recording of a job according to its recording policy."""
+    mode, post_roll = recording_options(data, default_mode)
+    recording = JobRecording(
+        job_id=job_id,
+        mode=mode,
+        post_roll=post_roll,
+        video_path=os.path.join(tempfile.gettempdir(), f"screen_record_{job_id}.mp4"),
+        started_at=time.monotonic()
     )
-    
-    # Load cursor image once
-    cursor_path = os.path.join(os.path.dirname(__file__), "cursor.png")
-    cursor = Image.open(cursor_path)
-    # make the cursor smaller
-    cursor = cursor.resize((int(cursor.width / 1.5), int(cursor.height / 1.5)))
-    
-    while not stop_event.is_set():
-        # Capture screenshot and cursor position
-        screenshot = pyautogui.screenshot()
-        cursor_x, cursor_y = pyautogui.position()
-        
-        # Add cursor to screenshot
-        screenshot.paste(cursor, (cursor_x, cursor_y), cursor)
-        
-        # Convert to OpenCV format and write
-        frame = np.array(screenshot)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        out.write(frame)
-    
-    out.release()
+    if mode != RecordMode.NONE:
+        recording.clip = screen_recorder.begin()
+    return recording
+
+def finish_job_recording(recording: JobRecording, failed: bool) -> bool:
+    """
+    Ends the recording of a job once its action is done. The clip is cut in a
+    background thread after the post-roll. Returns True if a video will be
+    available for the job.
+    """
+    keep = recording.clip is not None and (recording.mode == RecordMode.FULL or failed)
+    duration = time.monotonic() - recording.started_at
+    recorded = duration + recording.post_roll if keep else 0.0
+    with recording_stats_lock:
+        stats = recording_stats[recording.mode.value]
+        stats['jobs'] += 1
+        stats['recorded_seconds'] += recorded
+        stats['saved_seconds'] += max(0.0, duration + LEGACY_RECORD_SECONDS_AFTER - recorded)
+
+    job = jobs.get(recording.job_id)
+    if not keep:
+        if recording.clip is not None:
+            screen_recorder.discard(recording.clip)
+        if job is not None and job.status == JobStatus.RUNNING:
+            job.status = JobStatus.COMPLETED
+    elif job is not None:
+        job.recording_pending = True
+    if job is not None:
+        job_events.publish('job', job.id, 'status', job_event_data(job))
+    if not keep:
+        return False
+
+    threading.Thread(target=delayed_recording_cleanup, args=(recording,)).start()
+    return True
 
-def delayed_recording_cleanup(job_id: str, stop_recording: threading.Event, recording_thread: threading.Thread, temp_video_path: str):
-    time.sleep(3)  # Wait for 3 seconds after command completion
-    stop_recording.set()
-    recording_thread.join()
+def delayed_recording_cleanup(recording: JobRecording):
+    # Keep recording for the post-roll after command completion
+    screen_recorder.end(recording.clip, post_roll=recording.post_roll)
+    job_id = recording.job_id
     
     try:
-        # Read the video file and convert to base64
-        with open(temp_video_path, "rb") as video_file:
-            video_base64 = base64.b64encode(video_file.read()).decode('utf-8')
-        
-        # Update job with video data
+        # Cut the job's clip out of the shared recording
+        if not screen_recorder.extract(recording.clip, recording.video_path):
+            raise RuntimeError("No frame was recorded for this job")
+
+        # The video stays on disk and is served by /job/<job_id>/video
         if job_id in jobs:
-            jobs[job_id].video_base64 = video_base64
-            jobs[job_id].status = JobStatus.COMPLETED
-        
-        # Clean up the temporary file
-        os.remove(temp_video_path)
+            jobs[job_id].video_path = recording.video_path
+            jobs[job_id].video_size = os.path.getsize(recording.video_path)
+            jobs[job_id].recording_frames = recording.clip.frame_stats()
+            jobs[job_id].recording_pending = False
+            if jobs[job_id].status == JobStatus.RUNNING:
+                jobs[job_id].status = JobStatus.COMPLETED
+            job_events.publish('job', job_id, 'recording_ready', {
+                'screen_recording_url': f'/job/{job_id}/video',
+                'screen_recording_size': jobs[job_id].video_size,
+                'screen_recording_frames': jobs[job_id].recording_frames
+            })
+            job_events.publish('job', job_id, 'status', job_event_data(jobs[job_id]))
     except Exception as e:
         logger.error(f"Error in delayed cleanup for job {job_id}: {str(e)}\n{traceback.format_exc()}")
         if job_id in jobs:
             jobs[job_id].status = JobStatus.ERROR
             jobs[job_id].error = str(e)
+            jobs[job_id].recording_pending = False
+            job_events.publish('job', job_id, 'status', job_event_data(jobs[job_id]))
+
+def job_event_data(job: Job):
+    """Summary of a screen recording job sent with its status events."""
+    return {
+        'status': job.status.value,
+        'returncode': job.returncode,
+        'error': job.error if job.status == JobStatus.ERROR else None,
+        'recording_pending': job.recording_pending
+    }
+
+def powershell_job_event_data(job: PowerShellJob):
+    """Summary of a PowerShell job sent with its status events."""
+    return {
+        'status': job.status.value,
+        'returncode': job.returncode
+    }
+
+@app.route('/recording/stats', methods=['GET'])
+def get_recording_stats():
+    """
+    Recording per policy. 'saved_seconds' compares each job's recording with
+    the legacy one; the capture that goes on without any job (for
+    --record_idle_timeout after the last one) is shared, and is subtracted
+    in 'net_saved_seconds'.
+    """
+    with recording_stats_lock:
+        modes = {mode: dict(stats) for mode, stats in recording_stats.items()}
+    recorder_stats = screen_recorder.stats()
+    saved = sum(stats['saved_seconds'] for stats in modes.values())
+    return jsonify({
+        'status': 'success',
+        'default_mode': args.record_mode,
+        'default_post_roll': args.record_post_roll,
+        'modes': modes,
+        'idle_capture_seconds': recorder_stats['idle_seconds'],
+        'net_saved_seconds': round(saved - recorder_stats['idle_seconds'], 3),
+        'recorder': recorder_stats
+    })
+
+def parse_command(data):
+    """Returns the (command, shell) of an /execute request."""
+    shell = data.get('shell', False)
+    command = data.get('command', "" if shell else [])
+
+    if isinstance(command, str) and not shell:
+        command = shlex.split(command)
+
+    # Expand user directory
+    for i, arg in enumerate(command):
+        if arg.startswith("~/"):
+            command[i] = os.path.expanduser(arg)
+    return command, shell
+
+def run_execute_job(job_id, command, shell, data, timeout):
+    """Runs an /execute command for a job and returns the JSON response of the endpoint."""
+    try:
+        # Set up screen recording
+        recording = start_job_recording(job_id, data)
+
+        # Execute the command
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell, text=True, timeout=timeout)
+
+        # Update job with command results
+        jobs[job_id].output = result.stdout
+        jobs[job_id].error = result.stderr
+        jobs[job_id].returncode = result.returncode
+
+        # Stop or keep the screen recording according to the job's policy
+        recording_kept = finish_job_recording(recording, failed=result.returncode != 0)
+
+        return {
+            'status': 'success',
+            'output': result.stdout,
+            'error': result.stderr,
+            'returncode': result.returncode,
+            'screen_recording_job_id': job_id if recording_kept else None
+        }
+
+    except Exception as e:
+        logger.error("\n" + traceback.format_exc() + "\n")
+        # Update job with error
+        jobs[job_id].status = JobStatus.ERROR
+        jobs[job_id].error = str(e)
+        # Keep the recording of the failed command if the policy asks for it
+        if 'recording' in locals():
+            finish_job_recording(recording, failed=True)
+        else:
+            job_events.publish('job', job_id, 'status', job_event_data(jobs[job_id]))
+
+        return {
+            'status': 'error',
+            'message': str(e),
+            'job_id': job_id
+        }
 
 @app.route('/execute', methods=['POST'])
 def execute_command():
-    # Only execute one command at a time
-    with computer_control_lock:
-        data = request.json
-        shell = data.get('shell', False)
-        command = data.get('command', "" if shell else [])
+    """
+    Runs a command through the scheduler. "gui": false marks a headless
+    command that may run in parallel with others; by default commands are
+    exclusive, like /input. With "async": true the job id is returned right
+    away and the result is read from /job/<job_id> (or /events).
+    """
+    data = request.json
+    try:
+        recording_options(data)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        })
+    try:
+        timeout = float(data.get('timeout', 120))
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': f"Invalid timeout: {data.get('timeout')!r}"
+        })
+    command, shell = parse_command(data)
+    gui = bool(data.get('gui', True))
 
-        if isinstance(command, str) and not shell:
-            command = shlex.split(command)
+    # Create a new job
+    job_id = str(uuid.uuid4())
+    jobs[job_id] = Job(id=job_id, status=JobStatus.RUNNING)
 
-        # Expand user directory
-        for i, arg in enumerate(command):
-            if arg.startswith("~/"):
-                command[i] = os.path.expanduser(arg)
+    future = execute_scheduler.submit(gui, run_execute_job, job_id, command, shell, data, timeout)
+    if future is None:
+        jobs.pop(job_id)
+        response = jsonify({
+            'status': 'error',
+            'message': 'Too many queued commands, retry later',
+            'queue': execute_scheduler.stats()
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 429
 
-        # Create a new job
-        job_id = str(uuid.uuid4())
-        jobs[job_id] = Job(id=job_id, status=JobStatus.RUNNING)
+    if data.get('async', False):
+        return jsonify({
+            'status': 'success',
+            'message': 'Command queued',
+            'job_id': job_id,
+            'gui': gui
+        })
 
-        try:
-            # Set up screen recording
-            temp_video_path = os.path.join(tempfile.gettempdir(), f"screen_record_{job_id}.mp4")
-            stop_recording = threading.Event()
-            recording_thread = threading.Thread(target=record_screen, args=(stop_recording, temp_video_path))
-            recording_thread.start()
-
-            # Execute the command
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell, text=True, timeout=120)
-            
-            # Update job with command results
-            jobs[job_id].output = result.stdout
-            jobs[job_id].error = result.stderr
-            jobs[job_id].returncode = result.returncode
-            jobs[job_id].video_path = temp_video_path
-
-            # Start cleanup thread
-            cleanup_thread = threading.Thread(
-                target=delayed_recording_cleanup,
-                args=(job_id, stop_recording, recording_thread, temp_video_path)
-            )
-            cleanup_thread.start()
+    return jsonify(future.result())
 
-            return jsonify({
-                'status': 'success',
-                'output': result.stdout,
-                'error': result.stderr,
-                'returncode': result.returncode,
-                'screen_recording_job_id': job_id
-            })
+@app.route('/execute/stats', methods=['GET'])
+def get_execute_stats():
+    return jsonify({
+        'status': 'success',
+        **execute_scheduler.stats()
+    })
+
+
+def _input_point(action):
+    """Retourne les coordonnées (x, y) d'une action, ou None si absentes."""
+    x, y = action.get('x'), action.get('y')
+    if x is None or y is None:
+        return None, None
+    return int(x), int(y)
+
+def _input_click(action, clicks=1, button='left'):
+    x, y = _input_point(action)
+    pyautogui.click(x=x, y=y, clicks=action.get('clicks', clicks),
+                    interval=action.get('interval', 0.0), button=action.get('button', button))
+
+def _input_move_to(action):
+    x, y = _input_point(action)
+    pyautogui.moveTo(x=x, y=y, duration=action.get('duration', 0.0))
+
+def _input_drag_to(action):
+    x, y = _input_point(action)
+    pyautogui.dragTo(x=x, y=y, duration=action.get('duration', 0.5), button=action.get('button', 'left'))
+
+def _input_scroll(action):
+    x, y = _input_point(action)
+    pyautogui.scroll(int(action.get('amount', 0)), x=x, y=y)
+
+def _input_write(action):
+    pyautogui.write(action.get('text', ''), interval=action.get('interval', 0.0))
+
+def _input_keys(action):
+    keys = action.get('keys')
+    if keys is None:
+        keys = [action.get('key')]
+    if isinstance(keys, str):
+        keys = [keys]
+    return [k for k in keys if k]
+
+def _input_press(action):
+    pyautogui.press(_input_keys(action), presses=action.get('presses', 1), interval=action.get('interval', 0.0))
+
+def _input_key_down(action):
+    for key in _input_keys(action):
+        pyautogui.keyDown(key)
+
+def _input_key_up(action):
+    for key in reversed(_input_keys(action)):
+        pyautogui.keyUp(key)
+
+def _input_hotkey(action):
+    pyautogui.hotkey(*_input_keys(action), interval=action.get('interval', 0.0))
+
+def _input_sleep(action):
+    time.sleep(float(action.get('seconds', 0)))
+
+# Actions acceptées par /input, nommées comme les fonctions pyautogui correspondantes
+INPUT_ACTIONS = {
+    'click': _input_click,
+    'doubleClick': lambda action: _input_click(action, clicks=2),
+    'rightClick': lambda action: _input_click(action, button='right'),
+    'middleClick': lambda action: _input_click(action, button='middle'),
+    'moveTo': _input_move_to,
+    'dragTo': _input_drag_to,
+    'scroll': _input_scroll,
+    'write': _input_write,
+    'press': _input_press,
+    'keyDown': _input_key_down,
+    'keyUp': _input_key_up,
+    'hotkey': _input_hotkey,
+    'sleep': _input_sleep,
+}
+
+def run_input_actions(actions, pause=None):
+    """
+    Runs a list of input actions in-process and returns one result per action.
+    Stops at the first failing action. Must be called with computer_control_lock held.
+    """
+    results = []
+    previous_pause = pyautogui.PAUSE
+    if pause is not None:
+        pyautogui.PAUSE = float(pause)
+    try:
+        for index, action in enumerate(actions):
+            name = action.get('action')
+            handler = INPUT_ACTIONS.get(name)
+            if handler is None:
+                results.append({'index': index, 'action': name, 'status': 'error',
+                                'message': f'Unknown input action: {name}'})
+                break
+            start = time.perf_counter()
+            try:
+                handler(action)
+            except Exception as e:
+                logger.error(f"Error in input action {name}: {str(e)}\n{traceback.format_exc()}")
+                results.append({'index': index, 'action': name, 'status': 'error', 'message': str(e)})
+                break
+            results.append({'index': index, 'action': name, 'status': 'success',
+                            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3)})
+    finally:
+        pyautogui.PAUSE = previous_pause
+    return results
+
+@app.route('/input', methods=['POST'])
+def input_actions():
+    """
+    Executes mouse and keyboard actions directly in the server process, without
+    spawning a Python interpreter per action. Accepts either a single action
+    object or {"actions": [...], "pause": 0.05}.
+    """
+    data = request.json or {}
+    actions = data.get('actions')
+    if actions is None:
+        actions = [data]
+    if not isinstance(actions, list) or not all(isinstance(a, dict) for a in actions):
+        return jsonify({
+            'status': 'error',
+            'message': 'actions must be a list of objects'
+        })
+
+    try:
+        # Input actions are not recorded unless the request asks for it
+        recording_mode, _ = recording_options(data, default_mode=RecordMode.NONE)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        })
+
+    start = time.perf_counter()
+    job_id = None
+    with computer_control_lock:
+        if recording_mode != RecordMode.NONE:
+            job_id = str(uuid.uuid4())
+            jobs[job_id] = Job(id=job_id, status=JobStatus.RUNNING)
+            recording = start_job_recording(job_id, data, default_mode=RecordMode.NONE)
+        results = run_input_actions(actions, pause=data.get('pause'))
+    failed = [r for r in results if r['status'] == 'error']
+
+    recording_kept = False
+    if job_id is not None:
+        jobs[job_id].returncode = 1 if failed else 0
+        recording_kept = finish_job_recording(recording, failed=bool(failed))
+
+    response = {
+        'status': 'error' if failed else 'success',
+        'results': results,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+        'screen_recording_job_id': job_id if recording_kept else None
+    }
+    if failed:
+        response['message'] = failed[0]['message']
+    return jsonify(response)
 
-        except Exception as e:
-            logger.error("\n" + traceback.format_exc() + "\n")
-            # Make sure to stop recording if there's an error
-            if 'stop_recording' in locals():
-                stop_recording.set()
-                recording_thread.join()
-            if 'temp_video_path' in locals() and os.path.exists(temp_video_path):
-                os.remove(temp_video_path)
-            
-            # Update job with error
-            jobs[job_id].status = JobStatus.ERROR
-            jobs[job_id].error = str(e)
-            
-            return jsonify({
-                'status': 'error',
-                'message': str(e),
-                'job_id': job_id
-            })
 
 
-def read_stream(stream, output_queue):
-    """Lit le flux brut en continu et place les données dans une file d'attente."""
+def read_stream(stream, output_buffer, on_chunk=None):
+    """
+    Lit le flux par blocs et les ajoute au buffer de sortie au fur et à mesure.
+    on_chunk(text, offset) est appelé pour chaque bloc avec l'offset atteint.
+    """
+    # Même décodage que text=True : nouvelles lignes normalisées, même à cheval sur deux blocs
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(POWERSHELL_ENCODING)(errors='replace'), translate=True)
     while True:
-        data = stream.read(1)  # Lire caractère par caractère
+        data = stream.read1(65536)  # Tout ce qui est disponible, sans attendre 64 Ko
         if not data:  # Fin du flux
             break
-        output_queue.put(data)
+        text = decoder.decode(data)
+        offset = output_buffer.append(text)
+        if on_chunk is not None and text:
+            on_chunk(text, offset)
+    text = decoder.decode(b'', final=True)
+    offset = output_buffer.append(text)
+    if on_chunk is not None and text:
+        on_chunk(text, offset)
     stream.close()
 
+def publish_powershell_output(job_id, stream_name):
+    """Returns an on_chunk callback publishing the chunks of a PowerShell job stream."""
+    def on_chunk(text, offset):
+        job_events.publish('powershell', job_id, 'output', {'stream': stream_name, 'data': text, 'offset': offset})
+    return on_chunk
+
 def execute_powershell_in_thread(job_id, command):
     try:
         # Exécuter la commande PowerShell avec stdin, stdout et stderr configurés pour l'interactivité
-        powershell_command = ['powershell', '-Command', command]
+        powershell_command = shell_pool.shell_command_line(args.shell_executable, command)
         process = subprocess.Popen(
             powershell_command,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,  # Buffering minimal pour capturer en temps réel
-            universal_newlines=True
+            stderr=subprocess.PIPE
         )
         
         # Stocker la référence au processus dans le job
-        powershell_jobs[job_id].process = process
+        job = powershell_jobs[job_id]
+        job.process = process
         
         # Mettre à jour le statut du job
-        powershell_jobs[job_id].status = JobStatus.RUNNING
-        
-        # Files d'attente pour capturer la sortie et les erreurs
-        stdout_queue = queue.Queue()
-        stderr_queue = queue.Queue()
+        job.status = JobStatus.RUNNING
         
-        # Démarrer des threads pour lire les flux en continu
-        stdout_thread = threading.Thread(target=read_stream, args=(process.stdout, stdout_queue))
-        stderr_thread = threading.Thread(target=read_stream, args=(process.stderr, stderr_queue))
-        stdout_thread.daemon = True
+        # stderr est lu par un thread dédié, stdout directement par ce thread
+        stderr_thread = threading.Thread(target=read_stream, args=(
+            process.stderr, job.error, publish_powershell_output(job_id, 'stderr')))
         stderr_thread.daemon = True
-        stdout_thread.start()
         stderr_thread.start()
+        read_stream(process.stdout, job.output, publish_powershell_output(job_id, 'stdout'))
         
-        # Boucle principale pour récupérer les données en temps réel
-        while True:
-            # Vérifier si le processus est terminé
-            if process.poll() is not None:
-                break
-            
-            # Récupérer les données disponibles dans les files
-            try:
-                while not stdout_queue.empty():
-                    char = stdout_queue.get_nowait()
-                    powershell_jobs[job_id].output += char
-            except queue.Empty:
-                pass
-            
-            try:
-                while not stderr_queue.empty():
-                    char = stderr_queue.get_nowait()
-                    powershell_jobs[job_id].error += char
-            except queue.Empty:
-                pass
-            
-            time.sleep(0.01)  # Petite pause pour éviter de surcharger le CPU
-        
-        # Attendre la fin des threads et capturer les données restantes
-        stdout_thread.join()
+        # Attendre la fin du processus et de la lecture de stderr
+        process.wait()
         stderr_thread.join()
         
-        while not stdout_queue.empty():
-            powershell_jobs[job_id].output += stdout_queue.get()
-        while not stderr_queue.empty():
-            powershell_jobs[job_id].error += stderr_queue.get()
-        
-        # Mettre à jour le job avec le code de retour
-        powershell_jobs[job_id].returncode = process.returncode
-        powershell_jobs[job_id].status = JobStatus.COMPLETED
+        # Mettre à jour le job avec le code de retour (sauf s'il a été tué entre-temps)
+        job.returncode = process.returncode
+        if job.status == JobStatus.RUNNING:
+            job.status = JobStatus.COMPLETED
+            job_events.publish('powershell', job_id, 'status', powershell_job_event_data(job))
     except Exception as e:
         logger.error(f"Error in PowerShell job {job_id}: {str(e)}\n{traceback.format_exc()}")
         powershell_jobs[job_id].status = JobStatus.ERROR
-        powershell_jobs[job_id].error = str(e)
+        powershell_jobs[job_id].error.append(str(e))
+        job_events.publish('powershell', job_id, 'status', powershell_job_event_data(powershell_jobs[job_id]))
+
+def execute_powershell_in_pool(job_id, command):
+    """Runs a PowerShell job on a warm session of the pool instead of a new process."""
+    job = powershell_jobs[job_id]
+    publishers = {
+        'stdout': publish_powershell_output(job_id, 'stdout'),
+        'stderr': publish_powershell_output(job_id, 'stderr')
+    }
+
+    def on_output(stream_name, text):
+        buffer = job.output if stream_name == 'stdout' else job.error
+        publishers[stream_name](text, buffer.append(text))
+
+    def on_done(returncode):
+        job.returncode = returncode
+        if job.status == JobStatus.RUNNING:
+            job.status = JobStatus.COMPLETED
+            job_events.publish('powershell', job_id, 'status', powershell_job_event_data(job))
+
+    try:
+        session = powershell_pool.run(command, on_output, on_done)
+        job.session = session
+        job.process = session.process
+    except Exception as e:
+        logger.error(f"Error in PowerShell job {job_id}: {str(e)}\n{traceback.format_exc()}")
+        job.status = JobStatus.ERROR
+        job.error.append(str(e))
+        job_events.publish('powershell', job_id, 'status', powershell_job_event_data(job))
 
 @app.route('/powershell_job/<job_id>/input', methods=['POST'])
 def send_powershell_input(job_id):
-    if job_id not in powershell_jobs:
+    job = powershell_jobs.get(job_id)
+    if job is None:
         return jsonify({
             'status': 'error',
             'message': 'PowerShell job not found'
         })
     
-    job = powershell_jobs[job_id]
     
     # Vérifier si le job est toujours en cours d'exécution
     if job.status != JobStatus.RUNNING:
@@ -333,8 +925,12 @@ def send_powershell_input(job_id):
             input_text += '\n'
         
         # Envoyer l'entrée au processus
-        job.process.stdin.write(input_text)
-        job.process.stdin.flush()
+        if job.session is not None:
+            # Session du pool: elle ne sera pas réutilisée après avoir reçu une entrée
+            job.session.write_input(input_text)
+        else:
+            job.process.stdin.write(input_text.encode(POWERSHELL_ENCODING))
+            job.process.stdin.flush()
         
         return jsonify({
             'status': 'success',
@@ -352,13 +948,13 @@ def kill_powershell_process(job_id):
     """
     Kills a running PowerShell process by its job ID.
     """
-    if job_id not in powershell_jobs:
+    job = powershell_jobs.get(job_id)
+    if job is None:
         return jsonify({
             'status': 'error',
             'message': 'PowerShell job not found'
         })
     
-    job = powershell_jobs[job_id]
     
     # Check if the job is still running
     if job.status != JobStatus.RUNNING:
@@ -375,21 +971,28 @@ def kill_powershell_process(job_id):
         })
     
     try:
-        # Attempt to terminate the process
-        job.process.terminate()
-        
-        # Give it a short time to terminate gracefully
-        try:
-            job.process.wait(timeout=2)
-        except subprocess.TimeoutExpired:
-            # If it doesn't terminate within the timeout, force kill it
-            job.process.kill()
-            job.process.wait()
-        
+        if job.session is not None:
+            # Pooled session: killing the shell is the only way to stop the command,
+            # the pool replaces it with a fresh session
+            job.status = JobStatus.ERROR
+            job.session.kill()
+        else:
+            # Attempt to terminate the process
+            job.process.terminate()
+
+            # Give it a short time to terminate gracefully
+            try:
+                job.process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                # If it doesn't terminate within the timeout, force kill it
+                job.process.kill()
+                job.process.wait()
+
         # Update job status
         job.status = JobStatus.ERROR
-        job.error += "\nProcess was terminated by user request."
+        job.error.append("\nProcess was terminated by user request.")
         job.returncode = job.process.returncode
+        job_events.publish('powershell', job_id, 'status', powershell_job_event_data(job))
         
         return jsonify({
             'status': 'success',
@@ -403,6 +1006,12 @@ def kill_powershell_process(job_id):
             'message': f'Failed to terminate process: {str(e)}'
         })
 
+@app.route('/powershell_pool/stats', methods=['GET'])
+def get_powershell_pool_stats():
+    if powershell_pool is None:
+        return jsonify({'status': 'success', 'enabled': False})
+    return jsonify({'status': 'success', 'enabled': True, **powershell_pool.stats()})
+
 @app.route('/execute_powershell', methods=['POST'])
 def execute_powershell_command():
     data = request.json
@@ -411,9 +1020,14 @@ def execute_powershell_command():
     # Créer un nouvel ID de job
     job_id = str(uuid.uuid4())
     powershell_jobs[job_id] = PowerShellJob(id=job_id, command=command, status=JobStatus.RUNNING)
+    job_events.publish('powershell', job_id, 'status', powershell_job_event_data(powershell_jobs[job_id]))
 
-    # Démarrer l'exécution dans un thread séparé
-    threading.Thread(target=execute_powershell_in_thread, args=(job_id, command)).start()
+    if powershell_pool is not None and not data.get('fresh', False):
+        # Session chaude du pool: pas de coût de démarrage de PowerShell
+        execute_powershell_in_pool(job_id, command)
+    else:
+        # Démarrer l'exécution dans un thread séparé
+        threading.Thread(target=execute_powershell_in_thread, args=(job_id, command)).start()
 
     return jsonify({
         'status': 'success',
@@ -424,13 +1038,18 @@ def execute_powershell_command():
 # Ajouter le nouvel endpoint pour vérifier le statut d'un job PowerShell:
 @app.route('/powershell_job/<job_id>', methods=['GET'])
 def get_powershell_job_status(job_id):
-    if job_id not in powershell_jobs:
+    """
+    Returns the status of a PowerShell job. With ?offset=N (and/or
+    ?error_offset=M) only the output written after that offset is returned,
+    together with the new offsets to use for the next poll.
+    """
+    job = powershell_jobs.get(job_id)
+    if job is None:
         return jsonify({
             'status': 'error',
             'message': 'PowerShell job not found'
         })
 
-    job = powershell_jobs[job_id]
     response = {
         'status': job.status.value,
         'job_id': job.id,
@@ -438,9 +1057,14 @@ def get_powershell_job_status(job_id):
     }
 
     # Toujours renvoyer l'output et l'error, même si le job est en cours
+    # (seulement la partie après les offsets demandés, s'il y en a)
+    output, output_offset = job.output.read(request.args.get('offset', 0, type=int))
+    error, error_offset = job.error.read(request.args.get('error_offset', 0, type=int))
     response.update({
-        'output': job.output,
-        'error': job.error
+        'output': output,
+        'error': error,
+        'output_offset': output_offset,
+        'error_offset': error_offset
     })
 
     # Ajouter le code de retour si le job est terminé
@@ -453,413 +1077,798 @@ def get_powershell_job_status(job_id):
 
 
 # Route pour lire un fichier
-@app.route('/file/read', methods=['POST'])
-def file_read():
-    data = request.json
-    file_path = data.get('file', '')
+# Implémentations des opérations sur les fichiers, partagées par /file/* et /batch.
+# Chacune retourne les champs de la réponse propres à l'opération, dont 'output'.
+
+def file_read_range(file_path, data):
+    """
+    Byte range [start, end) of the file selected by a /file/read request, and
+    the fields describing it: offset/length (bytes, a negative offset counts
+    from the end), tail (last N lines), or start_line/end_line (Python slice
+    semantics, served from the cached line-offset index).
+    """
+    size = os.path.getsize(file_path)
+    if data.get('offset') is not None or data.get('length') is not None:
+        offset = int(data.get('offset') or 0)
+        start = max(0, size + offset) if offset < 0 else min(offset, size)
+        length = data.get('length')
+        end = size if length is None else min(size, start + max(0, int(length)))
+        return start, end, {'offset': start, 'next_offset': end, 'file_size': size}
+
     start_line = data.get('start_line')
     end_line = data.get('end_line')
-    sudo = data.get('sudo', False)
-    
-    try:
-        if not os.path.exists(file_path):
-            return jsonify({
-                'status': 'error',
-                'message': f'File not found: {file_path}'
-            })
-            
-        # Créer un nouvel ID de job pour l'enregistrement d'écran
-        job_id = str(uuid.uuid4())
-        jobs[job_id] = Job(id=job_id, status=JobStatus.RUNNING)
-            
-        # Configuration de l'enregistrement d'écran
-        temp_video_path = os.path.join(tempfile.gettempdir(), f"screen_record_{job_id}.mp4")
-        stop_recording = threading.Event()
-        recording_thread = threading.Thread(target=record_screen, args=(stop_recording, temp_video_path))
-        recording_thread.start()
-        
-        # Lecture du fichier
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-            if start_line is not None and end_line is not None:
-                # Lire seulement les lignes spécifiées
-                lines = f.readlines()
-                content = ''.join(lines[start_line:end_line])
-            elif start_line is not None:
-                lines = f.readlines()
-                content = ''.join(lines[start_line:])
-            else:
-                content = f.read()
-        
-        # Mise à jour du job avec les résultats
-        jobs[job_id].output = content
-        jobs[job_id].returncode = 0
-        jobs[job_id].video_path = temp_video_path
-        
-        # Démarrer le thread de nettoyage
-        cleanup_thread = threading.Thread(
-            target=delayed_recording_cleanup,
-            args=(job_id, stop_recording, recording_thread, temp_video_path)
-        )
-        cleanup_thread.start()
-        
-        return jsonify({
-            'status': 'success',
-            'output': content,
-            'returncode': 0,
-            'screen_recording_job_id': job_id
-        })
-    except Exception as e:
-        logger.error("\n" + traceback.format_exc() + "\n")
-        # Arrêter l'enregistrement en cas d'erreur
-        if 'stop_recording' in locals():
-            stop_recording.set()
-            recording_thread.join()
-        if 'temp_video_path' in locals() and os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
-        
-        # Mise à jour du job avec l'erreur
-        if 'job_id' in locals():
-            jobs[job_id].status = JobStatus.ERROR
-            jobs[job_id].error = str(e)
-        
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        })
+    tail = data.get('tail')
+    if tail is None and start_line is not None and start_line < 0 and end_line is None:
+        # Les dernières lignes se lisent depuis la fin, sans indexer le fichier
+        tail = -start_line
+    with open(file_path, 'rb') as f:
+        if tail is not None:
+            return file_index.tail_offset(f, size, int(tail)), size, {'file_size': size}
+        if start_line is None and end_line is None:
+            return 0, size, {'file_size': size}
+        index = line_index_cache.get(file_path)
+        start, end = file_index.line_range(f, index, start_line, end_line)
+        return start, end, {'file_size': index.size, 'line_count': index.line_count}
 
-# Route pour écrire dans un fichier
-@app.route('/file/write', methods=['POST'])
-def file_write():
-    data = request.json
+def read_file_operation(data):
     file_path = data.get('file', '')
+
+    # Lecture de la plage demandée seulement, jamais de tout le fichier pour en extraire quelques lignes
+    start, end, info = file_read_range(file_path, data)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        content = f.read(end - start)
+    if data.get('encoding') == 'base64':
+        # Octets bruts, sans décodage ni conversion des fins de ligne
+        return dict(info, output=base64.b64encode(content).decode('ascii'), encoding='base64')
+    content = content.decode('utf-8', errors='replace')
+    if 'offset' not in info:
+        # Comme la lecture en mode texte: fins de ligne universelles
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return dict(info, output=content)
+
+def write_file_operation(data):
     content = data.get('content', '')
     append = data.get('append', False)
-    leading_newline = data.get('leading_newline', False)
-    trailing_newline = data.get('trailing_newline', False)
-    sudo = data.get('sudo', False)
-    
-    try:
-        # Étendre les variables d'environnement Windows dans le chemin du fichier
-        file_path = expand_windows_env_vars(file_path)
-        # Préparation du contenu
-        if leading_newline:
-            content = '\n' + content
-        if trailing_newline:
-            content = content + '\n'
-            
-        # Créer un nouvel ID de job pour l'enregistrement d'écran
-        job_id = str(uuid.uuid4())
-        jobs[job_id] = Job(id=job_id, status=JobStatus.RUNNING)
-            
-        # Configuration de l'enregistrement d'écran
-        temp_video_path = os.path.join(tempfile.gettempdir(), f"screen_record_{job_id}.mp4")
-        stop_recording = threading.Event()
-        recording_thread = threading.Thread(target=record_screen, args=(stop_recording, temp_video_path))
-        recording_thread.start()
-        
-        # Écriture du fichier
-        mode = 'a' if append else 'w'
-        with open(file_path, mode, encoding='utf-8') as f:
+
+    # Étendre les variables d'environnement Windows dans le chemin du fichier
+    file_path = expand_windows_env_vars(data.get('file', ''))
+    # Préparation du contenu
+    if data.get('leading_newline', False):
+        content = '\n' + content
+    if data.get('trailing_newline', False):
+        content = content + '\n'
+
+    # Écriture du fichier
+    mode = 'a' if append else 'w'
+    if data.get('encoding') == 'base64':
+        # Contenu binaire: écrit tel quel, sans encodage ni conversion des fins de ligne
+        with open(file_path, mode + 'b') as f:
+            f.write(base64.b64decode(content))
+    else:
+        with open(file_path, mode, encoding='utf-8') as f:
             f.write(content)
-        
-        # Mise à jour du job avec les résultats
-        jobs[job_id].output = f"Content {'appended to' if append else 'written to'} {file_path}"
-        jobs[job_id].returncode = 0
-        jobs[job_id].video_path = temp_video_path
-        
-        # Démarrer le thread de nettoyage
-        cleanup_thread = threading.Thread(
-            target=delayed_recording_cleanup,
-            args=(job_id, stop_recording, recording_thread, temp_video_path)
-        )
-        cleanup_thread.start()
-        
-        return jsonify({
-            'status': 'success',
-            'output': f"Content {'appended to' if append else 'written to'} {file_path}",
-            'returncode': 0,
-            'screen_recording_job_id': job_id
-        })
-    except Exception as e:
-        logger.error("\n" + traceback.format_exc() + "\n")
-        # Arrêter l'enregistrement en cas d'erreur
-        if 'stop_recording' in locals():
-            stop_recording.set()
-            recording_thread.join()
-        if 'temp_video_path' in locals() and os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
-        
-        # Mise à jour du job avec l'erreur
-        if 'job_id' in locals():
-            jobs[job_id].status = JobStatus.ERROR
-            jobs[job_id].error = str(e)
-        
-        return jsonify({
+    return {'output': f"Content {'appended to' if append else 'written to'} {file_path}"}
+
+def str_replace_file_operation(data):
+    """
+    Applies one edit ("old_str"/"new_str") or a list of "edits", each with
+    "old_str" or "regex", "new_str" and an optional expected "count", in one
+    pass and with an atomic rewrite (see file_edit). With "dry_run": true
+    the file is left unchanged and a diff of the changed lines is returned;
+    "diff": true also returns it when the file is written.
+    """
+    # Étendre les variables d'environnement Windows dans le chemin du fichier
+    file_path = expand_windows_env_vars(data.get('file', ''))
+    specs = data.get('edits')
+    if specs is None:
+        specs = [{'old_str': data.get('old_str', ''), 'new_str': data.get('new_str', ''), 'count': data.get('count')}]
+
+    # Une seule passe sur le fichier, réécrit via un fichier temporaire puis renommé
+    edits = file_edit.parse_edits(specs, crlf=file_edit.uses_crlf(file_path))
+    dry_run = data.get('dry_run', False)
+    result = file_edit.apply_edits(file_path, edits, dry_run=dry_run, diff=data.get('diff', False))
+
+    occurrences = sum(edit.occurrences for edit in edits)
+    if data.get('edits') is None:
+        output = f"Replaced {occurrences} occurrence(s) of '{specs[0]['old_str']}' with '{specs[0]['new_str']}' in {file_path}"
+    else:
+        output = f"Applied {len(edits)} edit(s), {occurrences} occurrence(s) replaced in {file_path}"
+    if dry_run:
+        output = "Dry run, file not modified: " + output
+
+    return dict(
+        result,
+        output=output,
+        occurrences=occurrences,
+        edits=[{'index': i, 'occurrences': edit.occurrences} for i, edit in enumerate(edits)]
+    )
+
+def find_in_content_file_operation(data):
+    """
+    Searches a file with a regex (see file_search). Every matching line is
+    returned once in 'matches', as {'line', 'text', 'matches': [[column, text], ...]}
+    plus 'before'/'after' with "context": N. "max_matches" and
+    "max_line_length" default to the server options (0 for no limit).
+    """
+    # Étendre les variables d'environnement Windows dans le chemin du fichier
+    file_path = expand_windows_env_vars(data.get('file', ''))
+    max_matches = data.get('max_matches', args.search_max_matches)
+    max_line_length = data.get('max_line_length', args.search_max_line_length)
+
+    # Recherche en flux dans le fichier mappé en mémoire, arrêtée dès que la limite est atteinte
+    stats = {}
+    matches = list(file_search.search_file(
+        file_path,
+        data.get('regex', ''),
+        max_matches=int(max_matches) or None,
+        context=max(0, int(data.get('context', 0))),
+        max_line_length=int(max_line_length) or None,
+        stats=stats
+    ))
+
+    # 'output' ne fait que résumer la recherche: les résultats ne sont renvoyés qu'une fois, dans 'matches'
+    output = f"{stats['matches']} match(es) on {stats['lines']} line(s) in {file_path}"
+    if stats['truncated']:
+        output += f" (stopped at max_matches={max_matches})"
+    return {
+        'output': output,
+        'matches': matches,
+        'match_count': stats['matches'],
+        'truncated': stats['truncated']
+    }
+
+def search_globs(data, key):
+    """The include or exclude globs of a request: one string or a list."""
+    value = data.get(key) or []
+    return [value] if isinstance(value, str) else list(value)
+
+def search_options(data):
+    """Arguments of file_search.search_tree for a /file/search request."""
+    max_matches = data.get('max_matches', args.search_max_matches)
+    max_line_length = data.get('max_line_length', args.search_max_line_length)
+    max_file_size = data.get('max_file_size', args.search_max_file_size)
+    return {
+        'include': search_globs(data, 'include'),
+        'exclude': search_globs(data, 'exclude'),
+        'max_file_size': int(max_file_size) or None,
+        'skip_binary': data.get('skip_binary', True),
+        'max_matches': int(max_matches) or None,
+        'context': max(0, int(data.get('context', 0))),
+        'max_line_length': int(max_line_length) or None,
+        'workers': args.search_workers
+    }
+
+def search_summary(stats, path):
+    output = (f"{stats['matches']} match(es) on {stats['lines']} line(s) in {stats['files_searched']} "
+              f"file(s) under {path} ({stats['files_skipped']} skipped)")
+    if stats['truncated']:
+        output += " (stopped at max_matches)"
+    return output
+
+def search_file_operation(data):
+    """
+    Searches every file under "path" with a regex, on a thread pool (see
+    file_search.search_tree). Options: include/exclude (globs matching the
+    relative path or the name; excluded directories are not entered),
+    max_file_size, skip_binary, max_matches (over all files), context and
+    max_line_length.
+    """
+    # Étendre les variables d'environnement Windows dans le chemin du dossier
+    path = expand_windows_env_vars(data.get('path', ''))
+    stats = {}
+    matches = list(file_search.search_tree(path, data.get('regex', ''), stats=stats, **search_options(data)))
+    return dict(stats, output=search_summary(stats, path), matches=matches)
+
+def find_by_name_entries(data, stats):
+    """
+    Yields the entries of a /file/find_by_name request: the files and
+    directories under "path" matching "glob" (glob.glob rules, '**' for any
+    depth), starting after "cursor", at most "max_depth" directories deep and
+    without entering the "exclude" directories.
+    """
+    # Étendre les variables d'environnement Windows dans le chemin du fichier
+    path = expand_windows_env_vars(data.get('path', ''))
+    exclude = data.get('exclude') or []
+    return file_walk.walk(
+        path,
+        data.get('glob', '*'),
+        max_depth=data.get('max_depth'),
+        exclude=[exclude] if isinstance(exclude, str) else list(exclude),
+        cursor=data.get('cursor'),
+        stats=stats
+    )
+
+def find_by_name_file_operation(data):
+    """
+    Lists the entries matching a glob (see find_by_name_entries), one page
+    of "limit" entries at a time (default --find_limit, 0 for no limit).
+    'next_cursor' is set when more entries may follow: pass it back as
+    "cursor" to get the next page.
+    """
+    limit = int(data.get('limit', args.find_limit))
+    stats = {}
+    file_list = []
+    next_cursor = None
+    last_cursor = None
+    for parts, info in find_by_name_entries(data, stats):
+        if limit and len(file_list) == limit:
+            # Une entrée de plus existe: la page suivante reprend après la dernière renvoyée
+            next_cursor = last_cursor
+            break
+        file_list.append(info)
+        last_cursor = '/'.join(parts)
+
+    # 'output' ne fait que résumer la recherche: la liste n'est renvoyée qu'une fois, dans 'files'
+    output = f"{len(file_list)} entr{'y' if len(file_list) == 1 else 'ies'} found"
+    if next_cursor is not None:
+        output += f" (more after cursor {next_cursor!r})"
+    return {'output': output, 'files': file_list, 'count': len(file_list), 'next_cursor': next_cursor}
+
+# Opération -> (implémentation, paramètre du chemin qui doit exister, libellé de l'erreur)
+FILE_OPERATIONS = {
+    'read': (read_file_operation, 'file', 'File'),
+    'write': (write_file_operation, None, None),
+    'str_replace': (str_replace_file_operation, 'file', 'File'),
+    'find_in_content': (find_in_content_file_operation, 'file', 'File'),
+    'search': (search_file_operation, 'path', 'Directory'),
+    'find_by_name': (find_by_name_file_operation, 'path', 'Directory'),
+}
+
+def check_file_operation(name, data):
+    """Returns the error message of a file operation whose target does not exist, or None."""
+    _, path_key, label = FILE_OPERATIONS[name]
+    if path_key is not None and not os.path.exists(data.get(path_key, '')):
+        return f"{label} not found: {data.get(path_key, '')}"
+    return None
+
+def run_file_operation(name, data):
+    """Runs a /file/* operation as a job with its own screen recording and returns the response."""
+    message = check_file_operation(name, data)
+    if message is not None:
+        return {
             'status': 'error',
-            'message': str(e)
-        })
+            'message': message
+        }
 
-# Route pour remplacer une chaîne dans un fichier
-@app.route('/file/str_replace', methods=['POST'])
-def file_str_replace():
-    data = request.json
-    file_path = data.get('file', '')
-    old_str = data.get('old_str', '')
-    new_str = data.get('new_str', '')
-    sudo = data.get('sudo', False)
-    
     try:
-        if not os.path.exists(file_path):
-            return jsonify({
-                'status': 'error',
-                'message': f'File not found: {file_path}'
-            })
-            
         # Créer un nouvel ID de job pour l'enregistrement d'écran
         job_id = str(uuid.uuid4())
         jobs[job_id] = Job(id=job_id, status=JobStatus.RUNNING)
-            
+
         # Configuration de l'enregistrement d'écran
-        temp_video_path = os.path.join(tempfile.gettempdir(), f"screen_record_{job_id}.mp4")
-        stop_recording = threading.Event()
-        recording_thread = threading.Thread(target=record_screen, args=(stop_recording, temp_video_path))
-        recording_thread.start()
-        # Étendre les variables d'environnement Windows dans le chemin du fichier
-        file_path = expand_windows_env_vars(file_path)
-        
-        # Lecture du contenu actuel
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-            content = f.read()
-        
-        # Comptage des occurrences avant le remplacement
-        occurrences = content.count(old_str)
-        
-        # Remplacement
-        new_content = content.replace(old_str, new_str)
-        
-        # Écriture du nouveau contenu
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(new_content)
-        
-        result_message = f"Replaced {occurrences} occurrence(s) of '{old_str}' with '{new_str}' in {file_path}"
-        
+        recording = start_job_recording(job_id, data)
+
+        result = FILE_OPERATIONS[name][0](data)
+
         # Mise à jour du job avec les résultats
-        jobs[job_id].output = result_message
+        jobs[job_id].output = result['output']
         jobs[job_id].returncode = 0
-        jobs[job_id].video_path = temp_video_path
-        
-        # Démarrer le thread de nettoyage
-        cleanup_thread = threading.Thread(
-            target=delayed_recording_cleanup,
-            args=(job_id, stop_recording, recording_thread, temp_video_path)
+
+        # Arrêter ou conserver l'enregistrement selon la politique du job
+        recording_kept = finish_job_recording(recording, failed=False)
+
+        return dict(
+            result,
+            status='success',
+            returncode=0,
+            screen_recording_job_id=job_id if recording_kept else None
         )
-        cleanup_thread.start()
-        
-        return jsonify({
-            'status': 'success',
-            'output': result_message,
-            'returncode': 0,
-            'occurrences': occurrences,
-            'screen_recording_job_id': job_id
-        })
     except Exception as e:
         logger.error("\n" + traceback.format_exc() + "\n")
-        # Arrêter l'enregistrement en cas d'erreur
-        if 'stop_recording' in locals():
-            stop_recording.set()
-            recording_thread.join()
-        if 'temp_video_path' in locals() and os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
-        
         # Mise à jour du job avec l'erreur
         if 'job_id' in locals():
             jobs[job_id].status = JobStatus.ERROR
             jobs[job_id].error = str(e)
-        
+        recording_kept = False
+        if 'recording' in locals():
+            recording_kept = finish_job_recording(recording, failed=True)
+
+        return {
+            'status': 'error',
+            'message': str(e),
+            'screen_recording_job_id': job_id if recording_kept else None
+        }
+
+@app.route('/file/read', methods=['POST'])
+def file_read():
+    """
+    Reads a file, or part of it (see file_read_range). With "stream": true
+    the raw bytes of the range are streamed back as text/plain instead of a
+    JSON response, without a job or a screen recording.
+    """
+    data = request.json
+    if not data.get('stream', False):
+        return jsonify(run_file_operation('read', data))
+
+    file_path = data.get('file', '')
+    message = check_file_operation('read', data)
+    if message is not None:
+        return jsonify({
+            'status': 'error',
+            'message': message
+        }), 404
+    try:
+        start, end, info = file_read_range(file_path, data)
+    except (OSError, ValueError, TypeError) as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
-        })
+        }), 400
+    headers = {
+        'X-Range-Start': str(start),
+        'X-Range-End': str(end),
+        'X-File-Size': str(info['file_size'])
+    }
+    if 'line_count' in info:
+        headers['X-Line-Count'] = str(info['line_count'])
+    return Response(file_index.iter_file_range(file_path, start, end), mimetype='text/plain',
+                    headers=headers)
+
+# Route pour écrire dans un fichier
+@app.route('/file/write', methods=['POST'])
+def file_write():
+    return jsonify(run_file_operation('write', request.json))
+
+# Route pour remplacer une chaîne dans un fichier
+@app.route('/file/str_replace', methods=['POST'])
+def file_str_replace():
+    return jsonify(run_file_operation('str_replace', request.json))
 
 # Route pour rechercher du contenu dans un fichier
 @app.route('/file/find_in_content', methods=['POST'])
 def file_find_in_content():
+    return jsonify(run_file_operation('find_in_content', request.json))
+
+# Route pour rechercher du contenu dans tous les fichiers d'un dossier
+@app.route('/file/search', methods=['POST'])
+def file_search_tree():
+    """
+    Recursive content search (see search_file_operation). Results are streamed
+    as NDJSON while files are searched, one {"file", "line", "text",
+    "matches", ...} object per matching line, then a last {"done": true, ...}
+    object with the counters. With "stream": false a single JSON response
+    with a job and a screen recording is returned instead, like the other
+    /file/* endpoints.
+    """
     data = request.json
-    file_path = data.get('file', '')
-    regex = data.get('regex', '')
-    sudo = data.get('sudo', False)
-    
-    try:
-        if not os.path.exists(file_path):
-            return jsonify({
-                'status': 'error',
-                'message': f'File not found: {file_path}'
-            })
-            
-        # Créer un nouvel ID de job pour l'enregistrement d'écran
-        job_id = str(uuid.uuid4())
-        jobs[job_id] = Job(id=job_id, status=JobStatus.RUNNING)
-            
-        # Configuration de l'enregistrement d'écran
-        temp_video_path = os.path.join(tempfile.gettempdir(), f"screen_record_{job_id}.mp4")
-        stop_recording = threading.Event()
-        recording_thread = threading.Thread(target=record_screen, args=(stop_recording, temp_video_path))
-        recording_thread.start()
-        # Étendre les variables d'environnement Windows dans le chemin du fichier
-        file_path = expand_windows_env_vars(file_path)
-        
-        # Lecture du fichier
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-            content = f.read()
-            
-        # Recherche avec l'expression régulière
-        pattern = re.compile(regex)
-        matches = []
-        line_num = 0
-        
-        for line in content.splitlines():
-            line_num += 1
-            for match in pattern.finditer(line):
-                matches.append({
-                    'line': line_num,
-                    'column': match.start() + 1,
-                    'text': match.group(),
-                    'full_line': line
-                })
-        
-        # Mise à jour du job avec les résultats
-        match_output = json.dumps(matches, indent=2)
-        jobs[job_id].output = match_output
-        jobs[job_id].returncode = 0
-        jobs[job_id].video_path = temp_video_path
-        
-        # Démarrer le thread de nettoyage
-        cleanup_thread = threading.Thread(
-            target=delayed_recording_cleanup,
-            args=(job_id, stop_recording, recording_thread, temp_video_path)
-        )
-        cleanup_thread.start()
-        
+    if not data.get('stream', True):
+        return jsonify(run_file_operation('search', data))
+
+    message = check_file_operation('search', data)
+    if message is not None:
         return jsonify({
-            'status': 'success',
-            'output': match_output,
-            'matches': matches,
-            'returncode': 0,
-            'screen_recording_job_id': job_id
-        })
-    except Exception as e:
-        logger.error("\n" + traceback.format_exc() + "\n")
-        # Arrêter l'enregistrement en cas d'erreur
-        if 'stop_recording' in locals():
-            stop_recording.set()
-            recording_thread.join()
-        if 'temp_video_path' in locals() and os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
-        
-        # Mise à jour du job avec l'erreur
-        if 'job_id' in locals():
-            jobs[job_id].status = JobStatus.ERROR
-            jobs[job_id].error = str(e)
-        
+            'status': 'error',
+            'message': message
+        }), 404
+    path = expand_windows_env_vars(data.get('path', ''))
+    try:
+        pattern = re.compile(data.get('regex', ''))
+        options = search_options(data)
+    except (re.error, ValueError, TypeError) as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
-        })
+        }), 400
+
+    def generate():
+        stats = {}
+        try:
+            for record in file_search.search_tree(path, pattern, stats=stats, **options):
+                yield json.dumps(record) + '\n'
+            yield json.dumps(dict(stats, done=True, status='success', output=search_summary(stats, path))) + '\n'
+        except Exception as e:
+            logger.error("\n" + traceback.format_exc() + "\n")
+            yield json.dumps(dict(stats, done=True, status='error', message=str(e))) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 # Route pour rechercher des fichiers par nom/motif
 @app.route('/file/find_by_name', methods=['POST'])
 def file_find_by_name():
+    """
+    Lists files and directories matching a glob (see find_by_name_file_operation).
+    With "stream": true the entries are streamed as NDJSON while the tree is
+    walked, one object per entry, then a last {"done": true, "count",
+    "next_cursor"} object, without a job or a screen recording.
+    """
     data = request.json
-    path = data.get('path', '')
-    glob_pattern = data.get('glob', '*')
-    
+    if not data.get('stream', False):
+        return jsonify(run_file_operation('find_by_name', data))
+
+    message = check_file_operation('find_by_name', data)
+    if message is not None:
+        return jsonify({
+            'status': 'error',
+            'message': message
+        }), 404
     try:
-        if not os.path.exists(path):
+        limit = int(data.get('limit', args.find_limit))
+    except (ValueError, TypeError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    def generate():
+        stats = {}
+        count = 0
+        last_cursor = None
+        next_cursor = None
+        try:
+            for parts, info in find_by_name_entries(data, stats):
+                if limit and count == limit:
+                    next_cursor = last_cursor
+                    break
+                count += 1
+                last_cursor = '/'.join(parts)
+                yield json.dumps(info) + '\n'
+            yield json.dumps(dict(stats, done=True, status='success', count=count, next_cursor=next_cursor)) + '\n'
+        except Exception as e:
+            logger.error("\n" + traceback.format_exc() + "\n")
+            yield json.dumps(dict(stats, done=True, status='error', count=count, message=str(e))) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/file/download', methods=['GET'])
+def file_download():
+    """
+    Streams a file as raw bytes (?path=...), with HTTP Range support so that
+    clients can download parts of it or resume. With ?checksum=sha256 (or
+    another hashlib algorithm) the digest of the whole file is sent in the
+    X-Checksum header; it costs one extra read of the file.
+    """
+    file_path = expand_windows_env_vars(request.args.get('path', ''))
+    if not os.path.isfile(file_path):
+        return jsonify({
+            'status': 'error',
+            'message': f"File not found: {file_path}"
+        }), 404
+    headers = {}
+    algorithm = request.args.get('checksum')
+    if algorithm:
+        try:
+            headers['X-Checksum'] = f"{algorithm}:{file_transfer.file_checksum(file_path, algorithm)}"
+        except ValueError as e:
             return jsonify({
                 'status': 'error',
-                'message': f'Directory not found: {path}'
-            })
-            
-        # Créer un nouvel ID de job pour l'enregistrement d'écran
+                'message': str(e)
+            }), 400
+    response = send_file(file_path, mimetype='application/octet-stream', conditional=True,
+                         as_attachment=True, download_name=os.path.basename(file_path))
+    response.headers.update(headers)
+    return response
+
+@app.route('/file/upload', methods=['GET', 'PUT'])
+def file_upload():
+    """
+    Resumable binary upload (see file_transfer). PUT the raw bytes of a chunk
+    with ?path=...&offset=N: the response gives the new "offset" and the
+    checksum of the chunk. Add &complete=1 to the last chunk (or send an
+    empty chunk at the final offset) to move the file into place, with &checksum=<hex> to have the
+    whole file verified first. GET ?path=... returns the offset to resume from.
+    """
+    file_path = expand_windows_env_vars(request.args.get('path', ''))
+    algorithm = request.args.get('algorithm', 'sha256')
+    if not file_path:
+        return jsonify({
+            'status': 'error',
+            'message': 'Missing path'
+        }), 400
+    if request.method == 'GET':
+        return jsonify({'status': 'success', 'path': file_path, 'offset': file_transfer.partial_size(file_path)})
+
+    try:
+        offset = request.args.get('offset', 0, type=int)
+        response = {'status': 'success', 'path': file_path}
+        # Le corps est copié par blocs depuis le flux de la requête, jamais chargé en entier
+        received, chunk_checksum, size = file_transfer.write_chunk(file_path, request.stream, offset, algorithm)
+        response.update(received=received, chunk_checksum=chunk_checksum, offset=size)
+        if request.args.get('complete', '0') not in ('0', 'false') or (received == 0 and offset > 0):
+            response['checksum'] = file_transfer.complete_upload(file_path, request.args.get('checksum'), algorithm)
+            response['complete'] = True
+        return jsonify(response)
+    except file_transfer.UploadError as e:
+        return jsonify(dict(e.fields, status='error', message=str(e))), e.status
+    except (OSError, ValueError) as e:
+        logger.error("\n" + traceback.format_exc() + "\n")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/file/checksum', methods=['POST'])
+def file_checksum():
+    """Digest of a file, or of bytes [offset, offset + length) of it, without returning its content."""
+    data = request.json
+    file_path = expand_windows_env_vars(data.get('file', ''))
+    if not os.path.isfile(file_path):
+        return jsonify({
+            'status': 'error',
+            'message': f"File not found: {file_path}"
+        }), 404
+    algorithm = data.get('algorithm', 'sha256')
+    start = int(data.get('offset', 0))
+    length = data.get('length')
+    try:
+        checksum = file_transfer.file_checksum(file_path, algorithm, start,
+                                               None if length is None else start + int(length))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    return jsonify({
+        'status': 'success',
+        'algorithm': algorithm,
+        'checksum': checksum,
+        'file_size': os.path.getsize(file_path)
+    })
+
+@app.route('/file/archive', methods=['POST'])
+def file_archive_download():
+    """
+    Streams a directory ("path") as an archive built on the fly: "format"
+    "tar" (default) or "zip", "compress": true for tar.gz / deflated zip, and
+    include/exclude as for /file/search. There is no size limit unless
+    "max_file_size" is given; files over it and unreadable files are left
+    out, logged and listed in a last archive entry (file_archive.SKIPPED_LIST).
+    Empty directories are archived too, unless include globs are given.
+    X-Archive-Root gives the directory archived.
+    """
+    data = request.json
+    path = expand_windows_env_vars(data.get('path', ''))
+    if not os.path.isdir(path):
+        return jsonify({
+            'status': 'error',
+            'message': f"Directory not found: {path}"
+        }), 404
+    archive_format = data.get('format', 'tar')
+    compress = bool(data.get('compress', False))
+    if (archive_format, compress) not in file_archive.FORMATS:
+        return jsonify({
+            'status': 'error',
+            'message': f"Unsupported archive format: {archive_format}"
+        }), 400
+    try:
+        include = search_globs(data, 'include')
+        exclude = search_globs(data, 'exclude')
+        # Pas de limite de taille par défaut (contrairement à /file/search)
+        max_file_size = int(data.get('max_file_size') or 0) or None
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': f"Invalid archive options: {str(e)}"
+        }), 400
+    mimetype, extension = file_archive.FORMATS[(archive_format, compress)]
+
+    def skipped(file_path, reason):
+        logger.warning(f"Archive of {path}: skipped {file_path}: {reason}")
+
+    stream = file_archive.iter_archive(path, archive_format, compress, include=include,
+                                       exclude=exclude, max_file_size=max_file_size,
+                                       on_error=skipped)
+    name = (os.path.basename(os.path.normpath(path)) or 'archive') + extension
+    return Response(stream, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{name}"',
+        'X-Archive-Root': path
+    })
+
+@app.route('/file/extract', methods=['PUT'])
+def file_archive_extract():
+    """
+    Extracts the archive sent as the raw request body into ?path=... (created
+    if needed). ?format=tar (default, also compressed tars) or zip. Members
+    that would land outside the destination are rejected.
+    """
+    path = expand_windows_env_vars(request.args.get('path', ''))
+    archive_format = request.args.get('format', 'tar')
+    if not path or archive_format not in ('tar', 'zip'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Missing path or unsupported archive format'
+        }), 400
+    stats = {}
+    try:
+        # Lecture séquentielle du flux de la requête (zip: copié d'abord dans un fichier temporaire)
+        file_archive.extract_archive(request.stream, path, archive_format, stats)
+    except (OSError, ValueError, tarfile.TarError, zipfile.BadZipFile) as e:
+        logger.error("\n" + traceback.format_exc() + "\n")
+        return jsonify(dict(stats, status='error', message=str(e))), 400
+    return jsonify(dict(stats, status='success', path=path,
+                        output=f"Extracted {stats['files']} file(s) ({stats['bytes']} bytes) to {path}"))
+
+def _batch_file_operation(name):
+    def run(operation):
+        message = check_file_operation(name, operation)
+        if message is not None:
+            return {'status': 'error', 'message': message}
+        return dict(FILE_OPERATIONS[name][0](operation), status='success', returncode=0)
+    return run
+
+def _run_batch_command(command, shell, timeout):
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell, text=True,
+                            timeout=timeout)
+    return {
+        'status': 'success',
+        'output': result.stdout,
+        'error': result.stderr,
+        'returncode': result.returncode
+    }
+
+def _batch_execute(operation):
+    command, shell = parse_command(operation)
+    timeout = float(operation.get('timeout', 120))
+    if operation.get('gui', True):
+        # Le batch tourne déjà dans la file GUI du scheduler (voir run_batch), qui détient le verrou
+        return _run_batch_command(command, shell, timeout)
+    future = execute_scheduler.submit(False, _run_batch_command, command, shell, timeout)
+    if future is None:
+        return {'status': 'error', 'message': 'Too many queued commands, retry later'}
+    return future.result()
+
+def _batch_input(operation):
+    actions = operation.get('actions')
+    if actions is None:
+        actions = [operation]
+    results = run_input_actions(actions, pause=operation.get('pause'))
+    failed = [r for r in results if r['status'] == 'error']
+    response = {'status': 'error' if failed else 'success', 'results': results}
+    if failed:
+        response['message'] = failed[0]['message']
+    return response
+
+def _batch_sleep(operation):
+    time.sleep(float(operation.get('seconds', 0)))
+    return {'status': 'success'}
+
+def _batch_screenshot(operation):
+    options = screenshot_options(operation)
+    capture_start = time.perf_counter()
+    frame = transform_frame(screen_grabber.grab(), options['region'], options['scale'], options['max_width'])
+    capture_ms = (time.perf_counter() - capture_start) * 1000
+    encode_start = time.perf_counter()
+    image = encode_frame(frame, options['format'], options['quality'], options['compression'])
+    return {
+        'status': 'success',
+        'format': options['format'],
+        'width': frame.shape[1],
+        'height': frame.shape[0],
+        'image': base64.b64encode(image).decode('ascii'),
+        'capture_ms': round(capture_ms, 2),
+        'encode_ms': round((time.perf_counter() - encode_start) * 1000, 2)
+    }
+
+# Opérations acceptées par /batch
+BATCH_OPERATIONS = {
+    'file.read': _batch_file_operation('read'),
+    'file.write': _batch_file_operation('write'),
+    'file.str_replace': _batch_file_operation('str_replace'),
+    'file.find_in_content': _batch_file_operation('find_in_content'),
+    'file.search': _batch_file_operation('search'),
+    'file.find_by_name': _batch_file_operation('find_by_name'),
+    'execute': _batch_execute,
+    'input': _batch_input,
+    'sleep': _batch_sleep,
+    'screenshot': _batch_screenshot,
+}
+
+def batch_needs_control_lock(operations):
+    """GUI operations (input, and commands not marked "gui": false) need exclusive control of the screen."""
+    return any(op.get('op') == 'input' or (op.get('op') == 'execute' and op.get('gui', True))
+               for op in operations)
+
+def run_batch_job(data, operations):
+    """Runs the operations of a /batch request and returns its JSON response."""
+    stop_on_error = data.get('stop_on_error', False)
+    recording_mode, _ = recording_options(data)
+    start = time.perf_counter()
+    job_id = None
+    if recording_mode != RecordMode.NONE:
         job_id = str(uuid.uuid4())
         jobs[job_id] = Job(id=job_id, status=JobStatus.RUNNING)
-            
-        # Configuration de l'enregistrement d'écran
-        temp_video_path = os.path.join(tempfile.gettempdir(), f"screen_record_{job_id}.mp4")
-        stop_recording = threading.Event()
-        recording_thread = threading.Thread(target=record_screen, args=(stop_recording, temp_video_path))
-        recording_thread.start()
-        
-        
-        
-        # Étendre les variables d'environnement Windows dans le chemin du fichier
-        path = expand_windows_env_vars(path)
-        # Recherche des fichiers avec le motif glob
-        search_path = os.path.join(path, glob_pattern)
-        files = glob_module.glob(search_path, recursive=True)
-        
-        # Formatage des résultats
-        file_list = []
-        for file_path in files:
-            file_info = {
-                'path': file_path,
-                'name': os.path.basename(file_path),
-                'size': os.path.getsize(file_path),
-                'is_directory': os.path.isdir(file_path),
-                'created': os.path.getctime(file_path),
-                'modified': os.path.getmtime(file_path)
-            }
-            file_list.append(file_info)
-        
-        # Mise à jour du job avec les résultats
-        result_output = json.dumps(file_list, indent=2)
-        jobs[job_id].output = result_output
-        jobs[job_id].returncode = 0
-        jobs[job_id].video_path = temp_video_path
-        
-        # Démarrer le thread de nettoyage
-        cleanup_thread = threading.Thread(
-            target=delayed_recording_cleanup,
-            args=(job_id, stop_recording, recording_thread, temp_video_path)
-        )
-        cleanup_thread.start()
-        
+        recording = start_job_recording(job_id, data)
+
+    results = []
+    failed = False
+    for index, operation in enumerate(operations):
+        name = operation['op']
+        op_start = time.perf_counter()
+        try:
+            result = BATCH_OPERATIONS[name](operation)
+        except Exception as e:
+            logger.error(f"Error in batch operation {name}: {str(e)}\n{traceback.format_exc()}")
+            result = {'status': 'error', 'message': str(e)}
+        result.update(index=index, op=name, elapsed_ms=round((time.perf_counter() - op_start) * 1000, 3))
+        results.append(result)
+        if result['status'] == 'error' or result.get('returncode') not in (None, 0):
+            failed = True
+            if stop_on_error:
+                break
+
+    recording_kept = False
+    if job_id is not None:
+        jobs[job_id].returncode = 1 if failed else 0
+        recording_kept = finish_job_recording(recording, failed=failed)
+
+    return {
+        'status': 'error' if failed else 'success',
+        'results': results,
+        'completed': len(results),
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+        'screen_recording_job_id': job_id if recording_kept else None
+    }
+
+@app.route('/batch', methods=['POST'])
+def run_batch():
+    """
+    Runs an ordered list of operations in one request:
+    {"operations": [{"op": "file.write", "file": ..., "content": ...},
+                    {"op": "input", "action": "click", "x": 10, "y": 20},
+                    {"op": "sleep", "seconds": 0.5},
+                    {"op": "screenshot", "format": "jpeg", "scale": 0.5}],
+     "stop_on_error": true, "record": "on_error"}
+    Operations take the parameters of the matching endpoint. A single screen
+    recording covers the whole batch. An operation fails on an error or a
+    non-zero return code; with stop_on_error the batch stops there.
+
+    A batch with GUI operations runs as one exclusive command of the /execute
+    scheduler (its commands run in turn); "gui": false commands run on the
+    scheduler's headless workers.
+    """
+    data = request.json or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
         return jsonify({
-            'status': 'success',
-            'output': result_output,
-            'files': file_list,
-            'count': len(file_list),
-            'returncode': 0,
-            'screen_recording_job_id': job_id
+            'status': 'error',
+            'message': 'operations must be a list of objects'
         })
-    except Exception as e:
-        logger.error("\n" + traceback.format_exc() + "\n")
-        # Arrêter l'enregistrement en cas d'erreur
-        if 'stop_recording' in locals():
-            stop_recording.set()
-            recording_thread.join()
-        if 'temp_video_path' in locals() and os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
-        
-        # Mise à jour du job avec l'erreur
-        if 'job_id' in locals():
-            jobs[job_id].status = JobStatus.ERROR
-            jobs[job_id].error = str(e)
-        
+    unknown = [op.get('op') for op in operations if op.get('op') not in BATCH_OPERATIONS]
+    if unknown:
+        return jsonify({
+            'status': 'error',
+            'message': f'Unknown batch operation: {unknown[0]}'
+        })
+    try:
+        recording_options(data)
+    except ValueError as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         })
 
+    if not batch_needs_control_lock(operations):
+        return jsonify(run_batch_job(data, operations))
+
+    # File GUI du scheduler: le batch détient computer_control_lock pendant toute son exécution
+    future = execute_scheduler.submit(True, run_batch_job, data, operations)
+    if future is None:
+        response = jsonify({
+            'status': 'error',
+            'message': 'Too many queued commands, retry later',
+            'queue': execute_scheduler.stats()
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    return jsonify(future.result())
+
+@app.route('/jobs/stats', methods=['GET'])
+def get_jobs_stats():
+    return jsonify({
+        'status': 'success',
+        'jobs': jobs.stats(),
+        'powershell_jobs': powershell_jobs.stats()
+    })
+
 @app.route('/job/<job_id>', methods=['GET'])
 def get_job_status(job_id):
-    if job_id not in jobs:
+    job = jobs.get(job_id)
+    if job is None:
         return jsonify({
             'status': 'error',
             'message': 'Job not found'
         })
 
-    job = jobs[job_id]
     response = {
         'status': job.status.value,
         'job_id': job.id
@@ -869,32 +1878,380 @@ def get_job_status(job_id):
         response.update({
             'output': job.output,
             'error': job.error,
-            'returncode': job.returncode,
-            'screen_recording': job.video_base64
+            'returncode': job.returncode
         })
     elif job.status == JobStatus.ERROR:
         response.update({
             'error': job.error
         })
 
+    # Recordings of failed jobs are kept too when the recording policy asks for it
+    if job.video_size is not None:
+        response.update({
+            'screen_recording_url': f'/job/{job.id}/video',
+            'screen_recording_size': job.video_size,
+            'screen_recording_frames': job.recording_frames
+        })
+
     return jsonify(response)
 
+@app.route('/job/<job_id>/video', methods=['GET'])
+def get_job_video(job_id):
+    """
+    Streams the screen recording of a job from disk, with HTTP Range support
+    so clients can seek or resume partial downloads.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Job not found'
+        }), 404
+
+    if job.video_size is None or not os.path.exists(job.video_path):
+        return jsonify({
+            'status': 'error',
+            'message': f'Screen recording not available (job status: {job.status.value})'
+        }), 404
+
+    return send_file(job.video_path, mimetype='video/mp4', conditional=True,
+                     download_name=f"screen_record_{job_id}.mp4")
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def job_event_snapshot(job_id, offset=None, error_offset=None):
+    """Events describing the current state of a job, sent when a client subscribes."""
+    events = []
+    if job_id in powershell_jobs:
+        job = powershell_jobs[job_id]
+        for stream_name, buffer, start in (('stdout', job.output, offset), ('stderr', job.error, error_offset)):
+            if start is not None:
+                text, new_offset = buffer.read(start)
+                if text:
+                    events.append(('output', {'kind': 'powershell', 'job_id': job_id, 'stream': stream_name,
+                                              'data': text, 'offset': new_offset}))
+        events.append(('status', dict(powershell_job_event_data(job), kind='powershell', job_id=job_id)))
+    elif job_id in jobs:
+        job = jobs[job_id]
+        if job.video_size is not None:
+            events.append(('recording_ready', {'kind': 'job', 'job_id': job_id,
+                                               'screen_recording_url': f'/job/{job_id}/video',
+                                               'screen_recording_size': job.video_size,
+                                               'screen_recording_frames': job.recording_frames}))
+        events.append(('status', dict(job_event_data(job), kind='job', job_id=job_id)))
+    return events
+
+def job_finished(job_id):
+    """True once a job will not publish any more events."""
+    if job_id in powershell_jobs:
+        return powershell_jobs[job_id].status != JobStatus.RUNNING
+    if job_id in jobs:
+        return jobs[job_id].status != JobStatus.RUNNING and not jobs[job_id].recording_pending
+    return True
+
+@app.route('/events', methods=['GET'])
+def stream_job_events():
+    """
+    Server-sent events for PowerShell and screen recording jobs: 'output'
+    chunks (with their offset), 'status' changes and 'recording_ready'.
+    With ?job_id=<id> only that job's events are sent, starting with its
+    current state, and the stream ends when the job is finished; ?offset=N
+    and ?error_offset=M replay PowerShell output written after those offsets.
+    Without job_id, the events of all jobs are streamed.
+    """
+    job_id = request.args.get('job_id')
+    offset = request.args.get('offset', type=int)
+    error_offset = request.args.get('error_offset', type=int)
+    heartbeat = request.args.get('heartbeat', 15, type=float)
+    if job_id is not None and job_id not in jobs and job_id not in powershell_jobs:
+        return jsonify({
+            'status': 'error',
+            'message': 'Job not found'
+        }), 404
+
+    # Subscribe before taking the snapshot so that no event is missed in between
+    subscriber = job_events.subscribe(job_id)
+
+    def generate():
+        try:
+            if job_id is not None:
+                for event, data in job_event_snapshot(job_id, offset, error_offset):
+                    yield format_sse(event, data)
+                if job_finished(job_id):
+                    return
+            while True:
+                try:
+                    event, data = subscriber[1].get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event, data)
+                if job_id is not None and event == 'status' and job_finished(job_id):
+                    return
+        finally:
+            job_events.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Formats supported by /screenshot: (extension for cv2.imencode, mimetype)
+SCREENSHOT_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'jpg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+    'raw': (None, 'application/octet-stream'),
+}
+
+def parse_region(value):
+    """Parses a 'x,y,width,height' crop rectangle."""
+    if not value:
+        return None
+    x, y, width, height = (int(v) for v in value.split(','))
+    if width <= 0 or height <= 0:
+        raise ValueError("region width and height must be positive")
+    return x, y, width, height
+
+def screenshot_options(params):
+    """Reads the image options shared by the screenshot endpoints from query parameters."""
+    fmt = params.get('format', 'png').lower()
+    if fmt not in SCREENSHOT_FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    return {
+        'format': fmt,
+        'quality': int(params.get('quality', 80)),
+        # PNG compression level 0-9: 1 is much faster than PIL's default for a slightly larger file
+        'compression': int(params.get('compression', 1)),
+        'scale': float(params['scale']) if params.get('scale') else None,
+        'max_width': int(params['max_width']) if params.get('max_width') else None,
+        'region': parse_region(params.get('region')),
+    }
+
+def transform_frame(frame, region=None, scale=None, max_width=None):
+    """Crops then downscales a BGR frame. Returns a view of the frame when nothing changes."""
+    if region is not None:
+        x, y, width, height = region
+        frame_height, frame_width = frame.shape[:2]
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(frame_width, x + width), min(frame_height, y + height)
+        if x0 >= x1 or y0 >= y1:
+            raise ValueError("region is outside of the screen")
+        frame = frame[y0:y1, x0:x1]
+    factor = scale if scale is not None else 1.0
+    if max_width is not None and frame.shape[1] * factor > max_width:
+        factor = max_width / frame.shape[1]
+    if factor < 1.0:
+        size = (max(1, int(frame.shape[1] * factor)), max(1, int(frame.shape[0] * factor)))
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return frame
+
+def encode_frame(frame, fmt='png', quality=80, compression=1):
+    """Encodes a BGR frame. 'raw' returns the BGRA pixels without any compression."""
+    extension, _ = SCREENSHOT_FORMATS[fmt]
+    if extension is None:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA).tobytes()
+    if extension == '.png':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    elif extension == '.jpg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    success, encoded = cv2.imencode(extension, frame, params)
+    if not success:
+        raise RuntimeError(f"Failed to encode screenshot as {fmt}")
+    return encoded.tobytes()
+
+def image_response(frame, options, capture_ms, extra_headers=None):
+    """Encodes a frame according to the screenshot options and returns it with timing headers."""
+    frame = transform_frame(frame, options['region'], options['scale'], options['max_width'])
+    encode_start = time.perf_counter()
+    data = encode_frame(frame, options['format'], options['quality'], options['compression'])
+    encode_ms = (time.perf_counter() - encode_start) * 1000
+    response = send_file(BytesIO(data), mimetype=SCREENSHOT_FORMATS[options['format']][1])
+    response.headers['X-Capture-Ms'] = f"{capture_ms:.2f}"
+    response.headers['X-Encode-Ms'] = f"{encode_ms:.2f}"
+    response.headers['X-Image-Width'] = str(frame.shape[1])
+    response.headers['X-Image-Height'] = str(frame.shape[0])
+    if options['format'] == 'raw':
+        response.headers['X-Pixel-Format'] = 'BGRA'
+    for name, value in (extra_headers or {}).items():
+        response.headers[name] = str(value)
+    return response
+
 @app.route('/screenshot', methods=['GET'])
 def capture_screen_with_cursor():    
-    cursor_path = os.path.join(os.path.dirname(__file__), "cursor.png")
-    screenshot = pyautogui.screenshot()
-    cursor_x, cursor_y = pyautogui.position()
-    cursor = Image.open(cursor_path)
-    # make the cursor smaller
-    cursor = cursor.resize((int(cursor.width / 1.5), int(cursor.height / 1.5)))
-    screenshot.paste(cursor, (cursor_x, cursor_y), cursor)
-    
+    """
+    Returns the screen with the cursor drawn on it. Query parameters:
+    format (png, jpeg, webp, raw), quality, compression (PNG level), scale,
+    max_width and region=x,y,width,height.
+    """
+    try:
+        options = screenshot_options(request.args)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    capture_start = time.perf_counter()
+    frame = screen_grabber.grab()
+    capture_ms = (time.perf_counter() - capture_start) * 1000
 
-    # Convert PIL Image to bytes and send
-    img_io = BytesIO()
-    screenshot.save(img_io, 'PNG')
-    img_io.seek(0)
-    return send_file(img_io, mimetype='image/png')
+    try:
+        return image_response(frame, options, capture_ms)
+    except (ValueError, RuntimeError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+def screen_sample(frame, region=None, step=4):
+    """Returns a small copy of the frame (or of a region of it) used to detect changes cheaply."""
+    if region is not None:
+        frame = transform_frame(frame, region=region)
+    return frame[::step, ::step].copy()
+
+@app.route('/screen/wait', methods=['GET'])
+def wait_for_screen_to_settle():
+    """
+    Samples the screen until it has not changed for `stable_ms` milliseconds
+    (optionally only inside `wait_region=x,y,width,height`) or until
+    `timeout_ms` expires, then returns the screenshot like /screenshot does.
+    X-Settled tells whether the screen settled before the timeout and
+    X-Wait-Ms how long the request waited.
+    """
+    try:
+        options = screenshot_options(request.args)
+        stable_ms = request.args.get('stable_ms', 500, type=float)
+        timeout_ms = request.args.get('timeout_ms', 5000, type=float)
+        interval_ms = max(10.0, request.args.get('interval_ms', 50, type=float))
+        # Per-channel difference below which a sampled pixel counts as unchanged
+        pixel_threshold = request.args.get('pixel_threshold', 8, type=int)
+        wait_region = parse_region(request.args.get('wait_region'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    start = time.monotonic()
+    deadline = start + timeout_ms / 1000
+    try:
+        previous = screen_sample(screen_grabber.grab(with_cursor=False), wait_region)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    stable_since = time.monotonic()
+    settled = False
+    while True:
+        now = time.monotonic()
+        if (now - stable_since) * 1000 >= stable_ms:
+            settled = True
+            break
+        if now >= deadline:
+            break
+        time.sleep(min(interval_ms / 1000, max(0.0, deadline - now)))
+        sample = screen_sample(screen_grabber.grab(with_cursor=False), wait_region)
+        if sample.shape != previous.shape or \
+                np.count_nonzero(cv2.absdiff(sample, previous) > pixel_threshold):
+            stable_since = time.monotonic()
+            previous = sample
+    wait_ms = (time.monotonic() - start) * 1000
+
+    capture_start = time.perf_counter()
+    frame = screen_grabber.grab()
+    capture_ms = (time.perf_counter() - capture_start) * 1000
+    try:
+        return image_response(frame, options, capture_ms, extra_headers={
+            'X-Settled': 'true' if settled else 'false',
+            'X-Wait-Ms': f"{wait_ms:.2f}"
+        })
+    except (ValueError, RuntimeError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/screenshot/delta', methods=['GET'])
+def capture_screen_delta():
+    """
+    Returns only the parts of the screen that changed since frame `since`, as
+    encoded tiles with their coordinates, plus the id of the new frame. The
+    whole screen is returned as a single tile when `since` is missing or was
+    evicted from the history. Accepts the format/quality/compression options
+    of /screenshot.
+    """
+    try:
+        options = screenshot_options(request.args)
+        since = request.args.get('since', type=int)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    capture_start = time.perf_counter()
+    frame = screen_grabber.grab()
+    frame_id = screen_tile_history.add(frame)
+    capture_ms = (time.perf_counter() - capture_start) * 1000
+
+    height, width = frame.shape[:2]
+    regions = screen_tile_history.changed_regions(since, frame_id) if since is not None else None
+    full = regions is None
+    if full:
+        regions = [(0, 0, width, height)]
+
+    encode_start = time.perf_counter()
+    tiles = []
+    for x, y, tile_width, tile_height in regions:
+        data = encode_frame(frame[y:y + tile_height, x:x + tile_width],
+                            options['format'], options['quality'], options['compression'])
+        tiles.append({
+            'x': x,
+            'y': y,
+            'width': tile_width,
+            'height': tile_height,
+            'data': base64.b64encode(data).decode('ascii')
+        })
+    encode_ms = (time.perf_counter() - encode_start) * 1000
+
+    return jsonify({
+        'status': 'success',
+        'frame_id': frame_id,
+        'since': since,
+        'full': full,
+        'width': width,
+        'height': height,
+        'format': options['format'],
+        'tiles': tiles,
+        'capture_ms': round(capture_ms, 2),
+        'encode_ms': round(encode_ms, 2)
+    })
+
+def serve():
+    """Serves the app with waitress, or with Flask's development server if asked for (or if waitress is missing)."""
+    if args.server == 'waitress':
+        try:
+            import waitress
+        except ImportError:
+            logger.warning("waitress is not installed, falling back to the Flask development server")
+        else:
+            logger.info(f"Serving with waitress on port {args.port} ({args.threads} threads)")
+            waitress.serve(
+                app,
+                host="0.0.0.0",
+                port=args.port,
+                threads=args.threads,
+                connection_limit=args.connection_limit,
+                channel_timeout=args.keep_alive_timeout,
+                max_request_body_size=args.max_request_body,
+                ident="computer-use-server"
+            )
+            return
+    app.run(debug=args.debug, host="0.0.0.0", port=args.port, threaded=True)
 
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0", port=args.port)
\ No newline at end of file
+    serve()
@@ -0,0 +1,536 @@
+"""
+Shared background screen recorder.
+
+A single capture thread records the screen into short rolling segments on
+disk. Jobs do not record anything themselves: they only mark a start and an
+end time (a Clip), and their video is cut from the segments covering that
+time range once it has been captured. Any number of overlapping jobs share
+the same capture/encode pipeline.
+
+Capture is paced against a monotonic clock at `fps`. Frames identical (or
+nearly identical, see `duplicate_tolerance`) to the previous one are not
+encoded: segments are variable frame rate, with the capture time of every
+stored frame kept alongside, and clips are rebuilt at a constant frame rate by
+repeating the last frame, so their playback speed matches real time.
+
+Capture and encoding run on two threads connected by a FrameQueue: the
+capture thread grabs into a small pool of reusable frame buffers and only
+queues them, so a slow encode no longer delays the next grab. When every
+buffer is waiting to be encoded, the drop policy decides which frame is
+lost: 'drop_oldest' reuses the oldest queued frame (keeps the latest screen),
+'drop_newest' skips the frame being captured (keeps a continuous past).
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger('werkzeug')
+
+
+@dataclass
+class Segment:
+    path: str
+    start: float
+    # Capture time of every frame stored in the segment file
+    frame_times: List[float] = field(default_factory=list)
+    # Time of the last capture tick, stored or skipped as a duplicate
+    end: float = 0.0
+    closed: bool = False
+
+
+@dataclass
+class Clip:
+    id: str
+    start: float
+    end: Optional[float] = None
+    # Capture ticks during the clip: frames stored, skipped as duplicates, dropped under backpressure
+    frames_encoded: int = 0
+    frames_skipped: int = 0
+    frames_dropped: int = 0
+
+    def covers(self, moment):
+        return self.start <= moment and (self.end is None or moment <= self.end)
+
+    def frame_stats(self):
+        return {
+            'frames_encoded': self.frames_encoded,
+            'frames_skipped': self.frames_skipped,
+            'frames_dropped': self.frames_dropped,
+        }
+
+
+@dataclass
+class QueuedFrame:
+    captured_at: float
+    # None for a frame identical to the previous one: only its time is passed on
+    buffer: Optional[np.ndarray]
+    # First frame of a new segment, never dropped so that every segment starts with a stored frame
+    new_segment: bool = False
+
+
+DROP_POLICIES = ('drop_oldest', 'drop_newest')
+
+# Used for clips when `clip_fourcc` (avc1 needs an H.264 encoder) is not available in the OpenCV build
+CLIP_FALLBACK_FOURCC = 'mp4v'
+
+
+class FrameQueue:
+    """
+    Queue between the capture and encoder threads, bounded by a pool of `size`
+    reusable frame buffers: a buffer is either free, queued or being encoded.
+    """
+
+    def __init__(self, size, policy='drop_oldest'):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.size = max(2, size)
+        self.policy = policy
+        self._items = deque()
+        self._free = []
+        self._allocated = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, shape):
+        """
+        Returns (buffer, dropped frame or None). The buffer is None when the
+        frame about to be captured must be dropped (drop_newest, or nothing
+        else can be dropped).
+        """
+        with self._condition:
+            if self._free:
+                return self._free.pop(), None
+            if self._allocated < self.size:
+                self._allocated += 1
+                return np.empty(shape, dtype=np.uint8), None
+            if self.policy == 'drop_oldest':
+                for item in self._items:
+                    if item.buffer is not None and not item.new_segment:
+                        self._items.remove(item)
+                        return item.buffer, item
+            return None, None
+
+    def put(self, item):
+        with self._condition:
+            self._items.append(item)
+            self._condition.notify_all()
+
+    def get(self):
+        """Next frame to encode, or None once the queue is closed and empty."""
+        with self._condition:
+            while not self._items and not self._closed:
+                self._condition.wait()
+            return self._items.popleft() if self._items else None
+
+    def release(self, buffer):
+        with self._condition:
+            self._free.append(buffer)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def depth(self):
+        with self._condition:
+            return len(self._items)
+
+
+class SharedRecorder:
+    """
+    Records the screen continuously while at least one clip is active (and for
+    `idle_timeout` seconds after the last one), keeping `retention` seconds of
+    closed segments that are not needed by a pending clip.
+    Times are time.monotonic() values.
+    """
+
+    def __init__(self, grabber, fps=20.0, segment_seconds=10.0, retention=120.0, idle_timeout=3.0,
+                 segment_fourcc='MJPG', clip_fourcc='avc1', directory=None, duplicate_tolerance=0.0,
+                 pixel_threshold=8, queue_size=8, drop_policy='drop_oldest'):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.grabber = grabber
+        self.fps = fps
+        # Frame buffers between capture and encoding, and which frame is lost when they are all in use
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        # Fraction of sampled pixels allowed to change for a frame to still count as a duplicate
+        self.duplicate_tolerance = duplicate_tolerance
+        # Minimum per-channel difference for a sampled pixel to count as changed (tolerance > 0 only)
+        self.pixel_threshold = pixel_threshold
+        self.segment_seconds = segment_seconds
+        self.retention = retention
+        self.idle_timeout = idle_timeout
+        self.segment_fourcc = segment_fourcc
+        self.clip_fourcc = clip_fourcc
+        self.directory = directory or tempfile.mkdtemp(prefix="screen_segments_")
+
+        self._condition = threading.Condition()
+        self._segments: List[Segment] = []
+        self._clips = {}
+        self._thread: Optional[threading.Thread] = None
+        # Set by the capture thread once it decided to stop: a new clip then needs a new thread
+        self._stopping = False
+        self._rotate_requested = False
+        self._covered_until = 0.0
+        self._last_activity = time.monotonic()
+        self._previous_frame = None
+        self._frames: Optional[FrameQueue] = None
+        self.frames_captured = 0
+        self.frames_encoded = 0
+        self.frames_skipped = 0
+        self.frames_dropped = 0
+        # Time spent capturing, and the part of it when no clip was active (waiting for idle_timeout)
+        self.capture_seconds = 0.0
+        self.idle_seconds = 0.0
+
+    # Clip API used by the endpoints
+
+    def begin(self) -> Clip:
+        """Starts a clip at the current time, starting the capture thread if needed."""
+        with self._condition:
+            clip = Clip(id=str(uuid.uuid4()), start=time.monotonic())
+            self._clips[clip.id] = clip
+            self._last_activity = clip.start
+            if self._thread is None or not self._thread.is_alive() or self._stopping:
+                # A stopping thread is still finishing its last segment: the new one waits for it
+                previous = self._thread if self._stopping else None
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, args=(previous,), name="shared-screen-recorder",
+                                                daemon=True)
+                self._thread.start()
+            return clip
+
+    def end(self, clip: Clip, post_roll=0.0):
+        """Marks the end of a clip, `post_roll` seconds from now."""
+        with self._condition:
+            clip.end = time.monotonic() + max(0.0, post_roll)
+            self._last_activity = max(self._last_activity, clip.end)
+
+    def discard(self, clip: Clip):
+        """Forgets a clip without extracting it."""
+        with self._condition:
+            self._clips.pop(clip.id, None)
+            self._condition.notify_all()
+
+    def extract(self, clip: Clip, output_path, timeout=None) -> bool:
+        """
+        Waits until the clip's time range has been captured, then writes it to
+        `output_path`. Returns False if no frame was captured in that range.
+        """
+        if clip.end is None:
+            self.end(clip)
+        deadline = time.monotonic() + (timeout if timeout is not None else (clip.end - time.monotonic()) + 10.0)
+        with self._condition:
+            # Wait for a frame past the end of the clip, then for the segments covering it to be closed
+            while self._is_running() and self._covered_until < clip.end and time.monotonic() < deadline:
+                self._condition.wait(timeout=0.1)
+            while self._is_running() and time.monotonic() < deadline and \
+                    not all(s.closed for s in self._overlapping(clip)):
+                self._rotate_requested = True
+                self._condition.wait(timeout=0.1)
+            segments = [s for s in self._overlapping(clip) if s.closed]
+
+        try:
+            return self._write_clip(segments, clip, output_path)
+        finally:
+            self.discard(clip)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'running': self._is_running(),
+                'fps': self.fps,
+                'segments': len(self._segments),
+                'frames_captured': self.frames_captured,
+                'frames_encoded': self.frames_encoded,
+                'frames_skipped': self.frames_skipped,
+                'frames_dropped': self.frames_dropped,
+                'capture_seconds': round(self.capture_seconds, 3),
+                'idle_seconds': round(self.idle_seconds, 3),
+                'idle_timeout': self.idle_timeout,
+                'queue_size': self.queue_size,
+                'queue_depth': self._frames.depth() if self._frames is not None else 0,
+                'drop_policy': self.drop_policy,
+            }
+
+    def stop(self):
+        with self._condition:
+            self._clips.clear()
+            self._last_activity = 0.0
+            thread = self._thread
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    # Internals
+
+    def _is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _overlapping(self, clip):
+        return [s for s in self._segments
+                if s.frame_times and s.start <= clip.end and s.end >= clip.start]
+
+    def _is_duplicate(self, frame):
+        """Compares the frame with the previous stored one, keeping a copy of it if it changed."""
+        previous = self._previous_frame
+        if previous is not None and previous.shape == frame.shape:
+            if self.duplicate_tolerance <= 0:
+                if np.array_equal(previous, frame):
+                    return True
+            else:
+                # Compare a subsampled grid: enough to detect UI changes for a fraction of the cost
+                diff = cv2.absdiff(previous[::4, ::4], frame[::4, ::4])
+                changed = np.count_nonzero(diff.max(axis=2) > self.pixel_threshold)
+                if changed <= self.duplicate_tolerance * diff.shape[0] * diff.shape[1]:
+                    return True
+        if previous is None or previous.shape != frame.shape:
+            self._previous_frame = frame.copy()
+        else:
+            np.copyto(previous, frame)
+        return False
+
+    def _should_stop(self, now):
+        return not self._clips and now - self._last_activity > self.idle_timeout
+
+    def _open_segment(self, now, frame):
+        path = os.path.join(self.directory, f"segment_{int(now * 1000)}_{uuid.uuid4().hex[:8]}.avi")
+        height, width = frame.shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.segment_fourcc), self.fps, (width, height), isColor=True)
+        segment = Segment(path=path, start=now)
+        with self._condition:
+            self._segments.append(segment)
+        return segment, writer
+
+    def _close_segment(self, segment, writer):
+        writer.release()
+        with self._condition:
+            segment.closed = True
+            self._prune()
+            self._condition.notify_all()
+
+    def _prune(self):
+        """Deletes closed segments older than the retention window that no pending clip needs."""
+        horizon = time.monotonic() - self.retention
+        oldest_needed = min((c.start for c in self._clips.values()), default=None)
+        kept = []
+        for segment in self._segments:
+            expired = segment.closed and segment.end < horizon
+            needed = oldest_needed is not None and segment.end >= oldest_needed
+            if expired and not needed:
+                try:
+                    os.remove(segment.path)
+                except OSError:
+                    pass
+            else:
+                kept.append(segment)
+        self._segments = kept
+
+    def _count(self, moment, counter):
+        """Adds a capture tick at `moment` to the recorder's and the covering clips' `counter`. Lock held."""
+        setattr(self, counter, getattr(self, counter) + 1)
+        for clip in self._clips.values():
+            if clip.covers(moment):
+                setattr(clip, counter, getattr(clip, counter) + 1)
+
+    def _run(self, previous=None):
+        """Capture thread: grabs frames at `fps` and queues them for the encoder thread."""
+        if previous is not None:
+            previous.join()
+        frames = FrameQueue(self.queue_size, self.drop_policy)
+        encoder = threading.Thread(target=self._encode, args=(frames,), name="shared-screen-encoder", daemon=True)
+        with self._condition:
+            self._frames = frames
+        encoder.start()
+        interval = 1.0 / self.fps
+        next_tick = time.monotonic()
+        width, height = self.grabber.size()
+        shape = (height, width, 3)
+        segment_start = None
+        rotate = False
+        previous_tick = None
+        # Store the next frame even if it looks like the previous one (after a drop or at a segment start)
+        force_store = True
+        try:
+            while True:
+                now = time.monotonic()
+                if next_tick > now:
+                    time.sleep(next_tick - now)
+                    now = time.monotonic()
+                # Schedule against the clock; if capture fell behind, skip the missed ticks
+                next_tick = max(next_tick + interval, now)
+
+                with self._condition:
+                    if self._should_stop(now):
+                        self._stopping = True
+                        break
+                    if previous_tick is not None:
+                        self.capture_seconds += now - previous_tick
+                        if not any(clip.covers(now) for clip in self._clips.values()):
+                            self.idle_seconds += now - previous_tick
+                    previous_tick = now
+                    rotate = rotate or self._rotate_requested
+                    self._rotate_requested = False
+
+                buffer, dropped = frames.acquire(shape)
+                if buffer is None:
+                    # Every buffer is waiting for the encoder: this frame is lost
+                    with self._condition:
+                        self._count(now, 'frames_dropped')
+                    force_store = True
+                    continue
+                if dropped is not None:
+                    with self._condition:
+                        self._count(dropped.captured_at, 'frames_dropped')
+                    force_store = True
+
+                frame = self.grabber.grab(out=buffer)
+                captured_at = time.monotonic()
+                if frame is not buffer:
+                    # The buffer has the previous screen size: the new array grab() returned takes its place
+                    buffer = frame
+                # A segment file has a single frame size: a new one starts when the screen size changes
+                resized = frame.shape != shape
+                shape = frame.shape
+                new_segment = (segment_start is None or rotate or resized
+                               or captured_at - segment_start >= self.segment_seconds)
+                # Every segment starts with a stored frame so that it can be decoded on its own
+                duplicate = self._is_duplicate(buffer) and not (new_segment or force_store)
+                force_store = False
+                if new_segment:
+                    segment_start, rotate = captured_at, False
+                if duplicate:
+                    frames.release(buffer)
+                    buffer = None
+                with self._condition:
+                    self.frames_captured += 1
+                frames.put(QueuedFrame(captured_at, buffer, new_segment))
+        except Exception as e:
+            logger.error(f"Shared screen recorder stopped: {str(e)}")
+            with self._condition:
+                self._stopping = True
+        finally:
+            # The encoder finishes the frames already queued, then closes the last segment
+            frames.close()
+            encoder.join()
+            self._previous_frame = None
+            with self._condition:
+                self._frames = None
+                self._condition.notify_all()
+
+    def _encode(self, frames):
+        """Encoder thread: writes the queued frames into segments and records their capture times."""
+        segment, writer = None, None
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                if item.new_segment and segment is not None:
+                    self._close_segment(segment, writer)
+                    segment, writer = None, None
+                if segment is None:
+                    if item.buffer is None:
+                        # Only a stored frame can start a segment (new_segment frames always are)
+                        continue
+                    segment, writer = self._open_segment(item.captured_at, item.buffer)
+                if item.buffer is not None:
+                    writer.write(item.buffer)
+                    frames.release(item.buffer)
+                with self._condition:
+                    if item.buffer is not None:
+                        self._count(item.captured_at, 'frames_encoded')
+                        segment.frame_times.append(item.captured_at)
+                    else:
+                        self._count(item.captured_at, 'frames_skipped')
+                    segment.end = item.captured_at
+                    self._covered_until = item.captured_at
+                    self._condition.notify_all()
+        except Exception as e:
+            logger.error(f"Shared screen encoder stopped: {str(e)}")
+            # Let the capture thread stop too instead of filling the queue
+            with self._condition:
+                self._clips.clear()
+                self._last_activity = 0.0
+        finally:
+            if segment is not None:
+                self._close_segment(segment, writer)
+            with self._condition:
+                self._condition.notify_all()
+
+    def _stored_frames(self, segments):
+        """Yields (capture time, frame) for every stored frame of the segments, in order."""
+        for segment in segments:
+            reader = cv2.VideoCapture(segment.path)
+            try:
+                for frame_time in segment.frame_times:
+                    ok, frame = reader.read()
+                    if not ok:
+                        break
+                    yield frame_time, frame
+            finally:
+                reader.release()
+
+    def _open_clip_writer(self, output_path, width, height):
+        """A writer for `clip_fourcc`, or for mp4v if that codec is missing."""
+        for fourcc in dict.fromkeys((self.clip_fourcc, CLIP_FALLBACK_FOURCC)):
+            writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), self.fps, (width, height),
+                                     isColor=True)
+            if writer.isOpened():
+                return writer
+            writer.release()
+            logger.warning(f"Cannot write {output_path} with the {fourcc} codec")
+        raise RuntimeError(f"Cannot open a video writer for {output_path} "
+                           f"(tried the {self.clip_fourcc} and {CLIP_FALLBACK_FOURCC} codecs)")
+
+    def _write_clip(self, segments, clip, output_path):
+        """
+        Writes the clip at a constant frame rate, repeating the last stored frame
+        between changes. The clip has the size of its first frame: frames stored
+        after a resolution change are scaled to it (the writer would drop them).
+        """
+        interval = 1.0 / self.fps
+        frames = self._stored_frames(segments)
+        upcoming = next(frames, None)
+        current = None
+        size = None
+        out = None
+        written = 0
+        try:
+            tick = clip.start
+            while tick <= clip.end:
+                while upcoming is not None and upcoming[0] <= tick:
+                    current = upcoming[1]
+                    if size is None:
+                        size = (current.shape[1], current.shape[0])
+                    elif (current.shape[1], current.shape[0]) != size:
+                        current = cv2.resize(current, size, interpolation=cv2.INTER_AREA)
+                    upcoming = next(frames, None)
+                if current is None and upcoming is not None:
+                    # Recording started after the clip: begin with the first captured frame
+                    tick = upcoming[0]
+                    continue
+                if current is None:
+                    break
+                if out is None:
+                    out = self._open_clip_writer(output_path, *size)
+                out.write(current)
+                written += 1
+                tick += interval
+        finally:
+            frames.close()
+            if out is not None:
+                out.release()
+        return written > 0
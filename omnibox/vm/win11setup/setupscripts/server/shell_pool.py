@@ -0,0 +1,329 @@
+"""
+Pool of long-lived shell sessions used by /execute_powershell.
+
+Starting PowerShell and loading its profile costs far more than most of the
+commands the agent runs, so a few sessions are started ahead of time and
+reused. Each command is written to the session's stdin on a single line,
+followed by sentinel markers printed on stdout (with the exit code) and on
+stderr, which is how the output of consecutive commands is told apart.
+Sessions are recycled after `max_commands` commands, after a failed command,
+after a command that was sent input, or when they die (for example when a
+job is killed).
+
+Commands do not change the session for the next ones: the working directory,
+environment variables and variables set by a command are not kept (bash runs
+each command in a subshell; PowerShell runs it in a child scope and restores
+the location and the environment). Only what PowerShell makes global on
+purpose ($global: variables, imported modules) stays in the session.
+
+PowerShell (powershell, pwsh) and POSIX shells (bash, sh) are supported, so
+the pool can be exercised on Linux with bash as a stand-in.
+"""
+import base64
+import codecs
+import io
+import logging
+import os
+import subprocess
+import threading
+import uuid
+
+logger = logging.getLogger('werkzeug')
+
+
+def is_powershell(executable):
+    name = os.path.basename(executable).lower()
+    return 'powershell' in name or 'pwsh' in name
+
+
+def shell_command_line(executable, command):
+    """Command line running a single command in a fresh shell process."""
+    if is_powershell(executable):
+        return [executable, '-Command', command]
+    return [executable, '-c', command]
+
+
+class _RunningCommand:
+    def __init__(self, token, on_output, on_done):
+        self.token = token
+        self.on_output = on_output
+        self.on_done = on_done
+        self.returncode = None
+        self.streams_done = set()
+
+
+class ShellSession:
+    """A shell process reading framed commands from its stdin, one at a time."""
+
+    def __init__(self, executable, encoding):
+        self.executable = executable
+        self.encoding = encoding
+        self.powershell = is_powershell(executable)
+        if self.powershell:
+            command_line = [executable, '-NoLogo', '-Command', '-']
+        else:
+            command_line = [executable]
+        self.process = subprocess.Popen(
+            command_line,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self.commands_run = 0
+        self.broken = False
+        self._current = None
+        self._lock = threading.Lock()
+        for stream, name in ((self.process.stdout, 'stdout'), (self.process.stderr, 'stderr')):
+            threading.Thread(target=self._read, args=(stream, name), daemon=True).start()
+
+    def alive(self):
+        return not self.broken and self.process.poll() is None
+
+    def run(self, command, on_output, on_done):
+        """
+        Runs a command. on_output(stream_name, text) receives the output as it
+        arrives and on_done(returncode) is called once the command finished.
+        """
+        token = f"__OCU_DONE_{uuid.uuid4().hex}__"
+        with self._lock:
+            if self._current is not None:
+                raise RuntimeError("Shell session is busy")
+            self._current = _RunningCommand(token, on_output, on_done)
+            self.commands_run += 1
+        try:
+            self.process.stdin.write(self._frame(command, token).encode(self.encoding))
+            self.process.stdin.flush()
+        except OSError as e:
+            logger.error(f"Failed to send command to shell session: {str(e)}")
+            self.broken = True
+            self.process.kill()
+
+    def write_input(self, text):
+        """
+        Writes to the stdin of the running command, which is also the shell's
+        own stdin: whatever the command does not read would run as the next
+        command, so the session is never reused after that.
+        """
+        self.broken = True
+        self.process.stdin.write(text.encode(self.encoding))
+        self.process.stdin.flush()
+
+    def kill(self):
+        """Kills the shell and finishes the running command right away with the shell's exit code."""
+        self.broken = True
+        self.process.kill()
+        returncode = self.process.wait()
+        with self._lock:
+            current = self._current
+            self._current = None
+        if current is not None:
+            current.returncode = returncode
+            current.on_done(returncode)
+        return returncode
+
+    def close(self):
+        self.broken = True
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+    def _frame(self, command, token):
+        """Wraps a command so that it runs in its own scope and is followed by the sentinels."""
+        if self.powershell:
+            # Base64 keeps quotes, newlines and non-ASCII characters intact on a single line
+            encoded = base64.b64encode(command.encode('utf-8')).decode('ascii')
+            # Out-Default formats the output before the sentinel is written (the host would format it
+            # later, possibly after the sentinel), and the location and environment variables are
+            # restored afterwards, like the bash subshell does
+            return (
+                "$global:LASTEXITCODE = 0; $__ocu_ok = $true; "
+                "Push-Location -StackName __ocu; $__ocu_env = [Environment]::GetEnvironmentVariables(); "
+                "try { & ([scriptblock]::Create([Text.Encoding]::UTF8.GetString("
+                f"[Convert]::FromBase64String('{encoded}')))) | Out-Default; $__ocu_ok = $? }} "
+                "catch { $__ocu_ok = $false; [Console]::Error.WriteLine($_) } "
+                "finally { Pop-Location -StackName __ocu; "
+                "foreach ($__ocu_name in @([Environment]::GetEnvironmentVariables().Keys)) { "
+                "if (-not $__ocu_env.Contains($__ocu_name)) { [Environment]::SetEnvironmentVariable($__ocu_name, $null) } }; "
+                "foreach ($__ocu_entry in $__ocu_env.GetEnumerator()) { "
+                "[Environment]::SetEnvironmentVariable($__ocu_entry.Key, $__ocu_entry.Value) } }; "
+                "$__ocu_code = if ($global:LASTEXITCODE) { $global:LASTEXITCODE } "
+                "elseif ($__ocu_ok) { 0 } else { 1 }; "
+                f"[Console]::Out.Write(\"`n{token} $__ocu_code`n\"); "
+                f"[Console]::Error.Write(\"`n{token}`n\")\n"
+            )
+        escaped = command.replace("'", "'\\''")
+        # A subshell keeps cd, variables and exit from leaking into the session
+        return (
+            f"( eval '{escaped}' ); __ocu_code=$?; "
+            f"printf '\\n%s %s\\n' '{token}' \"$__ocu_code\"; "
+            f"printf '\\n%s\\n' '{token}' >&2\n"
+        )
+
+    def _read(self, stream, name):
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(self.encoding)(errors='replace'), translate=True)
+        pending = ''
+        try:
+            while True:
+                data = stream.read1(65536)
+                if not data:
+                    break
+                pending = self._dispatch(name, pending + decoder.decode(data))
+            pending += decoder.decode(b'', final=True)
+        except (OSError, ValueError):
+            pass
+        self._stream_closed(name, pending)
+
+    def _dispatch(self, name, pending):
+        """Forwards output to the running command until its sentinel. Returns the text held back."""
+        with self._lock:
+            current = self._current
+        if current is None:
+            # Output outside of any command (e.g. a late background job): nothing to attach it to
+            return ''
+        marker = '\n' + current.token
+        index = pending.find(marker)
+        if index == -1:
+            # Hold back only a suffix that could be the beginning of the marker
+            held = 0
+            for length in range(min(len(marker) - 1, len(pending)), 0, -1):
+                if marker.startswith(pending[-length:]):
+                    held = length
+                    break
+            emitted = pending[:len(pending) - held]
+            if emitted:
+                current.on_output(name, emitted)
+            return pending[len(pending) - held:]
+
+        line_end = pending.find('\n', index + len(marker))
+        if index > 0:
+            current.on_output(name, pending[:index])
+        if line_end == -1:
+            # Wait for the rest of the sentinel line
+            return pending[index:]
+        if name == 'stdout':
+            try:
+                current.returncode = int(pending[index + len(marker):line_end].strip())
+            except ValueError:
+                current.returncode = 1
+        self._stream_done(current, name)
+        return ''
+
+    def _stream_done(self, current, name):
+        with self._lock:
+            current.streams_done.add(name)
+            finished = len(current.streams_done) == 2 and self._current is current
+            if finished:
+                self._current = None
+        if finished:
+            current.on_done(current.returncode)
+
+    def _stream_closed(self, name, pending):
+        """The shell closed a stream: it exited, finish the running command with its exit code."""
+        self.broken = True
+        with self._lock:
+            current = self._current
+        if current is None or name in current.streams_done:
+            return
+        if pending:
+            current.on_output(name, pending)
+        if current.returncode is None:
+            try:
+                current.returncode = self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                current.returncode = -1
+        self._stream_done(current, name)
+
+
+class ShellPool:
+    """Keeps up to `size` idle warm sessions and hands them out to commands."""
+
+    def __init__(self, executable, size, max_commands, encoding):
+        self.executable = executable
+        self.size = size
+        self.max_commands = max_commands
+        self.encoding = encoding
+        self._idle = []
+        self._starting = 0
+        self._lock = threading.Lock()
+        self.sessions_started = 0
+        self.sessions_recycled = 0
+        self.commands_run = 0
+        self._replenish()
+
+    def run(self, command, on_output, on_done):
+        """Runs a command on a warm session (or a new one if none is idle) and returns the session."""
+        session = self._acquire()
+
+        def done(returncode):
+            self._release(session, returncode)
+            on_done(returncode)
+
+        session.run(command, on_output, done)
+        return session
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executable': self.executable,
+                'size': self.size,
+                'idle': len(self._idle),
+                'sessions_started': self.sessions_started,
+                'sessions_recycled': self.sessions_recycled,
+                'commands_run': self.commands_run,
+            }
+
+    def _start_session(self):
+        session = ShellSession(self.executable, self.encoding)
+        with self._lock:
+            self.sessions_started += 1
+        return session
+
+    def _acquire(self):
+        with self._lock:
+            self.commands_run += 1
+            while self._idle:
+                session = self._idle.pop()
+                if session.alive():
+                    break
+                self.sessions_recycled += 1
+            else:
+                session = None
+        if session is None:
+            session = self._start_session()
+        self._replenish()
+        return session
+
+    def _release(self, session, returncode):
+        reuse = session.alive() and returncode == 0 and session.commands_run < self.max_commands
+        with self._lock:
+            if reuse and len(self._idle) < self.size:
+                self._idle.append(session)
+                return
+            self.sessions_recycled += 1
+        # A broken session may still have input waiting on its stdin: no graceful exit
+        threading.Thread(target=session.kill if session.broken else session.close, daemon=True).start()
+        self._replenish()
+
+    def _replenish(self):
+        """Starts sessions in the background until `size` of them are idle."""
+        def fill():
+            while True:
+                with self._lock:
+                    if len(self._idle) + self._starting >= self.size:
+                        return
+                    self._starting += 1
+                try:
+                    session = self._start_session()
+                except OSError as e:
+                    logger.error(f"Failed to start shell session {self.executable}: {str(e)}")
+                    return
+                finally:
+                    with self._lock:
+                        self._starting -= 1
+                with self._lock:
+                    self._idle.append(session)
+
+        threading.Thread(target=fill, daemon=True).start()
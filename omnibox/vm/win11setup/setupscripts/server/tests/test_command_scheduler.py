@@ -0,0 +1,53 @@
+import threading
+
+import command_scheduler
+
+
+def blocked_scheduler(max_workers=1, max_queue=1):
+    """A scheduler whose workers all wait on the returned event."""
+    scheduler = command_scheduler.CommandScheduler(threading.Lock(), max_workers, max_queue)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def block():
+        started.release()
+        release.wait(10)
+
+    futures = [scheduler.submit(False, block) for _ in range(max_workers)]
+    for _ in futures:
+        assert started.acquire(timeout=5)
+    return scheduler, release, futures
+
+
+def test_submit_returns_none_when_the_queue_is_full():
+    scheduler, release, futures = blocked_scheduler(max_workers=1, max_queue=1)
+    try:
+        queued = scheduler.submit(False, lambda: 'queued')
+        assert queued is not None
+        # The queue is shared by both lanes
+        assert scheduler.submit(False, lambda: 'rejected') is None
+        assert scheduler.submit(True, lambda: 'rejected') is None
+        stats = scheduler.stats()
+        assert stats['queue_depth'] == 1 and stats['rejected'] == 2
+    finally:
+        release.set()
+    assert queued.result(5) == 'queued'
+    assert scheduler.submit(True, lambda: 'accepted').result(5) == 'accepted'
+    assert scheduler.stats()['completed'] == 3
+
+
+def test_headless_commands_run_in_parallel():
+    scheduler, release, futures = blocked_scheduler(max_workers=3, max_queue=1)
+    try:
+        assert scheduler.stats()['running'] == {'gui': 0, 'headless': 3}
+    finally:
+        release.set()
+    for future in futures:
+        future.result(5)
+
+
+def test_gui_commands_hold_the_gui_lock():
+    gui_lock = threading.Lock()
+    scheduler = command_scheduler.CommandScheduler(gui_lock, 1, 1)
+    assert scheduler.submit(True, gui_lock.locked).result(5)
+    assert not scheduler.submit(False, gui_lock.locked).result(5)
@@ -0,0 +1,77 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+import file_archive
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'small.txt').write_bytes(b'small')
+    (root / 'sub' / 'big.bin').write_bytes(b'x' * 1000)
+    return root
+
+
+def members(data, archive_format):
+    if archive_format == 'zip':
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        return {m.name: archive.extractfile(m).read() for m in archive.getmembers() if m.isfile()}
+
+
+@pytest.mark.parametrize('archive_format', ['tar', 'zip'])
+def test_no_size_limit_by_default(tree, archive_format):
+    stats = {}
+    data = b''.join(file_archive.iter_archive(str(tree), archive_format, stats=stats))
+    assert members(data, archive_format) == {'small.txt': b'small', 'sub/big.bin': b'x' * 1000}
+    assert stats['files'] == 2
+    assert stats['files_skipped'] == 0
+    assert stats['bytes'] == len(data)
+
+
+@pytest.mark.parametrize('archive_format', ['tar', 'zip'])
+def test_files_over_the_limit_are_listed(tree, archive_format):
+    stats = {}
+    errors = []
+    data = b''.join(file_archive.iter_archive(str(tree), archive_format, max_file_size=100,
+                                              on_error=lambda path, reason: errors.append(path), stats=stats))
+    content = members(data, archive_format)
+    assert set(content) == {'small.txt', file_archive.SKIPPED_LIST}
+    assert content[file_archive.SKIPPED_LIST].decode('utf-8').startswith('sub/big.bin\t1000 bytes')
+    assert errors == [str(tree / 'sub' / 'big.bin')]
+    assert stats['files'] == 1
+    assert stats['files_skipped'] == 1
+
+
+def test_extract_round_trip(tree, tmp_path):
+    data = b''.join(file_archive.iter_archive(str(tree), 'tar', compress=True))
+    stats = file_archive.extract_archive(io.BytesIO(data), str(tmp_path / 'out'))
+    assert (tmp_path / 'out' / 'sub' / 'big.bin').read_bytes() == b'x' * 1000
+    assert stats == {'files': 2, 'bytes': 1005}
+
+
+def names(data, archive_format):
+    if archive_format == 'zip':
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return set(archive.namelist())
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        return {m.name + '/' if m.isdir() else m.name for m in archive.getmembers()}
+
+
+@pytest.mark.parametrize('archive_format', ['tar', 'zip'])
+def test_empty_directories_are_kept(tree, tmp_path, archive_format):
+    (tree / 'empty' / 'nested').mkdir(parents=True)
+    stats = {}
+    data = b''.join(file_archive.iter_archive(str(tree), archive_format, stats=stats))
+    assert names(data, archive_format) == {'small.txt', 'sub/big.bin', 'empty/nested/'}
+    assert stats['files'] == 2 and stats['directories'] == 1
+    file_archive.extract_archive(io.BytesIO(data), str(tmp_path / 'out'), archive_format)
+    assert (tmp_path / 'out' / 'empty' / 'nested').is_dir()
+    # Only the files matching include globs are archived
+    data = b''.join(file_archive.iter_archive(str(tree), archive_format, include=['*.txt']))
+    assert names(data, archive_format) == {'small.txt'}
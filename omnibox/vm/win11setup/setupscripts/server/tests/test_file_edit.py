@@ -0,0 +1,69 @@
+import pytest
+
+import file_edit
+
+
+def edit(tmp_path, content, specs, **options):
+    path = tmp_path / 'file.txt'
+    path.write_bytes(content)
+    edits = file_edit.parse_edits(specs, crlf=file_edit.uses_crlf(str(path)))
+    result = file_edit.apply_edits(str(path), edits, **options)
+    return path.read_bytes(), result, edits
+
+
+def test_regex_matches_characters(tmp_path):
+    content, result, edits = edit(tmp_path, 'café au lait\n'.encode('utf-8'), [{'regex': 'caf.', 'new_str': 'X'}])
+    assert content == b'X au lait\n'
+    assert result['written']
+    assert edits[0].occurrences == 1
+
+
+def test_regex_and_literal_edits_in_one_pass(tmp_path):
+    content, result, _ = edit(tmp_path, 'naïve crème brûlée\n'.encode('utf-8'), [
+        {'regex': r'br(\w+)', 'new_str': r'<\1>'},
+        {'old_str': 'crème', 'new_str': 'cream'},
+    ], diff=True)
+    assert content == 'naïve cream <ûlée>\n'.encode('utf-8')
+    assert result['diff'] == '@@ -1,1 +1,1 @@\n-naïve crème brûlée\n+naïve cream <ûlée>\n'
+
+
+def test_invalid_utf8_is_kept(tmp_path):
+    content, _, _ = edit(tmp_path, b'\xff\xfe a=1\nb=2\n', [{'regex': r'(\w)=(\d)', 'new_str': r'\2=\1'}])
+    assert content == b'\xff\xfe 1=a\n2=b\n'
+
+
+def test_literal_newlines_follow_crlf(tmp_path):
+    content, _, _ = edit(tmp_path, b'one\r\ntwo\r\nthree\r\n', [{'old_str': 'one\ntwo', 'new_str': 'A\nB\nC'}])
+    assert content == b'A\r\nB\r\nC\r\nthree\r\n'
+
+
+def test_edits_do_not_apply_to_inserted_text(tmp_path):
+    content, _, edits = edit(tmp_path, b'a b a b', [{'old_str': 'a', 'new_str': 'b'}, {'old_str': 'b', 'new_str': 'a'}])
+    assert content == b'b a b a'
+    assert [e.occurrences for e in edits] == [2, 2]
+
+
+def test_count_mismatch_leaves_file_unchanged(tmp_path):
+    with pytest.raises(ValueError):
+        edit(tmp_path, b'x x x', [{'old_str': 'x', 'new_str': 'y', 'count': 2}])
+    assert (tmp_path / 'file.txt').read_bytes() == b'x x x'
+    assert [p.name for p in tmp_path.iterdir()] == ['file.txt']
+
+
+def test_dry_run_does_not_write(tmp_path):
+    content, result, _ = edit(tmp_path, b'x\n', [{'regex': 'x', 'new_str': 'y'}], dry_run=True)
+    assert content == b'x\n'
+    assert not result['written']
+    assert result['diff'] == '@@ -1,1 +1,1 @@\n-x\n+y\n'
+
+
+@pytest.mark.parametrize('newline', [b'\n', b'\r\n'])
+def test_diff_of_a_match_ending_with_a_newline(tmp_path, newline):
+    content = newline.join([b'line 9', b'line 10', b'line 11', b''])
+    _, result, _ = edit(tmp_path, content, [{'old_str': 'line 10\n', 'new_str': 'X\n'}], dry_run=True)
+    assert result['diff'] == '@@ -2,1 +2,1 @@\n-line 10\n+X\n'
+
+
+def test_diff_of_lines_joined_by_an_edit(tmp_path):
+    _, result, _ = edit(tmp_path, b'a\nb\nc\n', [{'old_str': 'a\n', 'new_str': 'X'}], dry_run=True)
+    assert result['diff'] == '@@ -1,2 +1,1 @@\n-a\n-b\n+Xb\n'
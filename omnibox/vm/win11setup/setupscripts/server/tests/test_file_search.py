@@ -0,0 +1,83 @@
+import random
+import re
+
+import pytest
+
+import file_search
+
+
+def reference_search(path, regex, max_matches=None, context=0):
+    """Line-by-line search the chunked scanner must agree with."""
+    with open(path, encoding='utf-8', newline='') as f:
+        lines = f.read().replace('\r\n', '\n').split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    pattern = re.compile(regex)
+    records = []
+    remaining = max_matches if max_matches is not None else -1
+    for i, line in enumerate(lines):
+        if remaining == 0:
+            break
+        hits = list(pattern.finditer(line))
+        if not hits:
+            continue
+        if remaining > 0:
+            hits = hits[:remaining]
+            remaining -= len(hits)
+        record = {'line': i + 1, 'text': line, 'matches': [[h.start() + 1, h.group()] for h in hits]}
+        if context:
+            record['before'] = lines[max(0, i - context):i]
+            record['after'] = lines[i + 1:i + 1 + context]
+        records.append(record)
+    return records
+
+
+@pytest.mark.parametrize('regex', ['$', '^$', 'x*', '^'])
+@pytest.mark.parametrize('max_matches', [None, 1000])
+def test_empty_match_on_unterminated_last_line(tmp_path, regex, max_matches):
+    path = tmp_path / 'file.txt'
+    path.write_bytes(b'foo\nbar x')
+    records = list(file_search.search_file(str(path), regex, max_matches=max_matches))
+    assert records == reference_search(str(path), regex, max_matches)
+    assert [r['line'] for r in records] == sorted(set(r['line'] for r in records))
+
+
+def test_search_tree_empty_match_terminates(tmp_path):
+    (tmp_path / 'a.txt').write_bytes(b'one\ntwo')
+    (tmp_path / 'b.txt').write_bytes(b'three')
+    stats = {}
+    records = list(file_search.search_tree(str(tmp_path), '$', stats=stats))
+    assert len(records) == 3
+    assert not stats['truncated']
+
+
+def test_matches_line_by_line_search(tmp_path):
+    rng = random.Random(1)
+    words = ['foo', 'bar', 'error', '', 'ERROR x', 'erroror']
+    path = tmp_path / 'file.txt'
+    for _ in range(200):
+        lines = [' '.join(rng.choice(words) for _ in range(rng.randint(0, 4))) for _ in range(rng.randint(0, 40))]
+        separator = rng.choice(['\n', '\r\n'])
+        path.write_bytes((separator.join(lines) + rng.choice(['', separator])).encode('utf-8'))
+        regex = rng.choice(['error', 'o+', '^foo', 'bar$', 'err(or)+', '$'])
+        max_matches = rng.choice([None, 1, 3])
+        context = rng.randint(0, 2)
+        records = list(file_search.search_file(str(path), regex, max_matches=max_matches, context=context,
+                                               chunk_size=rng.choice([1, 7, 64, 4096])))
+        assert records == reference_search(str(path), regex, max_matches, context)
+
+
+def test_max_matches_reports_truncation(tmp_path):
+    path = tmp_path / 'file.txt'
+    path.write_text('hit\n' * 10)
+    stats = {}
+    records = list(file_search.search_file(str(path), 'hit', max_matches=4, stats=stats))
+    assert len(records) == 4
+    assert stats['truncated']
+
+
+@pytest.mark.parametrize('regex', [r'\Afoo', r'foo\Z', r'\A\Z', r'[\]A]\Z', r'\Ab|a\Z'])
+def test_string_anchors_apply_to_every_line(tmp_path, regex):
+    path = tmp_path / 'f.txt'
+    path.write_text('foo\nfoo\n\nbar foo\nb]A\nfoo a\n')
+    assert list(file_search.search_file(str(path), regex)) == reference_search(str(path), regex)
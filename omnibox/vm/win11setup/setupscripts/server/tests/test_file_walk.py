@@ -0,0 +1,61 @@
+import glob
+import os
+
+import pytest
+
+import file_walk
+
+TREE = [
+    'a.txt', 'b.py', '.hidden.txt',
+    'src/main.py', 'src/util.py', 'src/data/x.txt', 'src/.cache/c.py',
+    'docs/readme.txt', 'docs/deep/er/note.txt',
+]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for relative in TREE:
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(relative)
+    return tmp_path
+
+
+def walked(root, pattern, **options):
+    return ['/'.join(parts) for parts, _ in file_walk.walk(str(root), pattern, **options)]
+
+
+@pytest.mark.parametrize('pattern', ['*', '*.txt', '**', '**/*.py', 'src/*', 'src/**/*.txt', '*/*.txt',
+                                     '.*', '**/.*', 'docs/**', '?.py', '[ab].*'])
+def test_matches_glob(tree, pattern):
+    expected = sorted(os.path.relpath(p, tree).replace(os.sep, '/')
+                      for p in glob.glob(os.path.join(str(tree), pattern), recursive=True)
+                      if os.path.normpath(p) != os.path.normpath(str(tree)))
+    assert sorted(walked(tree, pattern)) == expected
+
+
+def test_cursor_resumes_after_the_last_entry(tree):
+    everything = walked(tree, '**')
+    assert everything == sorted(everything, key=file_walk.split_relative)
+    pages = []
+    cursor = None
+    while True:
+        page = walked(tree, '**', cursor=cursor)[:3]
+        if not page:
+            break
+        pages.extend(page)
+        cursor = page[-1]
+    assert pages == everything
+
+
+def test_max_depth_and_exclude(tree):
+    assert walked(tree, '**/*.txt', max_depth=1) == ['a.txt']
+    assert walked(tree, '**/*.txt', exclude=['deep', 'src']) == ['a.txt', 'docs/readme.txt']
+
+
+def test_entry_info(tree):
+    (parts, info), = file_walk.walk(str(tree), 'src/main.py')
+    assert parts == ('src', 'main.py')
+    assert info['name'] == 'main.py'
+    assert info['size'] == len('src/main.py')
+    assert not info['is_directory']
@@ -0,0 +1,73 @@
+import time
+
+import job_registry
+
+
+class Job:
+    def __init__(self, id, size=0, running=False):
+        self.id = id
+        self.size = size
+        self.running = running
+
+
+def new_registry(max_count=0, max_bytes=0, ttl=0, evicted=None):
+    on_evict = evicted.append if evicted is not None else None
+    return job_registry.JobRegistry('jobs', max_count, max_bytes, ttl,
+                                    lambda job: job.size, lambda job: job.running, on_evict)
+
+
+def test_least_recently_used_jobs_are_evicted_first():
+    evicted = []
+    registry = new_registry(max_count=2, evicted=evicted)
+    registry['a'] = Job('a')
+    registry['b'] = Job('b')
+    registry['a']  # 'b' is now the least recently used
+    registry['c'] = Job('c')
+    assert [job.id for job in evicted] == ['b']
+    assert 'a' in registry and 'c' in registry
+    assert registry.stats()['evictions'] == {'count': 1, 'bytes': 0, 'ttl': 0}
+
+
+def test_jobs_are_evicted_until_the_bytes_fit():
+    evicted = []
+    registry = new_registry(max_bytes=10, evicted=evicted)
+    registry['a'] = Job('a', size=4)
+    registry['b'] = Job('b', size=4)
+    registry['c'] = Job('c', size=8)
+    assert [job.id for job in evicted] == ['a', 'b']
+    assert registry.stats()['bytes'] == 8
+    assert registry.stats()['evictions'] == {'count': 0, 'bytes': 2, 'ttl': 0}
+
+
+def test_expired_jobs_are_evicted():
+    evicted = []
+    registry = new_registry(ttl=0.1, evicted=evicted)
+    registry['a'] = Job('a')
+    time.sleep(0.2)
+    registry['b'] = Job('b')
+    assert [job.id for job in evicted] == ['a']
+    assert registry.stats()['evictions'] == {'count': 0, 'bytes': 0, 'ttl': 1}
+
+
+def test_running_jobs_are_never_evicted():
+    evicted = []
+    registry = new_registry(max_count=1, max_bytes=1, ttl=0.1, evicted=evicted)
+    running = Job('a', size=100, running=True)
+    registry['a'] = running
+    registry['b'] = Job('b', running=True)
+    time.sleep(0.2)
+    assert registry.prune() == 0
+    assert evicted == []
+    assert len(registry) == 2
+    # Once finished, the job is evicted like any other
+    running.running = False
+    assert registry.prune() == 1
+    assert [job.id for job in evicted] == ['a']
+
+
+def test_eviction_callback_errors_are_not_raised():
+    registry = job_registry.JobRegistry('jobs', 1, 0, 0, lambda job: 0, lambda job: False,
+                                        lambda job: 1 / 0)
+    registry['a'] = Job('a')
+    registry['b'] = Job('b')
+    assert 'a' not in registry and 'b' in registry
@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+import recorder  # noqa: E402
+
+
+class FakeGrabber:
+    """A 64x48 screen whose content changes on every grab."""
+
+    def __init__(self):
+        self.count = 0
+
+    def size(self):
+        return 64, 48
+
+    def grab(self, out=None):
+        frame = out if out is not None else np.empty((48, 64, 3), dtype=np.uint8)
+        self.count += 1
+        frame[:] = self.count % 256
+        return frame
+
+
+class SlowStopRecorder(recorder.SharedRecorder):
+    """Holds the first capture thread between its decision to stop and its exit."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stopping = threading.Event()
+        self.resume = threading.Event()
+
+    def _encode(self, frames):
+        super()._encode(frames)
+        if not self.stopping.is_set():
+            self.stopping.set()
+            self.resume.wait(10)
+
+
+def new_recorder(tmp_path, cls=recorder.SharedRecorder, **options):
+    options = dict(dict(fps=50, segment_seconds=1, idle_timeout=0, segment_fourcc='MJPG', clip_fourcc='MJPG',
+                        directory=str(tmp_path / 'segments')), **options)
+    (tmp_path / 'segments').mkdir(exist_ok=True)
+    return cls(FakeGrabber(), **options)
+
+
+def record(screen_recorder, output_path, seconds=0.2):
+    clip = screen_recorder.begin()
+    time.sleep(seconds)
+    return screen_recorder.extract(clip, str(output_path), timeout=5), clip
+
+
+def test_clip_is_recorded(tmp_path):
+    screen_recorder = new_recorder(tmp_path)
+    try:
+        ok, clip = record(screen_recorder, tmp_path / 'clip.avi')
+        assert ok
+        assert clip.frames_encoded > 0
+        assert (tmp_path / 'clip.avi').stat().st_size > 0
+    finally:
+        screen_recorder.stop()
+
+
+def test_begin_while_the_capture_thread_is_stopping(tmp_path):
+    screen_recorder = new_recorder(tmp_path, SlowStopRecorder)
+    try:
+        ok, _ = record(screen_recorder, tmp_path / 'first.avi')
+        assert ok
+        # The first thread decided to stop (no clip left) but has not exited yet
+        assert screen_recorder.stopping.wait(5)
+        clip = screen_recorder.begin()
+        screen_recorder.resume.set()
+        time.sleep(0.2)
+        assert screen_recorder.stats()['running']
+        assert screen_recorder.extract(clip, str(tmp_path / 'second.avi'), timeout=5)
+        assert clip.frames_encoded > 0
+    finally:
+        screen_recorder.resume.set()
+        screen_recorder.stop()
+
+
+def test_clip_codec_falls_back_to_mp4v(tmp_path):
+    screen_recorder = new_recorder(tmp_path, clip_fourcc='XXXX')
+    try:
+        ok, _ = record(screen_recorder, tmp_path / 'clip.mp4')
+        assert ok
+        assert (tmp_path / 'clip.mp4').stat().st_size > 0
+    finally:
+        screen_recorder.stop()
+
+
+def test_clip_writer_failure_is_reported(tmp_path):
+    screen_recorder = new_recorder(tmp_path)
+    try:
+        with pytest.raises(RuntimeError, match="Cannot open a video writer"):
+            record(screen_recorder, tmp_path / 'missing' / 'clip.avi')
+    finally:
+        screen_recorder.stop()
+
+
+def test_idle_capture_is_counted(tmp_path):
+    screen_recorder = new_recorder(tmp_path, idle_timeout=0.3)
+    try:
+        ok, _ = record(screen_recorder, tmp_path / 'clip.avi')
+        assert ok
+        deadline = time.monotonic() + 5
+        while screen_recorder.stats()['running'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stats = screen_recorder.stats()
+        assert not stats['running']
+        assert 0.2 < stats['idle_seconds'] < stats['capture_seconds']
+    finally:
+        screen_recorder.stop()
+
+
+class ResizingGrabber(FakeGrabber):
+    """Switches from 64x48 to 80x60 after `switch_after` grabs."""
+
+    def __init__(self, switch_after):
+        super().__init__()
+        self.switch_after = switch_after
+
+    def size(self):
+        return (64, 48) if self.count < self.switch_after else (80, 60)
+
+    def grab(self, out=None):
+        width, height = self.size()
+        if out is None or out.shape != (height, width, 3):
+            out = np.empty((height, width, 3), dtype=np.uint8)
+        return super().grab(out)
+
+
+def test_resolution_change_during_a_clip(tmp_path):
+    screen_recorder = new_recorder(tmp_path)
+    screen_recorder.grabber = ResizingGrabber(switch_after=5)
+    try:
+        ok, clip = record(screen_recorder, tmp_path / 'clip.avi', seconds=0.4)
+        assert ok
+        reader = cv2.VideoCapture(str(tmp_path / 'clip.avi'))
+        sizes = set()
+        count = 0
+        while True:
+            read, frame = reader.read()
+            if not read:
+                break
+            sizes.add(frame.shape[:2])
+            count += 1
+        reader.release()
+        # Every frame kept, at the size of the first one
+        assert sizes == {(48, 64)}
+        assert count >= 0.8 * (clip.end - clip.start) * screen_recorder.fps
+    finally:
+        screen_recorder.stop()
@@ -0,0 +1,91 @@
+import shutil
+import threading
+import time
+
+import pytest
+
+import shell_pool
+
+pytestmark = pytest.mark.skipif(shutil.which('bash') is None, reason="bash is used as a stand-in for PowerShell")
+
+
+class Command:
+    def __init__(self):
+        self.output = {'stdout': '', 'stderr': ''}
+        self.returncode = None
+        self.finished = threading.Event()
+
+    def on_output(self, name, text):
+        self.output[name] += text
+
+    def on_done(self, returncode):
+        self.returncode = returncode
+        self.finished.set()
+
+    def wait(self):
+        assert self.finished.wait(10), "command did not finish"
+        return self
+
+
+def run(pool, command):
+    result = Command()
+    session = pool.run(command, result.on_output, result.on_done)
+    return session, result
+
+
+def wait_idle(pool, count=1):
+    deadline = time.time() + 10
+    while pool.stats()['idle'] < count and time.time() < deadline:
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def pool():
+    return shell_pool.ShellPool('bash', 1, 100, 'utf-8')
+
+
+def test_commands_run_on_warm_sessions(pool):
+    wait_idle(pool)
+    _, result = run(pool, 'echo one; echo two >&2')
+    result.wait()
+    assert result.output == {'stdout': 'one\n', 'stderr': 'two\n'}
+    assert result.returncode == 0
+    wait_idle(pool)
+    _, result = run(pool, 'exit 3')
+    assert result.wait().returncode == 3
+
+
+def test_session_is_not_reused_after_input(pool):
+    wait_idle(pool)
+    session, result = run(pool, 'read line; echo "got $line"')
+    session.write_input('hello\nsecret=1\n')
+    result.wait()
+    assert result.output['stdout'] == 'got hello\n'
+    assert result.returncode == 0
+    assert not session.alive()
+    # Killed rather than reused, with the unread line still waiting on its stdin
+    assert session.process.wait(10) is not None
+    assert pool.stats()['sessions_recycled'] == 1
+
+
+def test_commands_do_not_change_the_session(tmp_path):
+    session = shell_pool.ShellSession('bash', 'utf-8')
+    try:
+        result = Command()
+        session.run(f'cd {tmp_path}; export OCU_TEST=1; value=2', result.on_output, result.on_done)
+        result.wait()
+        result = Command()
+        session.run('pwd; echo "[$OCU_TEST][$value]"', result.on_output, result.on_done)
+        directory, variables = result.wait().output['stdout'].splitlines()
+        assert directory != str(tmp_path)
+        assert variables == '[][]'
+    finally:
+        session.close()
+
+
+def test_powershell_output_is_formatted_before_the_sentinel():
+    session = shell_pool.ShellSession.__new__(shell_pool.ShellSession)
+    session.powershell = True
+    frame = session._frame('Get-ChildItem', 'TOKEN')
+    assert frame.endswith('\n') and frame.count('\n') == 1
+    assert frame.index('| Out-Default') < frame.index('Pop-Location') < frame.index('TOKEN')
@@ -1480,7 +1480,7 @@ function getAITools(currentCapture, updateClientCallback) {
         }),
 
         file_find_in_content_tool: tool({
-            description: "Search for matching text within file content on the Windows computer",
+            description: "Search for matching text within file content on the Windows computer. At most 1000 matching lines are returned by default: when truncated is true, narrow the regex to see the rest",
             parameters: z.object({
                 situation_analysis: z.string().describe("Analysis of the current situation"),
                 reasoning: z.string().describe("Reasoning behind searching this file"),
@@ -1538,6 +1538,8 @@ function getAITools(currentCapture, updateClientCallback) {
                         toolResult: {
                             output: cleanPowerShellOutput(result.output),
                             matches: result.matches,
+                            match_count: result.match_count,
+                            truncated: result.truncated,
                             error: result.error ? cleanPowerShellOutput(result.error) : null,
                             returncode: result.returncode,
                             screen_recording_job_id: result.screen_recording_job_id
@@ -1564,6 +1566,8 @@ function getAITools(currentCapture, updateClientCallback) {
                 return {
                     output: cleanPowerShellOutput(result.output),
                     matches: result.matches,
+                    match_count: result.match_count,
+                    truncated: result.truncated,
                     error: result.error ? cleanPowerShellOutput(result.error) : null,
                     returncode: result.returncode
                 };
@@ -1571,15 +1575,16 @@ function getAITools(currentCapture, updateClientCallback) {
         }),
 
         file_find_by_name_tool: tool({
-            description: "Find files by name pattern in specified directory on the Windows computer",
+            description: "Find files by name pattern in specified directory on the Windows computer. Results come in pages (1000 entries by default): when next_cursor is returned, call again with it as cursor to get the next page",
             parameters: z.object({
                 situation_analysis: z.string().describe("Analysis of the current situation"),
                 reasoning: z.string().describe("Reasoning behind finding these files"),
                 path: z.string().describe("Absolute path of directory to search"),
                 glob: z.string().describe("Filename pattern using glob syntax wildcards"),
+                cursor: z.string().describe("next_cursor returned by the previous page, or an empty string for the first page"),
                 action_description: z.string().describe("Description of what this action will do, formatted with markdown")
             }),
-            execute: async ({ path, glob, reasoning, action_description }) => {
+            execute: async ({ path, glob, cursor, reasoning, action_description }) => {
                 console.log(`Finding files in: ${path} with pattern: ${glob}`);
 
                 // Create initial action object
@@ -1597,7 +1602,8 @@ function getAITools(currentCapture, updateClientCallback) {
                             reasoning,
                             action_description,
                             path,
-                            glob
+                            glob,
+                            cursor
                         }
                     }
                 };
@@ -1610,7 +1616,8 @@ function getAITools(currentCapture, updateClientCallback) {
                 // Execute the command using our new API
                 const response = await axios.post(`${CONFIG.VNC_SERVER_URL}/file/find_by_name`, {
                     path,
-                    glob
+                    glob,
+                    cursor: cursor || undefined
                 });
 
                 const result = response.data;
@@ -1628,6 +1635,7 @@ function getAITools(currentCapture, updateClientCallback) {
                             output: cleanPowerShellOutput(result.output),
                             files: result.files,
                             count: result.count,
+                            next_cursor: result.next_cursor,
                             error: result.error ? cleanPowerShellOutput(result.error) : null,
                             returncode: result.returncode,
                             screen_recording_job_id: result.screen_recording_job_id
@@ -1655,6 +1663,7 @@ function getAITools(currentCapture, updateClientCallback) {
                     output: cleanPowerShellOutput(result.output),
                     files: result.files,
                     count: result.count,
+                    next_cursor: result.next_cursor,
                     error: result.error ? cleanPowerShellOutput(result.error) : null,
                     returncode: result.returncode
                 };
@@ -2836,8 +2845,14 @@ async function fetchAndSaveScreenRecording(jobId, currentAction) {
             const response = await axios.get(`http://localhost:5000/job/${jobId}`, { timeout: 10000 });
             const jobData = response.data;
 
-            if (jobData.status === "completed" && jobData.screen_recording) {
-                currentAction.metadata.screen_recording_base64 = `data:video/mp4;base64,${jobData.screen_recording}`;
+            if (jobData.status === "completed" && jobData.screen_recording_url) {
+                // The recording is streamed separately from the job metadata
+                const videoResponse = await axios.get(`http://localhost:5000${jobData.screen_recording_url}`, {
+                    responseType: "arraybuffer",
+                    timeout: 30000,
+                });
+                const videoBase64 = Buffer.from(videoResponse.data, "binary").toString("base64");
+                currentAction.metadata.screen_recording_base64 = `data:video/mp4;base64,${videoBase64}`;
                 break;
             } else if (jobData.status === "failed") {
                 console.error(`Failed to retrieve video for job ${jobId}`);